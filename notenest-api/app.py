@@ -2,23 +2,91 @@
 
 from flask import Flask
 from app.config.db import init_app, db
+from app.config.replicas import replica_router
+from app.config.shards import shard_router
 from app.api.user import ruta_user
 from app.api.note import ruta_note
 from app.api.session import ruta_session
 from app.api.comment import ruta_comment
+from app.api.blob import ruta_blob
+from app.api.sync import ruta_sync
+from app.api.events import ruta_events
+from app.api.metrics import ruta_metrics
+from app.api.profiles import ruta_profiles
+from app.api.stats import ruta_stats
+from app.commands import register_commands
+from app.utils.query_stats import init_query_stats
+from app.utils.metrics import init_metrics
+from app.utils.logs import init_logging
+from app.utils.note_cleanup import note_cleanup_worker
+from app.utils.user_directory import user_directory
+from app.utils.blob_store import blob_store
+from app.utils.previews import preview_pipeline
+from app.utils.profiler import profiler
+from app.utils.idempotency import idempotency_store
+from app.utils.entity_cache import entity_cache
+from app.utils.trending import trending_notes
+from app.utils.like_index import like_index
+from app.utils.events import event_hub
+from app.utils.bootstrap import bootstrap_cache
+from app.utils.autosave import note_autosave
+from app.utils.usage_stats import usage_stats
+from app.utils.schema_upgrade import upgrade_schema
 
-def create_app():
+def create_app(config=None):
+    """
+    Crea la aplicación. `config` permite sobrescribir la configuración antes de
+    conectar (por ejemplo SQLALCHEMY_DATABASE_URI y MONGO_DB en los benchmarks).
+    """
+    init_logging()  # Registro en JSON desde un hilo en segundo plano
     app = Flask(__name__)
+    if config:
+        app.config.update(config)
+    init_query_stats(app)  # Debe ir antes de crear el cliente de MongoDB
+    metrics_enabled = init_metrics(app)  # Usa los tiempos de init_query_stats
+    profiling_enabled = profiler.init_app(app)  # Solo con PROFILE_EVERY o PROFILE_SECRET
     init_app(app)  # Inicializa MySQL y MongoDB
+    blob_store.init_app(app)  # Almacén local de archivos adjuntos
+    preview_pipeline.init_app(app)  # Miniaturas y vistas previas en segundo plano
+    idempotency_store.init_app(app)  # Respuestas guardadas por Idempotency-Key
+    event_hub.init_app(app)  # Difusión de cambios por /events
+    entity_cache.init_app(app)  # Instantáneas de notas, usuarios, comentarios y sesiones por id
+    bootstrap_cache.init_app(app)  # Instantáneas de arranque de dispositivos en disco
 
     # Registrar blueprints
     app.register_blueprint(ruta_user, url_prefix="/api")
     app.register_blueprint(ruta_note, url_prefix="/api")
     app.register_blueprint(ruta_session, url_prefix="/api")
     app.register_blueprint(ruta_comment, url_prefix="/api")
+    app.register_blueprint(ruta_blob, url_prefix="/api")
+    app.register_blueprint(ruta_sync, url_prefix="/api")
+    app.register_blueprint(ruta_events, url_prefix="/api")
+    app.register_blueprint(ruta_stats, url_prefix="/api")
+    if metrics_enabled:
+        app.register_blueprint(ruta_metrics)  # /metrics, fuera de /api
+    if profiling_enabled:
+        app.register_blueprint(ruta_profiles, url_prefix="/api")
+
+    # Comandos de mantenimiento (flask --app app <comando>)
+    register_commands(app)
 
     with app.app_context():
         db.create_all()
+        shard_router.create_all()  # Tablas repartidas en cada shard (con SQL_SHARD_URLS)
+        upgrade_schema(app.config['MONGO_DB'])  # Columnas e índices que create_all no añade a tablas existentes
+        user_directory.load()  # Índice en memoria para /users/search
+        like_index.load()  # Likes por usuario para likeNote/unlikeNote y /likedNotes
+        trending_notes.load()  # Ranking de /trendingNotes a partir de likes y comentarios
+
+    # Limpieza en segundo plano de notas eliminadas (reanuda trabajos pendientes)
+    note_cleanup_worker.init_app(app)
+    # Contadores de /stats guardados en usage_stats cada USAGE_STATS_CHECKPOINT segundos
+    # (antes que el autoguardado: al cerrar, lo que este guarde también se cuenta)
+    usage_stats.init_app(app)
+    # Escritura agrupada del autoguardado de updateNote (con NOTE_AUTOSAVE_WINDOW > 0)
+    note_autosave.init_app(app)
+    # Latido en la base principal y medida del retraso de las réplicas (con SQL_REPLICA_URLS)
+    replica_router.start(app)
 
     return app
 
@@ -0,0 +1,192 @@
+# Este archivo maneja la subida y descarga del contenido de los archivos adjuntos
+# (subidas completas o reanudables por bloques, y descargas con soporte de Range)
+
+import logging
+import os
+import traceback
+from flask import Blueprint, request, jsonify, send_file, abort
+from app.config.db import db
+from app.models.blob import Blob
+from app.utils.blob_store import blob_store, register_blob, is_blob_id, UploadError
+from app.utils.previews import preview_pipeline, thumbnail_path, preview_path
+
+# Configuración del sistema de registro para seguimiento de eventos y errores
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Crear un Blueprint de Flask para las rutas de blobs
+ruta_blob = Blueprint("route_blob", __name__)
+
+def _upload_error(error):
+    """Convierte un UploadError en respuesta JSON (con el offset actual si se conoce)."""
+    body = {"error": str(error)}
+    if error.offset is not None:
+        body["offset"] = error.offset
+    response = jsonify(body)
+    if error.offset is not None:
+        response.headers["Upload-Offset"] = str(error.offset)
+    return response, error.status
+
+def _finish(sha256, size, content_type):
+    """Registra el blob en la base de datos y arma la respuesta."""
+    blob = register_blob(sha256, size, content_type)
+    db.session.commit()
+    logger.info("📦 Blob %s listo (%d bytes)", sha256, size)
+    return jsonify(blob.to_dict()), 201
+
+# Ruta para subir un archivo completo en una sola petición
+@ruta_blob.route("/blobs", methods=["POST"])
+def upload_blob():
+    """
+    Sube el contenido de un archivo en el cuerpo de la petición
+    Cabeceras: Content-Type del archivo
+    El contenido se lee por bloques y se hashea mientras llega
+    Retorna: blobId (SHA-256) para usar en addNoteFile
+    """
+    try:
+        sha256, size, content_type = blob_store.put_stream(
+            request.stream, request.mimetype or None, request.content_length
+        )
+        return _finish(sha256, size, content_type)
+    except UploadError as e:
+        return _upload_error(e)
+    except Exception as e:
+        logger.error("❌ Error al subir blob: %s", str(e))
+        logger.debug(traceback.format_exc())
+        db.session.rollback()
+        return jsonify({"error": "Error interno del servidor"}), 500
+
+# Ruta para iniciar una subida reanudable
+@ruta_blob.route("/uploads", methods=["POST"])
+def begin_upload():
+    """
+    Crea una sesión de subida reanudable
+    Recibe (opcional): contentType y size (tamaño total en bytes)
+    Retorna: uploadId y offset inicial
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        upload_id = blob_store.begin_upload(data.get("contentType"), data.get("size"))
+        return jsonify({"uploadId": upload_id, "offset": 0}), 201
+    except UploadError as e:
+        return _upload_error(e)
+
+# Ruta para consultar el progreso de una subida
+@ruta_blob.route("/uploads/<string:upload_id>", methods=["GET", "HEAD"])
+def get_upload(upload_id):
+    """
+    Retorna cuántos bytes se han recibido de una subida
+    Útil para reanudar tras un corte de conexión
+    """
+    try:
+        info = blob_store.upload_info(upload_id)
+        response = jsonify({"uploadId": upload_id, **info})
+        response.headers["Upload-Offset"] = str(info["offset"])
+        return response, 200
+    except UploadError as e:
+        return _upload_error(e)
+
+# Ruta para enviar un bloque de una subida
+@ruta_blob.route("/uploads/<string:upload_id>", methods=["PATCH"])
+def append_upload(upload_id):
+    """
+    Añade un bloque al final de una subida
+    Cabeceras: Upload-Offset con el número de bytes ya enviados
+    Si el offset no coincide responde 409 con el offset correcto
+    """
+    try:
+        offset = request.headers.get("Upload-Offset", type=int)
+        if offset is None:
+            return jsonify({"error": "Se requiere la cabecera Upload-Offset"}), 400
+        new_offset = blob_store.append(upload_id, request.stream, offset)
+        response = jsonify({"uploadId": upload_id, "offset": new_offset})
+        response.headers["Upload-Offset"] = str(new_offset)
+        return response, 200
+    except UploadError as e:
+        return _upload_error(e)
+    except Exception as e:
+        logger.error("❌ Error al recibir bloque: %s", str(e))
+        logger.debug(traceback.format_exc())
+        return jsonify({"error": "Error interno del servidor"}), 500
+
+# Ruta para cerrar una subida reanudable
+@ruta_blob.route("/uploads/<string:upload_id>/complete", methods=["POST"])
+def complete_upload(upload_id):
+    """
+    Termina una subida y guarda el contenido bajo su SHA-256
+    Si el contenido ya existía no se guarda una segunda copia
+    Retorna: blobId para usar en addNoteFile
+    """
+    try:
+        sha256, size, content_type = blob_store.complete(upload_id)
+        return _finish(sha256, size, content_type)
+    except UploadError as e:
+        return _upload_error(e)
+    except Exception as e:
+        logger.error("❌ Error al completar subida: %s", str(e))
+        logger.debug(traceback.format_exc())
+        db.session.rollback()
+        return jsonify({"error": "Error interno del servidor"}), 500
+
+# Ruta para cancelar una subida
+@ruta_blob.route("/uploads/<string:upload_id>", methods=["DELETE"])
+def abort_upload(upload_id):
+    """Descarta una subida sin terminar"""
+    try:
+        blob_store.abort(upload_id)
+        return jsonify({"message": "Subida cancelada"}), 200
+    except UploadError as e:
+        return _upload_error(e)
+
+# Ruta para descargar el contenido de un blob
+@ruta_blob.route("/blobs/<string:blob_id>", methods=["GET"])
+def download_blob(blob_id):
+    """
+    Sirve el contenido de un blob
+    Soporta Range (descargas parciales) e If-None-Match (el ETag es el SHA-256)
+    El archivo se envía con wsgi.file_wrapper, que usa sendfile cuando el servidor lo soporta
+    """
+    if not blob_store.exists(blob_id):
+        abort(404)
+    blob = db.session.get(Blob, blob_id)
+    response = send_file(
+        blob_store.object_path(blob_id),
+        mimetype=(blob.content_type if blob else None) or "application/octet-stream",
+        conditional=True,
+        etag=blob_id,
+        max_age=31536000,
+    )
+    # El contenido nunca cambia para un mismo hash
+    response.cache_control.immutable = True
+    return response
+
+# Ruta para consultar los metadatos de un blob
+@ruta_blob.route("/blobs/<string:blob_id>/info", methods=["GET"])
+def get_blob_info(blob_id):
+    """Retorna tamaño, tipo y número de referencias de un blob"""
+    blob = db.session.get(Blob, blob_id) if is_blob_id(blob_id) else None
+    if not blob:
+        return jsonify({"error": "Blob no encontrado"}), 404
+    return jsonify(blob.to_dict()), 200
+
+def _send_derived(blob_id, path_for, mimetype):
+    """Sirve un archivo derivado (miniatura o vista previa); si aún no existe lo encola."""
+    if not blob_store.exists(blob_id):
+        abort(404)
+    path = path_for(blob_id)
+    if not os.path.exists(path):
+        preview_pipeline.submit(blob_id)
+        return jsonify({"message": "Vista previa no disponible todavía"}), 404
+    return send_file(path, mimetype=mimetype, conditional=True, max_age=86400)
+
+# Ruta para obtener la miniatura de un blob de imagen
+@ruta_blob.route("/blobs/<string:blob_id>/thumbnail", methods=["GET"])
+def get_blob_thumbnail(blob_id):
+    """Retorna la miniatura JPEG generada en segundo plano"""
+    return _send_derived(blob_id, thumbnail_path, "image/jpeg")
+
+# Ruta para obtener la vista previa de texto de un blob
+@ruta_blob.route("/blobs/<string:blob_id>/preview", methods=["GET"])
+def get_blob_preview(blob_id):
+    """Retorna el texto de la primera página generado en segundo plano"""
+    return _send_derived(blob_id, preview_path, "text/plain; charset=utf-8")
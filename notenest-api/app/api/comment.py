@@ -5,7 +5,18 @@ import traceback
 import logging
 from flask import Blueprint, request, jsonify, current_app
 from app.config.db import db
+from app.config.shards import shard_router
 from app.models.comment import Comment
+from app.utils.note_counters import bump_note_counters, bump_mongo_note_counters
+from app.utils.comment_tree import delete_comment_subtree
+from app.utils.logs import summarize
+from app.utils.idempotency import idempotent
+from app.utils.entity_cache import entity_cache
+from app.utils.trending import trending_notes, COMMENT_WEIGHT
+from app.utils.usage_stats import usage_stats
+from app.utils.bootstrap import mark_user_data_changed
+from app.models.note import Note
+from app.utils.events import publish_note_event
 from datetime import datetime
 
 # Configuración del sistema de registro para seguimiento de eventos y errores
@@ -15,6 +26,25 @@ logger = logging.getLogger(__name__)
 # Crear un Blueprint de Flask para las rutas de comentarios
 ruta_comment = Blueprint("route_comment", __name__)
 
+def _note_activity(note_id, event_type, weight=0, **data):
+    """
+    Avisa de un cambio en los comentarios de una nota: lo publica a los
+    suscriptores de /events y, si la nota es pública, suma `weight` a su
+    puntuación de tendencia.
+    """
+    note = entity_cache.get(Note, note_id)
+    if not note:
+        return
+    if weight and note.get("isPublic"):
+        trending_notes.record(note_id, weight)
+    publish_note_event(event_type, note, **data)
+
+def _mark_note_owner(note_id):
+    """Los comentarios forman parte de la instantánea de arranque del dueño de la nota."""
+    note = entity_cache.get(Note, note_id)
+    if note:
+        mark_user_data_changed(note["userId"])
+
 # Ruta para obtener todos los comentarios
 @ruta_comment.route("/comments", methods=["GET"])
 def get_all_comments():
@@ -23,8 +53,8 @@ def get_all_comments():
     Útil para administración y moderación de comentarios
     """
     try:
-        comments = Comment.query.all()
-        return jsonify([c.to_dict() for c in comments])
+        comments = shard_router.gather(lambda: [c.to_dict() for c in Comment.query.all()])
+        return jsonify(comments)
     except Exception as e:
         logger.error("⚠️ Error al obtener comentarios: %s", str(e))
         logger.debug(traceback.format_exc())
@@ -38,13 +68,14 @@ def get_comment_by_id(comment_id):
     Parámetros:
         comment_id: ID del comentario a buscar
     """
-    comment = Comment.query.get(comment_id)
+    comment = entity_cache.get(Comment, comment_id)
     if not comment:
         return jsonify({"message": "Comentario no encontrado"}), 404
-    return jsonify(comment.to_dict()), 200
+    return jsonify(comment), 200
 
 # Ruta para agregar un nuevo comentario
 @ruta_comment.route("/addComment", methods=["POST"])
+@idempotent
 def add_comment():
     """
     Crea un nuevo comentario en una nota
@@ -53,26 +84,33 @@ def add_comment():
     """
     try:
         data = request.json
-        logger.info("📥 [addComment] Datos recibidos: %s", data)
+        logger.info("📥 [addComment] Datos recibidos", extra={"payload": summarize(data)})
 
         # Verificar campos requeridos
         if not data.get("noteId") or not data.get("userId"):
             return jsonify({"error": "noteId y userId son requeridos"}), 400
 
+        # Incrementar el contador de la nota (si no se actualiza ninguna fila, la nota no existe)
+        if not bump_note_counters(data["noteId"], comments=1):
+            return jsonify({"error": "Nota no encontrada"}), 404
+
         # Crear y guardar el nuevo comentario
         new_comment = Comment.from_dict(data)
         db.session.add(new_comment)
         db.session.flush()
-
-        logger.info("✅ [addComment] Objeto en memoria: %s", new_comment.to_dict())
+        usage_stats.record(new_comment.user_id, comments=1)
+        _mark_note_owner(new_comment.note_id)
 
         db.session.commit()
         logger.info("💾 [addComment] Comentario guardado con ID: %s", new_comment.id)
+        _note_activity(new_comment.note_id, "comment.created", COMMENT_WEIGHT,
+                       commentId=new_comment.id, parentId=None, userId=new_comment.user_id)
 
         # Guardar en MongoDB para sincronización
         try:
             mongo = current_app.config['MONGO_DB']
-            mongo.comments.insert_one({**new_comment.to_dict(), "from_flask": True})
+            mongo.comments.insert_one({**new_comment.to_document(), "from_flask": True})
+            bump_mongo_note_counters(mongo, new_comment.note_id, comments=1)
             logger.info("📦 Comentario insertado en MongoDB")
         except Exception as mongo_err:
             logger.error("❌ Error al insertar en MongoDB: %s", str(mongo_err))
@@ -87,6 +125,7 @@ def add_comment():
 
 # Ruta para responder a un comentario existente
 @ruta_comment.route("/replyComment", methods=["POST"])
+@idempotent
 def reply_comment():
     """
     Crea una respuesta a un comentario existente
@@ -95,30 +134,39 @@ def reply_comment():
     """
     try:
         data = request.json
-        logger.info("📥 [replyComment] Datos recibidos: %s", data)
+        logger.info("📥 [replyComment] Datos recibidos", extra={"payload": summarize(data)})
 
         # Verificar campos requeridos
         if not data.get("noteId") or not data.get("userId") or not data.get("parentId"):
             return jsonify({"error": "Faltan campos requeridos"}), 400
 
         # Verificar que existe el comentario padre
-        parent = Comment.query.get(data["parentId"])
+        parent = entity_cache.get(Comment, data["parentId"])
         if parent is None:
             return jsonify({"error": "Comentario padre no encontrado"}), 404
 
         # Establecer el comentario raíz (para mantener la jerarquía)
-        data["rootComment"] = parent.root_comment if parent.parent_id else parent.id
+        data["rootComment"] = parent["rootComment"] if parent["parentId"] else parent["id"]
+
+        # Incrementar el contador de la nota (si no se actualiza ninguna fila, la nota no existe)
+        if not bump_note_counters(data["noteId"], comments=1):
+            return jsonify({"error": "Nota no encontrada"}), 404
 
         # Crear y guardar la respuesta
         new_reply = Comment.from_dict(data)
         db.session.add(new_reply)
+        usage_stats.record(new_reply.user_id, comments=1)
+        _mark_note_owner(new_reply.note_id)
         db.session.commit()
         logger.info("💾 [replyComment] Respuesta guardada con ID: %s", new_reply.id)
+        _note_activity(new_reply.note_id, "comment.created", COMMENT_WEIGHT,
+                       commentId=new_reply.id, parentId=new_reply.parent_id, userId=new_reply.user_id)
 
         # Guardar en MongoDB para sincronización
         try:
             mongo = current_app.config['MONGO_DB']
-            mongo.comments.insert_one({**new_reply.to_dict(), "from_flask": True})
+            mongo.comments.insert_one({**new_reply.to_document(), "from_flask": True})
+            bump_mongo_note_counters(mongo, new_reply.note_id, comments=1)
             logger.info("📦 Respuesta insertada en MongoDB")
         except Exception as mongo_err:
             logger.error("❌ Error al insertar en MongoDB: %s", str(mongo_err))
@@ -135,28 +183,36 @@ def reply_comment():
 @ruta_comment.route("/deleteComment/<string:comment_id>", methods=["DELETE"])
 def delete_comment(comment_id):
     """
-    Elimina un comentario específico
+    Elimina un comentario y todas sus respuestas
     Parámetros:
         comment_id: ID del comentario a eliminar
-    Elimina el comentario de ambas bases de datos
+    Elimina el subárbol completo de ambas bases de datos
+    Retorna: número de comentarios eliminados
     """
     try:
         comment = Comment.query.get(comment_id)
         if not comment:
             return jsonify({"error": "Comentario no encontrado"}), 404
 
-        db.session.delete(comment)
+        note_id = comment.note_id
+        deleted, mongo_filters = delete_comment_subtree(comment)
+        bump_note_counters(note_id, comments=-deleted)
+        _mark_note_owner(note_id)
         db.session.commit()
+        logger.info("🗑️ Eliminados %d comentarios del hilo de %s", deleted, comment_id)
 
         # Eliminar también de MongoDB
         try:
             mongo = current_app.config['MONGO_DB']
-            mongo.comments.delete_one({"_id": comment_id})
-            logger.info("🗑️ Comentario eliminado de MongoDB")
+            for mongo_filter in mongo_filters:
+                mongo.comments.delete_many(mongo_filter)
+            bump_mongo_note_counters(mongo, note_id, comments=-deleted)
+            logger.info("🗑️ Comentarios eliminados de MongoDB")
         except Exception as mongo_err:
             logger.error("❌ Error al eliminar en MongoDB: %s", str(mongo_err))
 
-        return jsonify({"message": "Comentario eliminado"}), 200
+        _note_activity(note_id, "comment.deleted", commentId=comment_id, deleted=deleted)
+        return jsonify({"message": "Comentario eliminado", "deleted": deleted}), 200
 
     except Exception as e:
         logger.error("❌ Error al eliminar comentario: %s", str(e))
@@ -183,6 +239,7 @@ def update_comment(comment_id):
         if "content" in data:
             comment.content = data["content"]
         comment.updated_at = datetime.utcnow()
+        _mark_note_owner(comment.note_id)
 
         db.session.commit()
 
@@ -192,7 +249,7 @@ def update_comment(comment_id):
             mongo.comments.update_one(
                 {"_id": comment_id},
                 {"$set": {
-                    "content": comment.content,
+                    "content": comment.stored_content,
                     "updatedAt": comment.updated_at.isoformat()
                 }}
             )
@@ -200,6 +257,7 @@ def update_comment(comment_id):
         except Exception as mongo_err:
             logger.error("❌ Error al actualizar en MongoDB: %s", str(mongo_err))
 
+        _note_activity(comment.note_id, "comment.updated", commentId=comment_id)
         return jsonify({"message": "Comentario actualizado correctamente"}), 200
 
     except Exception as e:
@@ -233,8 +291,9 @@ def get_comments_by_user(user_id):
         user_id: ID del usuario cuyos comentarios se quieren obtener
     """
     try:
-        comments = Comment.query.filter_by(user_id=user_id).all()
-        return jsonify([c.to_dict() for c in comments]), 200
+        # Los comentarios están en el shard de cada nota: se pregunta a todos
+        comments = shard_router.gather(lambda: [c.to_dict() for c in Comment.query.filter_by(user_id=user_id).all()])
+        return jsonify(comments), 200
     except Exception as e:
         logger.error("❌ Error al obtener comentarios del usuario: %s", str(e))
         logger.debug(traceback.format_exc())
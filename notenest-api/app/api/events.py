@@ -0,0 +1,54 @@
+# Este archivo maneja la suscripción a cambios en tiempo real (Server-Sent
+# Events), que sustituye al sondeo periódico de notas y comentarios
+
+import logging
+from flask import Blueprint, Response, request, jsonify
+from app.utils.events import event_hub, EVENTS_MAX_TOPICS
+
+# Configuración del sistema de registro para seguimiento de eventos y errores
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Crear un Blueprint de Flask para las rutas de eventos
+ruta_events = Blueprint("route_events", __name__)
+
+# Ruta para suscribirse a los cambios de un usuario, de notas o del feed público
+@ruta_events.route("/events", methods=["GET"])
+def subscribe_events():
+    """
+    Abre un flujo text/event-stream con los cambios de los temas pedidos
+    Parámetros (query):
+        userId: cambios en las notas del usuario
+        notes: ids de notas separados por comas (comentarios, likes, ediciones)
+        public: 1 para el feed de notas públicas
+        lastEventId: como la cabecera Last-Event-ID, para reanudar
+    Eventos: note.created, note.updated, note.deleted, note.liked, note.fileAdded,
+    note.fileDeleted, comment.created, comment.updated, comment.deleted y
+    reset (se perdieron eventos: recargar los datos)
+    """
+    topics = set()
+    if request.args.get("userId"):
+        topics.add(f"user:{request.args['userId']}")
+    topics.update(f"note:{note_id}" for note_id in request.args.get("notes", "").split(",") if note_id)
+    if request.args.get("public") in ("1", "true"):
+        topics.add("public")
+    if not topics:
+        return jsonify({"error": "Indica userId, notes o public"}), 400
+    if len(topics) > EVENTS_MAX_TOPICS:
+        return jsonify({"error": f"Máximo {EVENTS_MAX_TOPICS} temas por suscripción"}), 400
+
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("lastEventId")
+    subscription = event_hub.subscribe(topics, last_event_id)
+    if subscription is None:
+        logger.warning("⚠️ Límite de suscriptores de eventos alcanzado")
+        return jsonify({"error": "Demasiadas suscripciones abiertas"}), 503
+
+    logger.info("📡 Nueva suscripción a eventos (%d temas)", len(topics))
+    subscriber, replay = subscription
+    response = Response(
+        event_hub.stream(subscriber, replay),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    response.call_on_close(lambda: event_hub.unsubscribe(subscriber))
+    return response
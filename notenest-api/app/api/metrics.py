@@ -0,0 +1,16 @@
+# Este archivo expone las métricas de la aplicación en formato Prometheus
+
+from flask import Blueprint, Response
+from app.utils.metrics import render
+
+# Crear un Blueprint de Flask para la ruta de métricas
+ruta_metrics = Blueprint("route_metrics", __name__)
+
+# Ruta para que Prometheus recoja las métricas
+@ruta_metrics.route("/metrics", methods=["GET"])
+def get_metrics():
+    """
+    Retorna las métricas en formato de texto de Prometheus
+    Con METRICS_MULTIPROC_DIR incluye las de todos los procesos del servidor
+    """
+    return Response(render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
@@ -6,10 +6,29 @@ import uuid
 import logging
 from flask import Blueprint, request, jsonify, current_app
 from app.config.db import db, mongo_db
+from app.config.shards import shard_router
 from app.models.note import Note, NoteSchema
 from app.models.note_files import NoteFile, NoteFileSchema
 from app.models.user import User
+from app.models.note_cleanup_job import NoteCleanupJob
+from app.models.note_like import NoteLike
+from app.utils.note_cleanup import note_cleanup_worker
+from app.utils.blob_store import acquire_blob, release_blobs, reclaim
+from app.utils.previews import preview_pipeline
+from app.utils.note_counters import bump_note_counters, bump_mongo_note_counters, bump_note_likes
+from app.utils.like_index import like_index
+from app.utils.events import publish_note_event
+from app.utils.logs import summarize
+from app.utils.idempotency import idempotent
+from app.utils.entity_cache import entity_cache
+from app.utils.autosave import note_autosave
+from app.utils.usage_stats import usage_stats
+from app.utils.bootstrap import mark_user_data_changed
+from app.utils.trending import trending_notes, LIKE_WEIGHT, TRENDING_TOP_K
+from app.utils.text_patch import apply_note_update, content_hash, PatchError, VersionMismatch
 from datetime import datetime
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
 
 # Configuración del sistema de registro para seguimiento de eventos y errores
 logging.basicConfig(level=logging.INFO)
@@ -23,6 +42,9 @@ note_schema = NoteSchema()
 notes_schema = NoteSchema(many=True)
 note_file_schema = NoteFileSchema(many=True)
 
+# Notas por consulta en /likedNotes
+MAX_LIKE_CHECK = 1000
+
 # Ruta para obtener todas las notas
 @ruta_note.route("/notes", methods=["GET"])
 def get_all_notes():
@@ -32,8 +54,7 @@ def get_all_notes():
     """
     try:
         logger.info("\U0001F4E5 Obteniendo todas las notas")
-        notes = Note.query.all()
-        result = notes_schema.dump(notes)
+        result = shard_router.gather(lambda: notes_schema.dump(Note.active().all()))
         return jsonify(result)
     except Exception as e:
         logger.error(f"⚠️ Error al obtener notas: {str(e)}")
@@ -50,19 +71,39 @@ def sync_notes():
     """
     try:
         notes_data = request.json
-        logger.info("\U0001F4E5 Sincronizando notas: %s", notes_data)
+        logger.info("\U0001F4E5 Sincronizando notas", extra={"payload": summarize(notes_data)})
         if not isinstance(notes_data, list):
             return jsonify({"error": "Se esperaba una lista de notas"}), 400
 
         # Sincronizar cada nota en ambas bases de datos
         mongo = current_app.config['MONGO_DB']
+        synced = []
+        # La sincronización completa reemplaza lo que hubiera pendiente de autoguardado
+        note_autosave.flush(*[data.get('id') or data.get('_id') for data in notes_data])
         for data in notes_data:
-            note = Note.from_dict(data)
-            db.session.merge(note)
+            # Con sharding, cada nota se lee y se escribe en el shard de su dueño
+            shard_router.use(shard_router.shard_for_user(data.get('userId')))
+            # Las notas en proceso de borrado no se resucitan
+            existing = db.session.get(Note, data.get('id') or data.get('_id'))
+            if existing is not None and existing.deleted_at is not None:
+                continue
+            if existing is not None:
+                usage_stats.record_note(existing, -1)  # Se vuelve a contar como quede tras el merge
+                mark_user_data_changed(existing.user_id)
+            # merge devuelve la instancia persistente, con los contadores ya guardados
+            note = db.session.merge(Note.from_dict(data))
+            usage_stats.record_note(note)
+            mark_user_data_changed(note.user_id)
+            if shard_router.enabled:
+                db.session.flush()
+            document = note.to_document()
             mongo.notes.update_one(
-                {"_id": note.id}, {"$set": note.to_dict()}, upsert=True
+                {"_id": note.id}, {"$set": document}, upsert=True
             )
+            synced.append(document)
         db.session.commit()
+        for document in synced:
+            publish_note_event("note.updated", document, updatedAt=document["updatedAt"])
         return jsonify({"message": "Notas sincronizadas correctamente"}), 201
     except Exception as e:
         logger.error(f"❌ Error en sincronización de notas: {str(e)}")
@@ -79,13 +120,14 @@ def get_note_by_id(note_id):
         note_id: ID de la nota a buscar
     """
     logger.info("\U0001F50D Buscando nota con ID: %s", note_id)
-    note = Note.query.get(note_id)
+    note = entity_cache.get(Note, note_id)
     if not note:
         return jsonify({"message": "Nota no encontrada"}), 404
-    return jsonify(note_schema.dump(note)), 200
+    return jsonify(note), 200
 
 # Ruta para crear una nueva nota
 @ruta_note.route("/addNote", methods=["POST"])
+@idempotent
 def add_note():
     """
     Crea una nueva nota con sus archivos adjuntos
@@ -94,15 +136,14 @@ def add_note():
     """
     try:
         data = request.json
-        logger.info("\U0001F4DD Agregando nueva nota: %s", data)
+        logger.info("\U0001F4DD Agregando nueva nota", extra={"payload": summarize(data)})
 
         # Verificar que el usuario existe
         user_id = data.get("userId")
         if not user_id:
             return jsonify({"error": "La nota debe tener un userId válido"}), 400
 
-        user = User.query.get(user_id)
-        if not user:
+        if not entity_cache.get(User, user_id):
             logger.warning("\u274C Usuario con ID %s no encontrado", user_id)
             return jsonify({"error": "El usuario no existe"}), 400
 
@@ -111,24 +152,36 @@ def add_note():
         new_note = Note.from_dict(data)
         db.session.add(new_note)
 
-        # Procesar y guardar los archivos adjuntos
+        # Procesar y guardar los archivos adjuntos (por URL o por blobId ya subido)
         note_files = []
         for file_data in files:
-            if isinstance(file_data, dict) and 'fileUrl' in file_data:
-                note_file = NoteFile(
-                    id=file_data.get('id', str(uuid.uuid4())),
-                    note_id=new_note.id,
-                    file_url=file_data['fileUrl']
-                )
-                db.session.add(note_file)
-                note_files.append(note_file.to_dict())
+            if not isinstance(file_data, dict):
+                continue
+            blob_id = file_data.get('blobId')
+            if blob_id:
+                if not acquire_blob(blob_id):
+                    db.session.rollback()
+                    return jsonify({"error": f"Blob no encontrado: {blob_id}"}), 404
+            elif 'fileUrl' not in file_data:
+                continue
+            note_file = NoteFile(
+                id=file_data.get('id', str(uuid.uuid4())),
+                note_id=new_note.id,
+                file_url=file_data.get('fileUrl'),
+                blob_sha256=blob_id
+            )
+            db.session.add(note_file)
+            note_files.append(note_file.to_dict())
+        new_note.file_count = len(note_files)
+        usage_stats.record_note(new_note)
+        mark_user_data_changed(user_id)
 
         db.session.commit()
         logger.info("✅ Nota agregada con ID: %s", new_note.id)
 
         # Guardar en MongoDB para sincronización
         mongo = current_app.config['MONGO_DB']
-        mongo_note = new_note.to_dict()
+        mongo_note = new_note.to_document()
         mongo_note["files"] = note_files
         mongo_note["from_flask"] = True
         mongo.notes.insert_one(mongo_note)
@@ -138,9 +191,13 @@ def add_note():
             mongo.note_files.insert_one({
                 "_id": file_data["id"],
                 "noteId": file_data["noteId"],
-                "fileUrl": file_data["fileUrl"]
+                "fileUrl": file_data["fileUrl"],
+                "blobId": file_data["blobId"]
             })
+            # Miniaturas y vistas previas en segundo plano (no bloquea la respuesta)
+            preview_pipeline.submit(file_data["blobId"])
 
+        publish_note_event("note.created", mongo_note, userId=mongo_note["userId"], title=mongo_note["title"])
         return jsonify({"message": "Nota guardada correctamente", "id": new_note.id}), 201
 
     except Exception as e:
@@ -157,34 +214,67 @@ def update_note(note_id):
     Parámetros:
         note_id: ID de la nota a actualizar
     Permite actualizar: título, contenido y estado público/privado
+    En lugar de "content" se puede enviar "patch" (operaciones retain/insert/delete,
+    ver apply_patch) junto con "baseHash", el contentHash del contenido sobre el que
+    se calculó; si el contenido cambió entretanto retorna 409 con el hash actual
+    Con "autosave": true (y NOTE_AUTOSAVE_WINDOW > 0) el cambio se acumula en
+    memoria con los siguientes de la misma nota y se guarda solo el estado final:
+    retorna 202 con el contentHash pendiente, "pendingVersion" (llega en el
+    evento note.updated cuando se guarda) y "flushBy", la hora límite de escritura
+    Retorna: contentHash del contenido guardado
     """
     try:
         logger.info("✏️ Actualizando nota %s", note_id)
-        note = Note.query.get(note_id)
+        data = request.json
+        patch = data.get("patch")
+        if patch is not None and "content" in data:
+            return jsonify({"error": "Enviar content o patch, no ambos"}), 400
+
+        if data.get("autosave") and note_autosave.enabled and note_autosave.accepts(note_id):
+            try:
+                ack = note_autosave.submit(note_id, data)
+            except VersionMismatch as e:
+                return jsonify({"error": "La nota cambió desde la versión base", "contentHash": e.current_hash}), 409
+            except PatchError as e:
+                return jsonify({"error": f"Parche inválido: {e}"}), 422
+            if ack is None:
+                return jsonify({"error": "Nota no encontrada"}), 404
+            return jsonify({"message": "Cambios pendientes de guardar", **ack}), 202
+
+        # Lo pendiente de autoguardado se escribe antes que este cambio
+        note_autosave.flush(note_id)
+        query = Note.active().filter(Note.id == note_id)
+        if patch is not None:
+            # Bloquear la fila: dos parches sobre la misma base no deben pisarse
+            query = query.with_for_update()
+        note = query.first()
         if not note:
             return jsonify({"error": "Nota no encontrada"}), 404
 
-        data = request.json
-        # Actualizar campos si están presentes en la petición
-        if "title" in data:
-            note.title = data["title"]
-        if "content" in data:
-            note.content = data["content"]
-        if "isPublic" in data:
-            note.is_public = data["isPublic"]
-        note.updated_at = datetime.utcnow()
+        try:
+            changes = apply_note_update(note, data, datetime.utcnow())
+        except VersionMismatch as e:
+            db.session.rollback()
+            return jsonify({"error": "La nota cambió desde la versión base", "contentHash": e.current_hash}), 409
+        except PatchError as e:
+            db.session.rollback()
+            return jsonify({"error": f"Parche inválido: {e}"}), 422
+        new_hash = content_hash(note.content)
+        event_note = {"id": note.id, "userId": note.user_id, "isPublic": note.is_public}
+        if "isPublic" in changes:
+            usage_stats.record(note.user_id, public_notes=1 if note.is_public else -1)
+        mark_user_data_changed(note.user_id)
 
         db.session.commit()
+        publish_note_event("note.updated", event_note, fields=sorted(changes), contentHash=new_hash,
+                           updatedAt=changes["updatedAt"])
 
-        # Actualizar en MongoDB para mantener sincronización
+        # Actualizar en MongoDB solo los campos que cambiaron
+        # (los contadores se mantienen con $inc y no se tocan aquí)
         mongo = current_app.config['MONGO_DB']
-        mongo_note = note.to_dict()
-        mongo.notes.update_one(
-            {"_id": note.id},
-            {"$set": mongo_note}
-        )
+        mongo.notes.update_one({"_id": note.id}, {"$set": changes})
 
-        return jsonify({"message": "Nota actualizada correctamente"}), 200
+        return jsonify({"message": "Nota actualizada correctamente", "contentHash": new_hash}), 200
 
     except Exception as e:
         logger.error(f"❌ Error al actualizar nota: {str(e)}")
@@ -199,27 +289,55 @@ def delete_note(note_id):
     Elimina una nota y sus archivos adjuntos
     Parámetros:
         note_id: ID de la nota a eliminar
-    Elimina la nota de ambas bases de datos
+    Marca la nota como eliminada y responde de inmediato; los comentarios,
+    archivos y documentos de MongoDB se borran en segundo plano
     """
     try:
         logger.info("\U0001F5D1️ Eliminando nota %s", note_id)
-        note = Note.query.get(note_id)
+        note = Note.get_active(note_id)
         if not note:
             return jsonify({"error": "Nota no encontrada"}), 404
 
-        db.session.delete(note)
+        note_autosave.discard(note_id)
+        note.deleted_at = datetime.utcnow()
+        event_note = {"id": note.id, "userId": note.user_id, "isPublic": note.is_public}
+        usage_stats.record_note(note, -1)
+        mark_user_data_changed(note.user_id)
+        job = db.session.get(NoteCleanupJob, note_id)
+        if job is None:
+            db.session.add(NoteCleanupJob(note_id=note_id))
+        else:
+            # El id ya se limpió antes (nota recreada): se reinicia el trabajo
+            job.phase = 'comments'
+            job.error = None
         db.session.commit()
-        
-        # Eliminar también de MongoDB
+
+        # Marcar también en MongoDB; el documento se borra al terminar la limpieza
         mongo = current_app.config['MONGO_DB']
-        mongo.notes.delete_one({"_id": note_id})
-        return jsonify({"message": "Nota eliminada"}), 200
+        mongo.notes.update_one({"_id": note_id}, {"$set": {"deletedAt": note.deleted_at.isoformat()}})
+        trending_notes.discard(note_id)
+        publish_note_event("note.deleted", event_note)
+        note_cleanup_worker.notify()
+        return jsonify({"message": "Nota eliminada", "cleanup": f"/api/noteCleanup/{note_id}"}), 200
     except Exception as e:
         logger.error(f"❌ Error al eliminar nota: {str(e)}")
         logger.debug(traceback.format_exc())
         db.session.rollback()
         return jsonify({"error": "Error interno del servidor"}), 500
 
+# Ruta para consultar el progreso de la limpieza de una nota eliminada
+@ruta_note.route("/noteCleanup/<string:note_id>", methods=["GET"])
+def get_note_cleanup(note_id):
+    """
+    Retorna el estado del trabajo de limpieza de una nota eliminada
+    Parámetros:
+        note_id: ID de la nota eliminada
+    """
+    job = db.session.get(NoteCleanupJob, note_id)
+    if not job:
+        return jsonify({"message": "No hay limpieza para esta nota"}), 404
+    return jsonify(job.to_dict()), 200
+
 # Ruta para obtener notas de un usuario específico
 @ruta_note.route("/notesByUser/<string:user_id>", methods=["GET"])
 def get_notes_by_user(user_id):
@@ -230,7 +348,7 @@ def get_notes_by_user(user_id):
     """
     try:
         logger.info("📄 Obteniendo notas del usuario %s", user_id)
-        notes = Note.query.filter_by(user_id=user_id).all()
+        notes = Note.active().filter_by(user_id=user_id).all()
         return jsonify(notes_schema.dump(notes)), 200
     except Exception as e:
         logger.error("❌ Error al obtener notas del usuario: %s", str(e))
@@ -241,35 +359,102 @@ def get_notes_by_user(user_id):
 @ruta_note.route("/publicNotes", methods=["GET"])
 def get_public_notes():
     """
-    Obtiene todas las notas marcadas como públicas
+    Obtiene todas las notas marcadas como públicas, de la más reciente a la más antigua
     Útil para la sección de notas públicas/compartidas
+    Parámetros (query):
+        limit: número máximo de notas (opcional)
     """
     try:
         logger.info("🌐 Obteniendo notas públicas")
-        notes = Note.query.filter_by(is_public=True).all()
-        return jsonify(notes_schema.dump(notes)), 200
+        limit = request.args.get("limit", type=int)
+
+        def newest():
+            query = Note.active().filter_by(is_public=True).order_by(Note.created_at.desc(), Note.id.desc())
+            return notes_schema.dump(query.limit(limit).all() if limit else query.all())
+
+        # Con sharding cada shard retorna sus notas ya ordenadas y se mezclan (k vías)
+        notes = shard_router.gather(newest, key=lambda note: (note["createdAt"] or "", note["id"]),
+                                    reverse=True, limit=limit)
+        return jsonify(notes), 200
     except Exception as e:
         logger.error("❌ Error al obtener notas públicas: %s", str(e))
         logger.debug(traceback.format_exc())
         return jsonify({"error": "Error interno del servidor"}), 500
 
+# Ruta para obtener las notas públicas en tendencia
+@ruta_note.route("/trendingNotes", methods=["GET"])
+def get_trending_notes():
+    """
+    Obtiene las notas públicas con más actividad reciente (likes y comentarios,
+    con un peso que se reduce a la mitad cada `window`)
+    Parámetros (query):
+        window: ventana de tiempo, p. ej. 1h, 24h o 7d (ver TRENDING_WINDOWS)
+        limit: número de notas (máximo TRENDING_TOP_K)
+    Retorna: notas ordenadas de mayor a menor, con su trendingScore
+    """
+    try:
+        window = request.args.get("window", trending_notes.default_window)
+        if window not in trending_notes.windows:
+            return jsonify({"error": "Ventana no disponible", "windows": list(trending_notes.windows)}), 400
+        limit = max(1, min(request.args.get("limit", 20, type=int), TRENDING_TOP_K))
+
+        logger.info("📈 Obteniendo notas en tendencia (%s)", window)
+        result = []
+        for note_id, score in trending_notes.leaders(window):
+            # La nota pudo borrarse o dejar de ser pública después de sus eventos
+            note = entity_cache.get(Note, note_id)
+            if not note or not note.get("isPublic"):
+                continue
+            result.append({**note, "trendingScore": round(score, 4)})
+            if len(result) == limit:
+                break
+        return jsonify(result), 200
+    except Exception as e:
+        logger.error("❌ Error al obtener notas en tendencia: %s", str(e))
+        logger.debug(traceback.format_exc())
+        return jsonify({"error": "Error interno del servidor"}), 500
+
 # Ruta para dar "me gusta" a una nota
 @ruta_note.route("/likeNote/<string:note_id>", methods=["PUT"])
+@idempotent
 def like_note(note_id):
     """
     Incrementa el contador de "me gusta" de una nota
     Parámetros:
         note_id: ID de la nota a la que se dará like
+    Recibe (opcional): {"userId": "..."}; con userId el like queda registrado
+    por usuario y repetirlo no vuelve a sumar (retorna "liked": true)
     Actualiza el contador en ambas bases de datos
     """
     try:
         logger.info("👍 Añadiendo like a la nota %s", note_id)
-        note = Note.query.get(note_id)
+        note = entity_cache.get(Note, note_id)
         if not note:
             return jsonify({"error": "Nota no encontrada"}), 404
 
-        note.likes += 1
+        user_id = (request.get_json(silent=True) or {}).get("userId")
+        if user_id:
+            if not entity_cache.get(User, user_id):
+                return jsonify({"error": "El usuario no existe"}), 400
+            # Decide la clave primaria de note_likes, no el índice: este proceso puede
+            # seguir teniendo un like que otro proceso ya quitó
+            try:
+                db.session.execute(insert(NoteLike).values(user_id=user_id, note_id=note_id))
+            except IntegrityError:
+                db.session.rollback()
+                like_index.add(user_id, note_id)
+                return jsonify({"message": "Like ya registrado", "likes": note["likes"], "liked": True}), 200
+
+        if not bump_note_likes(note_id, 1):
+            db.session.rollback()
+            return jsonify({"error": "Nota no encontrada"}), 404
+        usage_stats.record(note["userId"], likes_received=1)
+        mark_user_data_changed(note["userId"])
         db.session.commit()
+        if user_id:
+            like_index.add(user_id, note_id)
+        if note["isPublic"]:
+            trending_notes.record(note_id, LIKE_WEIGHT)
 
         # Actualizar likes en MongoDB
         mongo = current_app.config['MONGO_DB']
@@ -281,7 +466,8 @@ def like_note(note_id):
         if result.modified_count == 0:
             logger.warning("⚠️ No se actualizó el documento en MongoDB")
         
-        return jsonify({"message": "Like añadido", "likes": note.likes}), 200
+        publish_note_event("note.liked", note, likes=note["likes"] + 1)
+        return jsonify({"message": "Like añadido", "likes": note["likes"] + 1, "liked": True}), 200
 
     except Exception as e:
         logger.error(f"❌ Error al dar like: {str(e)}")
@@ -291,43 +477,81 @@ def like_note(note_id):
 
 # Ruta para quitar "me gusta" de una nota
 @ruta_note.route("/unlikeNote/<string:note_id>", methods=["PUT"])
+@idempotent
 def unlike_note(note_id):
     """
     Decrementa el contador de "me gusta" de una nota
     Parámetros:
         note_id: ID de la nota a la que se quitará el like
+    Recibe (opcional): {"userId": "..."}; con userId solo se resta si ese
+    usuario le había dado like (repetirlo retorna "liked": false sin cambios)
     Solo reduce el contador si es mayor que 0
     """
     try:
         logger.info("👎 Eliminando like de la nota %s", note_id)
-        note = Note.query.get(note_id)
+        note = entity_cache.get(Note, note_id)
         if not note:
             return jsonify({"error": "Nota no encontrada"}), 404
 
-        if note.likes > 0:
-            note.likes -= 1
-            db.session.commit()
-            
-            # Actualizar likes en MongoDB
-            mongo = current_app.config['MONGO_DB']
-            result = mongo.notes.update_one(
-                {"_id": note_id},
-                {"$inc": {"likes": -1}}
-            )
-            
-            if result.modified_count == 0:
-                logger.warning("⚠️ No se actualizó el documento en MongoDB")
-                
-            return jsonify({"message": "Like eliminado", "likes": note.likes}), 200
-        else:
+        user_id = (request.get_json(silent=True) or {}).get("userId")
+        if user_id:
+            # Decide el DELETE, no el índice: este proceso puede no conocer un like registrado por otro
+            removed = NoteLike.query.filter_by(
+                user_id=user_id, note_id=note_id
+            ).delete(synchronize_session=False)
+            if not removed:
+                db.session.rollback()
+                like_index.discard(user_id, note_id)  # Pudo quitarlo otro proceso
+                return jsonify({"message": "Like no registrado", "likes": note["likes"], "liked": False}), 200
+        elif note["likes"] <= 0:
             return jsonify({"message": "La nota no tiene likes para eliminar"}), 400
 
+        bump_note_likes(note_id, -1)
+        if note["likes"] > 0:
+            usage_stats.record(note["userId"], likes_received=-1)
+        mark_user_data_changed(note["userId"])
+        db.session.commit()
+        if user_id:
+            like_index.discard(user_id, note_id)
+        if note["isPublic"]:
+            trending_notes.record(note_id, -LIKE_WEIGHT)
+
+        # Actualizar likes en MongoDB
+        mongo = current_app.config['MONGO_DB']
+        result = mongo.notes.update_one(
+            {"_id": note_id},
+            {"$inc": {"likes": -1}}
+        )
+
+        if result.modified_count == 0:
+            logger.warning("⚠️ No se actualizó el documento en MongoDB")
+
+        publish_note_event("note.liked", note, likes=max(note["likes"] - 1, 0))
+        return jsonify({"message": "Like eliminado", "likes": max(note["likes"] - 1, 0), "liked": False}), 200
+
     except Exception as e:
         logger.error(f"❌ Error al quitar like: {str(e)}")
         logger.debug(traceback.format_exc())
         db.session.rollback()
         return jsonify({"error": "Error interno del servidor"}), 500
 
+# Ruta para saber a cuáles de varias notas les dio like un usuario
+@ruta_note.route("/likedNotes", methods=["POST"])
+def get_liked_notes():
+    """
+    Comprueba en memoria, de una vez, qué notas le gustan a un usuario
+    Recibe: {"userId": "...", "noteIds": ["...", ...]} (hasta MAX_LIKE_CHECK ids)
+    Retorna: {"liked": [ids de las notas con like del usuario]}
+    """
+    data = request.get_json(silent=True) or {}
+    user_id, note_ids = data.get("userId"), data.get("noteIds")
+    if not user_id or not isinstance(note_ids, list):
+        return jsonify({"error": "Se requiere userId y una lista noteIds"}), 400
+    if len(note_ids) > MAX_LIKE_CHECK:
+        return jsonify({"error": f"Máximo {MAX_LIKE_CHECK} notas por consulta"}), 413
+    liked = like_index.check(user_id, note_ids)
+    return jsonify({"liked": [note_id for note_id in note_ids if note_id in liked]}), 200
+
 # Ruta para obtener los archivos adjuntos de una nota
 @ruta_note.route("/noteFiles/<string:note_id>", methods=["GET"])
 def get_note_files(note_id):
@@ -341,14 +565,18 @@ def get_note_files(note_id):
         logger.info("📎 Obteniendo archivos de la nota %s", note_id)
         
         # Verificar que la nota existe
-        note = Note.query.get(note_id)
-        if not note:
+        if not entity_cache.get(Note, note_id):
             logger.warning("⚠️ Nota no encontrada: %s", note_id)
             return jsonify({"error": "Nota no encontrada"}), 404
 
         # Obtener archivos de MySQL
         note_files = NoteFile.query.filter_by(note_id=note_id).all()
         result = note_file_schema.dump(note_files)
+
+        # Reencolar las vistas previas que aún no existen (p. ej. si la cola estaba llena)
+        for file_data in result:
+            if file_data.get('blobId') and not file_data.get('thumbnailUrl') and not file_data.get('previewUrl'):
+                preview_pipeline.submit(file_data['blobId'])
         
         # Obtener y combinar archivos de MongoDB
         try:
@@ -361,7 +589,8 @@ def get_note_files(note_id):
                     result.append({
                         'id': str(mongo_file.get('_id')),
                         'noteId': mongo_file.get('noteId'),
-                        'fileUrl': mongo_file.get('fileUrl')
+                        'fileUrl': mongo_file.get('fileUrl'),
+                        'blobId': mongo_file.get('blobId')
                     })
             
             logger.info("✅ Archivos encontrados: %d", len(result))
@@ -377,36 +606,46 @@ def get_note_files(note_id):
 
 # Ruta para agregar un archivo adjunto a una nota
 @ruta_note.route("/addNoteFile", methods=["POST"])
+@idempotent
 def add_note_file():
     """
     Agrega un nuevo archivo adjunto a una nota
-    Requiere: ID de la nota y URL del archivo
+    Requiere: ID de la nota y la URL del archivo o el blobId de un contenido ya subido
+    (ver /blobs y /uploads)
     Guarda el archivo en ambas bases de datos
     """
     try:
         data = request.json
-        logger.info("📎 Agregando archivo a nota: %s", data)
+        logger.info("📎 Agregando archivo a nota", extra={"payload": summarize(data)})
 
         note_id = data.get("noteId")
         file_url = data.get("fileUrl")
+        blob_id = data.get("blobId")
 
-        if not note_id or not file_url:
-            return jsonify({"error": "Se requiere noteId y fileUrl"}), 400
+        if not note_id or not (file_url or blob_id):
+            return jsonify({"error": "Se requiere noteId y fileUrl o blobId"}), 400
 
         # Verificar que la nota existe
-        note = Note.query.get(note_id)
+        note = entity_cache.get(Note, note_id)
         if not note:
             return jsonify({"error": "Nota no encontrada"}), 404
 
+        # Sumar una referencia al contenido compartido
+        if blob_id and not acquire_blob(blob_id):
+            return jsonify({"error": "Blob no encontrado"}), 404
+
         # Crear nuevo archivo adjunto
         file_id = data.get("id", str(uuid.uuid4()))
         note_file = NoteFile(
             id=file_id,
             note_id=note_id,
-            file_url=file_url
+            file_url=file_url,
+            blob_sha256=blob_id
         )
 
         db.session.add(note_file)
+        bump_note_counters(note_id, files=1)
+        mark_user_data_changed(note["userId"])
         db.session.commit()
 
         # Guardar en MongoDB
@@ -414,13 +653,20 @@ def add_note_file():
         mongo_file = {
             "_id": file_id,
             "noteId": note_id,
-            "fileUrl": file_url
+            "fileUrl": note_file.file_url,
+            "blobId": blob_id
         }
         mongo.note_files.insert_one(mongo_file)
+        bump_mongo_note_counters(mongo, note_id, files=1)
+
+        # Miniatura o vista previa en segundo plano (no bloquea la respuesta)
+        preview_pipeline.submit(blob_id)
+        publish_note_event("note.fileAdded", note, fileId=file_id)
 
         return jsonify({
             "message": "Archivo agregado correctamente",
-            "id": file_id
+            "id": file_id,
+            "fileUrl": note_file.file_url
         }), 201
 
     except Exception as e:
@@ -445,12 +691,22 @@ def delete_note_file(file_id):
         if not note_file:
             return jsonify({"error": "Archivo no encontrado"}), 404
 
+        note = entity_cache.get(Note, note_file.note_id)
         db.session.delete(note_file)
+        bump_note_counters(note_file.note_id, files=-1)
+        reclaimed = release_blobs([note_file.blob_sha256])
+        if note:
+            mark_user_data_changed(note["userId"])
         db.session.commit()
+        # El contenido solo se borra del disco cuando ya nadie lo referencia
+        reclaim(reclaimed)
 
         # Eliminar de MongoDB
         mongo = current_app.config['MONGO_DB']
         mongo.note_files.delete_one({"_id": file_id})
+        bump_mongo_note_counters(mongo, note_file.note_id, files=-1)
+        if note:
+            publish_note_event("note.fileDeleted", note, fileId=file_id)
 
         return jsonify({"message": "Archivo eliminado correctamente"}), 200
 
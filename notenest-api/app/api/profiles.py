@@ -0,0 +1,82 @@
+# Este archivo expone los perfiles de peticiones capturados por el perfilador
+# (listado, descarga de pilas para flame graphs y muestreo en caliente)
+
+from collections import Counter
+from flask import Blueprint, request, jsonify, Response
+from app.utils.profiler import profiler, folded
+
+# Crear un Blueprint de Flask para las rutas de perfiles
+ruta_profiles = Blueprint("route_profiles", __name__)
+
+@ruta_profiles.before_request
+def require_token():
+    """Con PROFILE_SECRET las rutas de perfiles exigen la cabecera X-Profile firmada."""
+    if profiler.secret and not profiler.authorized():
+        return jsonify({"error": "Token de perfilado inválido o caducado"}), 403
+
+# Ruta para listar los perfiles guardados
+@ruta_profiles.route("/profiles", methods=["GET"])
+def list_profiles():
+    """
+    Lista los perfiles guardados, del más reciente al más antiguo
+    Parámetros (query):
+        route: filtrar por endpoint (p. ej. route_note.get_public_notes)
+    Retorna: perfiles y, por ruta, cuántos hay y su duración media
+    """
+    entries = profiler.profiles(request.args.get("route"))
+    counts = Counter(entry["route"] for entry in entries)
+    total_ms = Counter()
+    for entry in entries:
+        total_ms[entry["route"]] += entry["durationMs"]
+    routes = [
+        {"route": route, "profiles": n, "avgDurationMs": round(total_ms[route] / n, 2)}
+        for route, n in counts.most_common()
+    ]
+    return jsonify({"every": profiler.every, "routes": routes, "profiles": entries}), 200
+
+# Ruta para descargar las pilas de un perfil
+@ruta_profiles.route("/profiles/<string:profile_id>", methods=["GET"])
+def get_profile(profile_id):
+    """
+    Descarga un perfil en formato "folded" (o JSON con ?format=json)
+    Parámetros:
+        profile_id: ID del perfil
+    """
+    entry = profiler.get(profile_id)
+    if entry is None:
+        return jsonify({"error": "Perfil no encontrado"}), 404
+    if request.args.get("format") == "json":
+        return jsonify(entry), 200
+    return Response(folded(entry["stacks"]), mimetype="text/plain",
+                    headers={"Content-Disposition": f"attachment; filename={profile_id}.folded"})
+
+# Ruta para descargar las pilas agregadas de una ruta
+@ruta_profiles.route("/profiles/routes/<string:route>", methods=["GET"])
+def get_route_profile(route):
+    """
+    Suma las pilas de todos los perfiles guardados de una ruta, en formato "folded"
+    Parámetros:
+        route: endpoint de Flask (p. ej. route_user.login)
+    """
+    stacks = profiler.aggregate(route)
+    if not stacks:
+        return jsonify({"error": "No hay perfiles de esa ruta"}), 404
+    return Response(folded(stacks), mimetype="text/plain",
+                    headers={"Content-Disposition": f"attachment; filename={route}.folded"})
+
+# Ruta para cambiar en caliente la proporción de peticiones perfiladas
+@ruta_profiles.route("/profiles/sampling", methods=["PUT"])
+def set_sampling():
+    """
+    Cambia la proporción de peticiones perfiladas sin reiniciar
+    Recibe: {"every": N} para perfilar 1 de cada N peticiones (0 = desactivar)
+    Solo afecta al proceso que atiende la petición
+    """
+    if not profiler.secret:
+        return jsonify({"error": "Requiere PROFILE_SECRET"}), 403
+    data = request.get_json(silent=True) or {}
+    every = data.get("every")
+    if not isinstance(every, int) or isinstance(every, bool) or every < 0:
+        return jsonify({"error": "every debe ser un entero >= 0"}), 400
+    profiler.every = every
+    return jsonify({"every": profiler.every}), 200
@@ -2,12 +2,20 @@
 # Una sesión representa el período de tiempo en que un usuario está activo/conectado
 
 import traceback
+import logging
 from flask import Blueprint, request, jsonify, current_app
 from app.config.db import db
+from app.config.shards import shard_router
 from app.models.session import Session, SessionSchema
+from app.utils.idempotency import idempotent
+from app.utils.entity_cache import entity_cache
 from datetime import datetime, timedelta
 import uuid
 
+# Configuración del sistema de registro para seguimiento de eventos y errores
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
 # Crear un Blueprint de Flask para las rutas de sesión
 ruta_session = Blueprint("route_session", __name__)
 
@@ -23,12 +31,11 @@ def get_all_sessions():
     Útil para monitoreo y administración
     """
     try:
-        sessions = Session.query.all()
-        result = sessions_schema.dump(sessions)
+        result = shard_router.gather(lambda: sessions_schema.dump(Session.query.all()))
         return jsonify(result)
     except Exception as e:
-        print(f"⚠️ Error al obtener sesiones: {str(e)}")
-        print(traceback.format_exc())
+        logger.error("⚠️ Error al obtener sesiones: %s", e)
+        logger.debug(traceback.format_exc())
         return jsonify({"error": "Error interno del servidor"}), 500
 
 # Ruta para obtener la sesión de un usuario específico
@@ -39,13 +46,14 @@ def get_session_by_user(user_id):
     Parámetros:
         user_id: ID del usuario cuya sesión se busca
     """
-    session = Session.query.get(user_id)
+    session = entity_cache.get(Session, user_id)
     if not session:
         return jsonify({"message": "Sesión no encontrada"}), 404
-    return jsonify(session_schema.dump(session)), 200
+    return jsonify(session), 200
 
 # Ruta para crear una nueva sesión
 @ruta_session.route("/createSession", methods=["POST"])
+@idempotent
 def create_session():
     """
     Crea una nueva sesión para un usuario
@@ -78,12 +86,12 @@ def create_session():
         # Guardar en base de datos SQL
         db.session.add(new_session)
         db.session.commit()
-        print("✅ Sesión guardada en MySQL")
+        logger.info("✅ Sesión guardada en MySQL")
 
         # Guardar también en MongoDB para sincronización
         mongo = current_app.config['MONGO_DB']
         mongo.sessions.insert_one(new_session.to_dict())
-        print("✅ Sesión guardada en MongoDB")
+        logger.info("✅ Sesión guardada en MongoDB")
 
         return jsonify({
             "message": "Sesión creada correctamente",
@@ -91,8 +99,8 @@ def create_session():
         }), 201
 
     except Exception as e:
-        print(f"❌ Error al crear sesión: {str(e)}")
-        print(traceback.format_exc())
+        logger.error("❌ Error al crear sesión: %s", e)
+        logger.debug(traceback.format_exc())
         db.session.rollback()
         return jsonify({"error": "Error interno del servidor"}), 500
 
@@ -111,8 +119,8 @@ def delete_session(user_id):
         db.session.commit()
         return jsonify({"message": "Sesión eliminada"}), 200
     except Exception as e:
-        print(f"❌ Error al eliminar sesión: {str(e)}")
-        print(traceback.format_exc())
+        logger.error("❌ Error al eliminar sesión: %s", e)
+        logger.debug(traceback.format_exc())
         db.session.rollback()
         return jsonify({"error": "Error interno del servidor"}), 500
 
@@ -129,7 +137,11 @@ def validate_session():
         if not token:
             return jsonify({"error": "Token no proporcionado"}), 400
 
-        # Buscar la sesión por el token
+        # Buscar la sesión por el token (con sharding, primero el shard que la tiene)
+        shard = shard_router.locate(Session, token, column=Session.token)
+        if shard is None:
+            return jsonify({"error": "Sesión no encontrada"}), 404
+        shard_router.use(shard)
         session = Session.query.filter_by(token=token).first()
         if not session:
             return jsonify({"error": "Sesión no encontrada"}), 404
@@ -147,6 +159,6 @@ def validate_session():
         }), 200
 
     except Exception as e:
-        print(f"❌ Error al validar sesión: {str(e)}")
-        print(traceback.format_exc())
+        logger.error("❌ Error al validar sesión: %s", e)
+        logger.debug(traceback.format_exc())
         return jsonify({"error": "Error interno del servidor"}), 500
@@ -0,0 +1,49 @@
+# Este archivo expone las estadísticas de uso (por usuario y globales), que se
+# mantienen de forma incremental en usage_stats: leerlas no recorre notas ni comentarios
+
+import traceback
+import logging
+from flask import Blueprint, jsonify
+from app.models.user import User
+from app.utils.entity_cache import entity_cache
+from app.utils.usage_stats import usage_stats
+
+# Configuración del sistema de registro para seguimiento de eventos y errores
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Crear un Blueprint de Flask para las rutas de estadísticas
+ruta_stats = Blueprint("route_stats", __name__)
+
+# Ruta para obtener las estadísticas de un usuario
+@ruta_stats.route("/stats/user/<string:user_id>", methods=["GET"])
+def get_user_stats(user_id):
+    """
+    Retorna los contadores de un usuario
+    Parámetros:
+        user_id: ID del usuario
+    Retorna: notes, publicNotes, likesReceived y comments (escritos por el
+    usuario), más updatedAt y reconciledAt de la fila guardada
+    """
+    try:
+        if not entity_cache.get(User, user_id):
+            return jsonify({"error": "Usuario no encontrado"}), 404
+        return jsonify({"userId": user_id, **usage_stats.user(user_id)}), 200
+    except Exception as e:
+        logger.error("❌ Error al obtener las estadísticas del usuario %s: %s", user_id, str(e))
+        logger.debug(traceback.format_exc())
+        return jsonify({"error": "Error interno del servidor"}), 500
+
+# Ruta para obtener las estadísticas globales
+@ruta_stats.route("/stats/global", methods=["GET"])
+def get_global_stats():
+    """
+    Retorna los totales del sistema
+    Retorna: users, notes, publicNotes, likes y comments, más updatedAt y reconciledAt
+    """
+    try:
+        return jsonify(usage_stats.totals()), 200
+    except Exception as e:
+        logger.error("❌ Error al obtener las estadísticas globales: %s", str(e))
+        logger.debug(traceback.format_exc())
+        return jsonify({"error": "Error interno del servidor"}), 500
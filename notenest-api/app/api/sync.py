@@ -0,0 +1,102 @@
+# Este archivo maneja la sincronización por lotes: el cliente offline envía en
+# una sola petición todas las operaciones que acumuló sin conexión, y la carga
+# inicial de un dispositivo nuevo
+
+import traceback
+import logging
+from flask import Blueprint, Response, request, jsonify, current_app, send_file, stream_with_context
+from app.config.db import db
+from app.config.replicas import reads_primary
+from app.models.user import User
+from app.utils.batch_sync import apply_batch, BATCH_MAX_OPERATIONS
+from app.utils.bootstrap import bootstrap_cache, data_version
+from app.utils.entity_cache import entity_cache
+from app.utils.events import event_hub
+from app.utils.idempotency import idempotent
+
+# Configuración del sistema de registro para seguimiento de eventos y errores
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Crear un Blueprint de Flask para las rutas de sincronización
+ruta_sync = Blueprint("route_sync", __name__)
+
+# Ruta para aplicar un lote de operaciones encoladas por el cliente
+@ruta_sync.route("/sync/batch", methods=["POST"])
+@idempotent
+def sync_batch():
+    """
+    Aplica en orden una lista de operaciones tipadas
+    Recibe: {"operations": [{"op": "addNote", "ref": "n1", "data": {...}},
+                            {"op": "addComment", "data": {"noteId": "$ref:n1", ...}},
+                            {"op": "likeNote", "id": "$ref:n1", "data": {"userId": "..."}}, ...]}
+    Operaciones: addNote, updateNote, likeNote, addComment, replyComment,
+    deleteComment y addNoteFile. "$ref:<nombre>" se sustituye por el id creado
+    por una operación anterior del mismo lote con "ref": "<nombre>".
+    Retorna: un resultado por operación (estado, id o error) y los ids de cada ref
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        operations = data.get("operations") if isinstance(data, dict) else None
+        if not isinstance(operations, list):
+            return jsonify({"error": "Se esperaba una lista de operaciones"}), 400
+        if len(operations) > BATCH_MAX_OPERATIONS:
+            return jsonify({"error": f"Máximo {BATCH_MAX_OPERATIONS} operaciones por lote"}), 413
+
+        logger.info("📦 Aplicando lote de %d operaciones", len(operations))
+        results, refs = apply_batch(operations, current_app.config['MONGO_DB'])
+        failed = sum(1 for result in results if result["status"] >= 400)
+        if failed:
+            logger.warning("⚠️ %d de %d operaciones del lote fallaron", failed, len(operations))
+        return jsonify({"results": results, "refs": refs, "failed": failed}), 200
+    except Exception as e:
+        logger.error("❌ Error al aplicar el lote: %s", str(e))
+        logger.debug(traceback.format_exc())
+        db.session.rollback()
+        return jsonify({"error": "Error interno del servidor"}), 500
+
+# Ruta para descargar de una vez los datos de un usuario en un dispositivo nuevo
+@ruta_sync.route("/sync/bootstrap/<string:user_id>", methods=["GET"])
+@reads_primary  # El token de /events debe ser posterior a los datos leídos
+def sync_bootstrap(user_id):
+    """
+    Instantánea de las notas del usuario, sus archivos y los comentarios de
+    esas notas, en NDJSON comprimido con gzip (Content-Encoding: gzip). Cada
+    línea es {"type": "snapshot" | "note" | "file" | "comment" | "end", ...};
+    los objetos van en "data" con el mismo formato que notesByUser,
+    noteFiles y commentsByNote.
+    Parámetros:
+        user_id: ID del usuario
+    Retorna: la instantánea (ETag = versión de los datos; If-None-Match
+    responde 304 si no cambió) y la cabecera X-Sync-Token, que se envía como
+    Last-Event-ID a /events para recibir los cambios posteriores
+    """
+    try:
+        if not entity_cache.get(User, user_id):
+            return jsonify({"error": "Usuario no encontrado"}), 404
+        # El token se toma antes de leer: lo escrito después llega también por /events
+        sync_token = event_hub.cursor()
+        version = data_version(user_id)
+        headers = {"X-Sync-Token": sync_token, "Cache-Control": "private, no-cache"}
+        if version in request.if_none_match:
+            return Response(status=304, headers={**headers, "ETag": f'"{version}"'})
+
+        path = bootstrap_cache.lookup(user_id, version)
+        if path:
+            logger.info("📦 Instantánea de arranque del usuario %s servida desde disco", user_id)
+            response = send_file(path, mimetype="application/x-ndjson", etag=version, conditional=False)
+        else:
+            logger.info("📦 Generando instantánea de arranque del usuario %s", user_id)
+            response = Response(
+                stream_with_context(bootstrap_cache.generate(user_id, version)),
+                mimetype="application/x-ndjson",
+            )
+            response.set_etag(version)
+        response.headers["Content-Encoding"] = "gzip"
+        response.headers.update(headers)
+        return response
+    except Exception as e:
+        logger.error("❌ Error al preparar la instantánea de arranque: %s", str(e))
+        logger.debug(traceback.format_exc())
+        db.session.rollback()
+        return jsonify({"error": "Error interno del servidor"}), 500
@@ -5,7 +5,13 @@ import logging
 import traceback
 from flask import Blueprint, request, jsonify, current_app
 from app.config.db import db
-from app.models.user import User, UserSchema
+from app.config.shards import shard_router
+from app.models.user import User, UserSchema, PublicUserSchema
+from app.models.user_shard import UserShard
+from app.utils.user_directory import user_directory
+from app.utils.entity_cache import entity_cache
+from app.utils.usage_stats import usage_stats
+from app.utils.logs import summarize
 from app.utils.password_utils import hash_password, verify_password, generate_uuid
 from datetime import datetime
 
@@ -19,23 +25,55 @@ ruta_user = Blueprint("route_user", __name__)
 # Esquemas para convertir objetos Usuario a formato JSON y viceversa
 user_schema = UserSchema()
 users_schema = UserSchema(many=True)
+public_users_schema = PublicUserSchema(many=True)
 
 # Ruta para obtener todos los usuarios
 @ruta_user.route("/users", methods=["GET"])
 def get_all_users():
     """
     Obtiene una lista de todos los usuarios registrados en el sistema
-    Retorna: Lista de usuarios en formato JSON
+    Parámetros opcionales:
+        name: si se indica, filtra por prefijo usando el directorio en memoria
+    Retorna: Lista de usuarios en formato JSON (sin datos sensibles)
     """
     try:
+        name = request.args.get("name")
+        if name:
+            user_directory.refresh()
+            users, _ = user_directory.search(name, limit=request.args.get("limit", 20, type=int))
+            return jsonify(users)
+
         users = User.query.all()  # Consultar todos los usuarios de la base de datos
-        result = users_schema.dump(users)  # Convertir usuarios a formato JSON
+        result = public_users_schema.dump(users)  # Convertir usuarios a formato JSON
         return jsonify(result)
     except Exception as e:
         logger.error("⚠️ Error al obtener usuarios: %s", str(e))
         logger.debug(traceback.format_exc())
         return jsonify({"error": "Error interno del servidor"}), 500
 
+# Ruta para buscar usuarios por prefijo de nombre o email
+@ruta_user.route("/users/search", methods=["GET"])
+def search_users():
+    """
+    Busca usuarios cuyo nombre (o alguna palabra del nombre) o email empiece por un prefijo
+    Parámetros:
+        prefix: texto a buscar (sin distinguir mayúsculas ni tildes)
+        limit: número máximo de resultados (por defecto 20, máximo 50)
+        cursor: valor de nextCursor de la página anterior
+    Retorna: resultados y cursor de la página siguiente (o null)
+    """
+    prefix = request.args.get("prefix", "").strip()
+    if not prefix:
+        return jsonify({"error": "Se requiere el parámetro prefix"}), 400
+
+    user_directory.refresh()
+    users, next_cursor = user_directory.search(
+        prefix,
+        limit=request.args.get("limit", 20, type=int),
+        cursor=request.args.get("cursor"),
+    )
+    return jsonify({"results": users, "nextCursor": next_cursor}), 200
+
 # Ruta para obtener un usuario específico por su ID
 @ruta_user.route("/user/<string:user_id>", methods=["GET"])
 def get_user_by_id(user_id):
@@ -45,10 +83,10 @@ def get_user_by_id(user_id):
         user_id: Identificador único del usuario
     Retorna: Datos del usuario en formato JSON
     """
-    user = User.query.get(user_id)
+    user = entity_cache.get(User, user_id)
     if not user:
         return jsonify({"message": "Usuario no encontrado"}), 404
-    return jsonify(user_schema.dump(user)), 200
+    return jsonify(user), 200
 
 # Ruta para registrar un nuevo usuario
 @ruta_user.route("/register", methods=["POST"])
@@ -60,7 +98,7 @@ def register_user():
     """
     try:
         data = request.json
-        logger.info("📥 Datos recibidos en /register: %s", data)
+        logger.info("📥 Datos recibidos en /register", extra={"payload": summarize(data)})
 
         # Verificar que se proporcionaron todos los campos necesarios
         if not data.get("email") or not data.get("name") or not data.get("password"):
@@ -69,7 +107,7 @@ def register_user():
 
         # Verificar si el email ya está registrado
         existing_user = User.query.filter_by(email=data["email"]).first()
-        logger.info("🔍 Usuario existente: %s", existing_user)
+        logger.info("🔍 Usuario existente: %s", existing_user is not None)
 
         if existing_user:
             logger.warning("❌ El email ya está registrado")
@@ -92,10 +130,15 @@ def register_user():
             salt=salt,
             created_at=datetime.utcnow()
         )
-        logger.info("📦 Usuario preparado para insertar en MySQL: %s", new_user.to_dict())
+        logger.info("📦 Usuario %s preparado para insertar en MySQL", new_user.id)
 
         db.session.add(new_user)
+        if shard_router.enabled:
+            # Los datos del usuario se crearán en su shard preferido
+            db.session.add(UserShard(user_id=user_id, shard=shard_router.preferred_shard(user_id)))
+        usage_stats.record(user_id, users=1)
         db.session.commit()
+        user_directory.upsert(new_user.id, new_user.name, new_user.email)
         logger.info("✅ Usuario insertado correctamente en MySQL")
 
         # Guardar también en MongoDB para sincronización
@@ -237,6 +280,7 @@ def update_user(user_id):
         logger.info("✅ Usuario actualizado correctamente en MongoDB")
 
         db.session.commit()
+        user_directory.upsert(user.id, user.name, user.email)
         return jsonify({"message": "Usuario actualizado correctamente"}), 200
 
     except Exception as e:
@@ -0,0 +1,123 @@
+# Comandos de mantenimiento que se ejecutan con `flask --app app <comando>`
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+@click.command("repair-counters")
+@with_appcontext
+def repair_counters_command():
+    """Recalcula commentCount y fileCount de todas las notas."""
+    from app.utils.note_counters import recompute_note_counters
+
+    fixed = recompute_note_counters(current_app.config['MONGO_DB'])
+    click.echo(f"✅ Contadores recalculados, notas corregidas: {fixed}")
+
+@click.command("cleanup-notes")
+@with_appcontext
+def cleanup_notes_command():
+    """Procesa ahora los trabajos pendientes de limpieza de notas eliminadas."""
+    from app.utils.note_cleanup import run_pending_jobs
+
+    finished = run_pending_jobs(current_app.config['MONGO_DB'])
+    click.echo(f"✅ Trabajos de limpieza terminados: {finished}")
+
+@click.command("gc-blobs")
+@click.option("--grace-hours", default=24, show_default=True, help="Antigüedad mínima para borrar")
+@with_appcontext
+def gc_blobs_command(grace_hours):
+    """Borra blobs sin referencias y subidas abandonadas."""
+    from app.utils.blob_store import collect_garbage
+
+    blobs, uploads = collect_garbage(grace_hours)
+    click.echo(f"✅ Blobs borrados: {blobs}, subidas abandonadas borradas: {uploads}")
+
+@click.command("compress-content")
+@click.option("--batch-size", default=500, show_default=True, help="Filas por transacción")
+@click.option("--pause", default=0.0, show_default=True, help="Segundos de espera entre bloques")
+@with_appcontext
+def compress_content_command(batch_size, pause):
+    """Comprime el contenido de notas y comentarios guardado sin comprimir."""
+    from app.utils.compression import compress_existing
+
+    totals = compress_existing(current_app.config['MONGO_DB'], batch_size, pause)
+    click.echo(f"✅ Notas comprimidas: {totals['notes']}, comentarios comprimidos: {totals['comments']}")
+
+@click.command("profile-token")
+@click.option("--ttl", default=300, show_default=True, help="Segundos de validez")
+@with_appcontext
+def profile_token_command(ttl):
+    """Genera un valor para la cabecera X-Profile (requiere PROFILE_SECRET)."""
+    from app.utils.profiler import profiler, make_token
+
+    if not profiler.secret:
+        raise click.ClickException("PROFILE_SECRET no está configurado")
+    click.echo(make_token(profiler.secret, ttl))
+
+@click.command("shard-rebalance")
+@click.option("--limit", default=0, show_default=True, help="Usuarios como máximo a trasladar (0 = todos)")
+@click.option("--dry-run", is_flag=True, help="Solo muestra los traslados pendientes")
+@click.option("--drain", default=None, type=float, help="Segundos de espera antes de borrar el origen")
+@with_appcontext
+def shard_rebalance_command(limit, dry_run, drain):
+    """Traslada a su shard preferido los usuarios que están en otro."""
+    from app.config.shards import shard_router
+    from app.utils.shard_rebalance import rebalance
+
+    if not shard_router.enabled:
+        click.echo("⚠️ Sharding desactivado (SQL_SHARD_URLS vacío)")
+        return
+    moves = rebalance(limit or None, dry_run, drain)
+    for user_id, source, target in moves:
+        click.echo(f"{user_id}: shard {source} -> {target}")
+    click.echo(f"✅ Usuarios {'por trasladar' if dry_run else 'trasladados'}: {len(moves)}")
+
+@click.command("shard-move")
+@click.argument("user_id")
+@click.argument("shard", type=int)
+@click.option("--drain", default=None, type=float, help="Segundos de espera antes de borrar el origen")
+@with_appcontext
+def shard_move_command(user_id, shard, drain):
+    """Traslada los datos de un usuario al shard indicado."""
+    from app.config.shards import shard_router
+    from app.utils.shard_rebalance import move_users
+
+    if not shard_router.enabled or not 0 <= shard < shard_router.count:
+        raise click.BadParameter(f"El shard debe estar entre 0 y {shard_router.count - 1}")
+    moved = move_users([(user_id, shard)], drain)
+    click.echo(f"✅ Filas copiadas: {moved[user_id][1]}" if moved else "✅ El usuario ya estaba en ese shard")
+
+@click.command("replica-status")
+@with_appcontext
+def replica_status_command():
+    """Mide ahora el retraso de cada réplica de lectura."""
+    from app.config.replicas import replica_router
+
+    if not replica_router.enabled:
+        click.echo("⚠️ Sin réplicas de lectura (SQL_REPLICA_URLS vacío)")
+        return
+    for entry in replica_router.check():
+        lag = "-" if entry["lag"] is None else f"{entry['lag']:.2f} s"
+        state = "✅ en uso" if entry["healthy"] else f"⚠️ retirada ({entry['error'] or 'retraso'})"
+        click.echo(f"réplica {entry['replica']}: {lag} {state}")
+
+@click.command("reconcile-stats")
+@with_appcontext
+def reconcile_stats_command():
+    """Recalcula las estadísticas de uso con agregados agrupados (pensado para cron, de noche)."""
+    from app.utils.usage_stats import usage_stats
+
+    fixed = usage_stats.reconcile()
+    click.echo(f"✅ Estadísticas de uso reconciliadas, filas corregidas: {fixed}")
+
+def register_commands(app):
+    """Registra los comandos de mantenimiento en la CLI de Flask."""
+    app.cli.add_command(repair_counters_command)
+    app.cli.add_command(cleanup_notes_command)
+    app.cli.add_command(gc_blobs_command)
+    app.cli.add_command(compress_content_command)
+    app.cli.add_command(profile_token_command)
+    app.cli.add_command(shard_rebalance_command)
+    app.cli.add_command(shard_move_command)
+    app.cli.add_command(replica_status_command)
+    app.cli.add_command(reconcile_stats_command)
@@ -2,80 +2,175 @@ from flask import Flask, current_app
 from flask_sqlalchemy import SQLAlchemy
 from flask_marshmallow import Marshmallow
 from pymongo import MongoClient, errors as mongo_errors
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from app.config.docstore import DocumentDatabase
+from app.config.replicas import replica_router, replica_urls, replica_bind_key
+from app.config.shards import RoutingSession, shard_router, shard_urls, shard_bind_key
 import pymysql
+import sqlite3
 import os
 import time
 
-db = SQLAlchemy()
+# La sesión elige la base de cada sentencia cuando hay shards o réplicas (ver app/config/shards.py)
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 ma = Marshmallow()
 mongo_client = None
 mongo_db = None
 
 def get_mongo_db():
-    if not mongo_db:
+    if mongo_db is None:
         raise RuntimeError("MongoDB no ha sido inicializado. Asegúrate de llamar a init_app primero.")
     return mongo_db
 
-def wait_for_mysql():
-    host = os.getenv("DB_HOST", "localhost")
-    port = int(os.getenv("DB_PORT", "3306"))
-    user = os.getenv("DB_USER", "root")
-    password = os.getenv("DB_PASSWORD", "root")
-    database = os.getenv("DB_NAME", "notenest")
+# Tiempo máximo de espera a que MySQL o MongoDB estén disponibles al arrancar
+WAIT_TIMEOUT = float(os.getenv("DB_WAIT_TIMEOUT", "120"))
+
+def sql_database_uri():
+    """
+    URI de SQLAlchemy. DATABASE_URL permite usar cualquier backend (por ejemplo
+    sqlite:////var/lib/notenest/notenest.db); si no está definida se arma la de
+    MySQL a partir de las variables DB_*.
+    """
+    url = os.environ.get("DATABASE_URL")
+    if url:
+        return url
+    db_user = os.environ.get("DB_USER", "root")
+    db_pass = os.environ.get("DB_PASSWORD", "root")
+    db_host = os.environ.get("DB_HOST", "localhost")
+    db_port = os.environ.get("DB_PORT", "3306")
+    db_name = os.environ.get("DB_NAME", "notenest")
+    return f"mysql+pymysql://{db_user}:{db_pass}@{db_host}:{db_port}/{db_name}"
+
+def document_store_url():
+    """
+    URL del almacén de documentos (DOCUMENT_STORE_URL):
+        mongodb://host:puerto   servidor MongoDB (por defecto, a partir de MONGO_HOST/MONGO_PORT)
+        file:///ruta/directorio almacén embebido persistido en archivos
+        memory://               almacén embebido solo en memoria (pruebas)
+    """
+    url = os.environ.get("DOCUMENT_STORE_URL")
+    if url:
+        return url
+    host = os.getenv("MONGO_HOST", "localhost")
+    port = os.getenv("MONGO_PORT", "27017")
+    return f"mongodb://{host}:{port}"
+
+def wait_for_mysql(uri):
+    url = make_url(uri)
+    host = url.host or "localhost"
+    port = url.port or 3306
 
     print(f"⏳ Esperando que MySQL esté disponible en {host}:{port}...")
 
+    deadline = time.monotonic() + WAIT_TIMEOUT
     while True:
         try:
-            conn = pymysql.connect(host=host, port=port, user=user, password=password, database=database)
+            conn = pymysql.connect(
+                host=host, port=port, user=url.username, password=url.password or "", database=url.database
+            )
             conn.close()
             print("✅ MySQL está disponible.")
             break
         except Exception:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"MySQL no disponible en {host}:{port} tras {WAIT_TIMEOUT:.0f} segundos")
             print("❌ Base de datos MySQL no disponible aún, reintentando en 2 segundos...")
             time.sleep(2)
 
-def wait_for_mongodb():
-    host = os.getenv("MONGO_HOST", "localhost")
-    port = int(os.getenv("MONGO_PORT", "27017"))
-    print(f"⏳ Esperando que MongoDB esté disponible en {host}:{port}...")
+def wait_for_mongodb(url):
+    print(f"⏳ Esperando que MongoDB esté disponible en {url}...")
 
+    deadline = time.monotonic() + WAIT_TIMEOUT
     while True:
         try:
-            client = MongoClient(host=host, port=port, serverSelectionTimeoutMS=2000)
+            client = MongoClient(url, serverSelectionTimeoutMS=2000)
             client.admin.command('ping')
             print("✅ MongoDB está disponible.")
             return client
         except mongo_errors.ServerSelectionTimeoutError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"MongoDB no disponible en {url} tras {WAIT_TIMEOUT:.0f} segundos")
             print("❌ MongoDB no disponible aún, reintentando en 2 segundos...")
             time.sleep(2)
 
-def init_app(app: Flask):
-    global mongo_client, mongo_db
+@event.listens_for(Engine, "connect")
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    """En SQLite: WAL (lecturas concurrentes con un escritor) y claves foráneas como en MySQL."""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
 
-    # 🔸 Esperar a MySQL y MongoDB
-    wait_for_mysql()
-    mongo_client = wait_for_mongodb()
+def configure_sqlite(app, uri):
+    """Prepara el directorio de la base y las opciones de conexión para varios hilos."""
+    options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    prepare_sqlite(uri, options)
 
-    # 🔸 Configurar SQLAlchemy con MySQL
-    db_user = os.environ.get("DB_USER", "root")
-    db_pass = os.environ.get("DB_PASSWORD", "root")
-    db_host = os.environ.get("DB_HOST", "localhost")
-    db_port = os.environ.get("DB_PORT", "3306")
-    db_name = os.environ.get("DB_NAME", "notenest")
+def prepare_sqlite(uri, options):
+    database = make_url(uri).database
+    if database and database != ":memory:" and os.path.isabs(database):
+        os.makedirs(os.path.dirname(database), exist_ok=True)
+    connect_args = options.setdefault('connect_args', {})
+    connect_args.setdefault('check_same_thread', False)
+    # Con varios hilos escribiendo se espera al bloqueo en vez de fallar
+    connect_args.setdefault('timeout', 30)
+
+def configure_binds(app, setting, default_urls, bind_key):
+    """Añade a SQLALCHEMY_BINDS una base por URI de `setting` (lista o separadas por comas). Retorna las URIs."""
+    urls = app.config.get(setting) or default_urls
+    if isinstance(urls, str):
+        urls = [url.strip() for url in urls.split(",") if url.strip()]
+    binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+    for index, url in enumerate(urls):
+        options = {"url": url}
+        if url.startswith("mysql"):
+            wait_for_mysql(url)
+        elif url.startswith("sqlite"):
+            prepare_sqlite(url, options)
+        binds[bind_key(index)] = options
+    app.config[setting] = urls
+    return urls
 
-    app.config['SQLALCHEMY_DATABASE_URI'] = (
-        f"mysql+pymysql://{db_user}:{db_pass}@{db_host}:{db_port}/{db_name}"
-    )
+def open_document_store(url):
+    """Abre el almacén de documentos indicado por la URL. Retorna (cliente o None, base de datos)."""
+    if url.startswith(("mongodb://", "mongodb+srv://")):
+        client = wait_for_mongodb(url)
+        return client, client[os.environ.get("MONGO_DB", "notenest_mongo")]
+    if url.startswith("file://"):
+        return None, DocumentDatabase(os.path.abspath(url[len("file://"):]))
+    if url.startswith("memory://"):
+        return None, DocumentDatabase()
+    raise ValueError(f"DOCUMENT_STORE_URL no soportada: {url}")
+
+def init_app(app: Flask):
+    global mongo_client, mongo_db
+
+    # 🔸 Base de datos SQL: MySQL por defecto, o la URI configurada (p. ej. SQLite)
+    uri = app.config.get('SQLALCHEMY_DATABASE_URI') or sql_database_uri()
+    if uri.startswith("mysql"):
+        wait_for_mysql(uri)
+    elif uri.startswith("sqlite"):
+        configure_sqlite(app, uri)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    configure_binds(app, 'SQL_SHARD_URLS', shard_urls(), shard_bind_key)
+    configure_binds(app, 'SQL_REPLICA_URLS', replica_urls(), replica_bind_key)
 
     db.init_app(app)
+    shard_router.init_app(app, db)  # Sin SQL_SHARD_URLS no hace nada
+    replica_router.init_app(app, db)  # Sin SQL_REPLICA_URLS no hace nada
     ma.init_app(app)
 
-    # 🔸 Inicializar base de datos MongoDB
-    mongo_db_name = os.environ.get("MONGO_DB", "notenest_mongo")
-    mongo_db = mongo_client[mongo_db_name]
-    
+    # 🔸 Almacén de documentos: MongoDB, el embebido, o uno ya inyectado
+    if app.config.get('MONGO_DB') is not None:
+        mongo_db = app.config['MONGO_DB']
+    else:
+        url = app.config.get('DOCUMENT_STORE_URL') or document_store_url()
+        mongo_client, mongo_db = open_document_store(url)
+
     # Guardar mongo_db en la configuración de la aplicación
     app.config['MONGO_DB'] = mongo_db
 
@@ -86,4 +181,9 @@ def init_app(app: Flask):
             if collection not in mongo_db.list_collection_names():
                 mongo_db.create_collection(collection)
 
-    print("✅ Conexión a MySQL y MongoDB establecida correctamente.")
+        # Índices usados por los borrados en bloque de hilos de comentarios
+        mongo_db.comments.create_index("rootComment")
+        mongo_db.comments.create_index("noteId")
+        mongo_db.note_files.create_index("noteId")
+
+    print("✅ Conexión a la base de datos y al almacén de documentos establecida correctamente.")
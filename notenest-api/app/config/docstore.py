@@ -0,0 +1,422 @@
+# Almacén de documentos embebido: implementa el subconjunto de la API de
+# PyMongo que usa el backend, en memoria o persistido en archivos locales.
+# Pensado para instalaciones de un solo nodo, CI y benchmarks, sin MongoDB.
+
+import copy
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+from pymongo.errors import DuplicateKeyError
+
+FSYNC = os.environ.get("DOCSTORE_FSYNC", "0") == "1"
+
+# ----------------------------------------------------------------------
+# Monitorización (equivalente a pymongo.monitoring para el almacén embebido)
+# ----------------------------------------------------------------------
+
+_listeners = []
+
+def register_listener(listener):
+    """Registra listener(colección, comando, filtro, segundos), llamado tras cada operación."""
+    _listeners.append(listener)
+
+def _monitored(command):
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, query=None, *args, **kwargs):
+            if not _listeners:
+                return method(self, query, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return method(self, query, *args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                spec = query if isinstance(query, dict) and command != "insert" else None
+                for listener in _listeners:
+                    listener(self.name, command, spec, elapsed)
+        return wrapper
+    return decorate
+
+# ----------------------------------------------------------------------
+# Consultas y actualizaciones
+# ----------------------------------------------------------------------
+
+def _compare(value, operator, expected):
+    if operator == "$in":
+        return value in expected
+    if operator == "$nin":
+        return value not in expected
+    if operator == "$ne":
+        return value != expected
+    if operator == "$exists":
+        return (value is not None) == bool(expected)
+    if value is None:
+        return False
+    if operator == "$gt":
+        return value > expected
+    if operator == "$gte":
+        return value >= expected
+    if operator == "$lt":
+        return value < expected
+    if operator == "$lte":
+        return value <= expected
+    raise ValueError(f"Operador no soportado: {operator}")
+
+def matches(doc, query):
+    """True si el documento cumple el filtro (igualdad y operadores de comparación)."""
+    for key, expected in (query or {}).items():
+        value = doc.get(key)
+        if isinstance(expected, dict) and expected and all(op.startswith("$") for op in expected):
+            if not all(_compare(value, op, arg) for op, arg in expected.items()):
+                return False
+        elif value != expected:
+            return False
+    return True
+
+def project(doc, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+    included = {key for key, flag in projection.items() if flag}
+    if included:
+        if projection.get("_id", 1):
+            included.add("_id")
+        return {key: copy.deepcopy(doc[key]) for key in included if key in doc}
+    return {key: copy.deepcopy(value) for key, value in doc.items() if key not in projection}
+
+def apply_update(doc, update):
+    for key, value in update.get("$set", {}).items():
+        doc[key] = copy.deepcopy(value)
+    for key, value in update.get("$inc", {}).items():
+        doc[key] = (doc.get(key) or 0) + value
+    for key in update.get("$unset", {}):
+        doc.pop(key, None)
+    for key, value in update.get("$push", {}).items():
+        doc.setdefault(key, []).append(copy.deepcopy(value))
+    unknown = set(update) - {"$set", "$inc", "$unset", "$push"}
+    if unknown:
+        raise ValueError(f"Operador de actualización no soportado: {', '.join(sorted(unknown))}")
+
+def _index_key(value):
+    # Las listas y dicts no son hashables; se indexan por su JSON
+    return json.dumps(value, sort_keys=True, default=str) if isinstance(value, (list, dict)) else value
+
+# ----------------------------------------------------------------------
+# Colecciones
+# ----------------------------------------------------------------------
+
+class Cursor:
+    def __init__(self, docs):
+        self._docs = docs
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key, direction=1):
+        if isinstance(key, list):
+            for field, order in reversed(key):
+                self.sort(field, order)
+            return self
+        # Los documentos sin el campo van primero en orden ascendente, como en MongoDB
+        self._docs.sort(key=lambda doc: (doc.get(key) is not None, doc.get(key)), reverse=direction < 0)
+        return self
+
+    def skip(self, count):
+        self._skip = count
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def __iter__(self):
+        end = self._skip + self._limit if self._limit else None
+        return iter(self._docs[self._skip:end])
+
+class Collection:
+    """
+    Colección en memoria con índices hash opcionales por campo. Si tiene un
+    diario (journal) cada escritura se añade al final del archivo, y al abrir
+    se reconstruye el estado repitiéndolo.
+    """
+
+    def __init__(self, name, journal=None):
+        self.name = name
+        self._docs = {}
+        self._indexes = {}  # campo -> {valor -> set(_id)}
+        self._lock = threading.RLock()
+        self._journal_path = journal
+        self._journal = None
+        self._journal_lines = 0
+        if journal:
+            self._replay()
+            if self._journal is None:
+                self._journal = open(journal, "a", encoding="utf-8")
+
+    # -- Persistencia ----------------------------------------------------
+
+    def _replay(self):
+        if not os.path.exists(self._journal_path):
+            return
+        with open(self._journal_path, encoding="utf-8") as handle:
+            for line in handle:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # Última línea a medio escribir tras una caída
+                self._journal_lines += 1
+                if entry["op"] == "put":
+                    self._docs[entry["doc"]["_id"]] = entry["doc"]
+                else:
+                    self._docs.pop(entry["_id"], None)
+        # Si el diario es mucho más largo que el estado vivo se compacta
+        if self._journal_lines > 2 * len(self._docs) + 1000:
+            self.compact()
+
+    def compact(self):
+        """Reescribe el diario con solo los documentos vivos (escritura atómica)."""
+        if not self._journal_path:
+            return
+        with self._lock:
+            tmp = self._journal_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as handle:
+                for doc in self._docs.values():
+                    handle.write(json.dumps({"op": "put", "doc": doc}, default=str) + "\n")
+                handle.flush()
+                os.fsync(handle.fileno())
+            if self._journal:
+                self._journal.close()
+            os.replace(tmp, self._journal_path)
+            self._journal_lines = len(self._docs)
+            self._journal = open(self._journal_path, "a", encoding="utf-8")
+
+    def _log(self, entries):
+        if self._journal is None:
+            return
+        self._journal.write("".join(json.dumps(entry, default=str) + "\n" for entry in entries))
+        self._journal.flush()
+        if FSYNC:
+            os.fsync(self._journal.fileno())
+        self._journal_lines += len(entries)
+
+    # -- Índices ---------------------------------------------------------
+
+    def create_index(self, keys, **kwargs):
+        field = keys if isinstance(keys, str) else keys[0][0]
+        with self._lock:
+            if field not in self._indexes:
+                index = {}
+                for doc_id, doc in self._docs.items():
+                    index.setdefault(_index_key(doc.get(field)), set()).add(doc_id)
+                self._indexes[field] = index
+        return f"{field}_1"
+
+    def _index_add(self, doc):
+        for field, index in self._indexes.items():
+            index.setdefault(_index_key(doc.get(field)), set()).add(doc["_id"])
+
+    def _index_remove(self, doc):
+        for field, index in self._indexes.items():
+            ids = index.get(_index_key(doc.get(field)))
+            if ids:
+                ids.discard(doc["_id"])
+
+    def _candidates(self, query):
+        """Documentos que podrían cumplir el filtro, usando _id o un índice si se puede."""
+        for field, expected in (query or {}).items():
+            values = None
+            if isinstance(expected, dict) and set(expected) == {"$in"}:
+                values = expected["$in"]
+            elif not isinstance(expected, dict):
+                values = [expected]
+            if values is None:
+                continue
+            if field == "_id":
+                return [self._docs[v] for v in values if not isinstance(v, (list, dict)) and v in self._docs]
+            if field in self._indexes:
+                index = self._indexes[field]
+                ids = set().union(*(index.get(_index_key(v), ()) for v in values))
+                return [self._docs[doc_id] for doc_id in ids]
+        return list(self._docs.values())
+
+    def _matching(self, query):
+        return [doc for doc in self._candidates(query) if matches(doc, query)]
+
+    # -- Lecturas --------------------------------------------------------
+
+    @_monitored("find")
+    def find(self, query=None, projection=None):
+        with self._lock:
+            return Cursor([project(doc, projection) for doc in self._matching(query)])
+
+    @_monitored("find")
+    def find_one(self, query=None, projection=None):
+        with self._lock:
+            found = self._matching(query)
+            return project(found[0], projection) if found else None
+
+    @_monitored("count")
+    def count_documents(self, query):
+        with self._lock:
+            return len(self._matching(query))
+
+    # -- Escrituras ------------------------------------------------------
+
+    def _put(self, doc):
+        previous = self._docs.get(doc["_id"])
+        if previous is not None:
+            self._index_remove(previous)
+        self._docs[doc["_id"]] = doc
+        self._index_add(doc)
+
+    @_monitored("insert")
+    def insert_one(self, document):
+        doc = copy.deepcopy(document)
+        doc.setdefault("_id", uuid.uuid4().hex)
+        with self._lock:
+            if doc["_id"] in self._docs:
+                raise DuplicateKeyError(f"E11000 duplicate key: {self.name} _id {doc['_id']}", code=11000)
+            self._put(doc)
+            self._log([{"op": "put", "doc": doc}])
+        document.setdefault("_id", doc["_id"])
+        return SimpleNamespace(inserted_id=doc["_id"])
+
+    def insert_many(self, documents):
+        return SimpleNamespace(inserted_ids=[self.insert_one(doc).inserted_id for doc in documents])
+
+    def _update(self, query, update, upsert, many):
+        with self._lock:
+            targets = self._matching(query)
+            if not many:
+                targets = targets[:1]
+            changed = []
+            for doc in targets:
+                updated = copy.deepcopy(doc)
+                apply_update(updated, update)
+                if updated != doc:
+                    self._put(updated)
+                    changed.append(updated)
+            upserted_id = None
+            if not targets and upsert:
+                doc = {key: copy.deepcopy(value) for key, value in query.items() if not isinstance(value, dict)}
+                apply_update(doc, update)
+                doc.setdefault("_id", uuid.uuid4().hex)
+                self._put(doc)
+                changed.append(doc)
+                upserted_id = doc["_id"]
+            self._log([{"op": "put", "doc": doc} for doc in changed])
+        return SimpleNamespace(
+            matched_count=len(targets),
+            modified_count=len(changed) - (1 if upserted_id is not None else 0),
+            upserted_id=upserted_id,
+        )
+
+    @_monitored("update")
+    def update_one(self, query, update, upsert=False):
+        return self._update(query, update, upsert, many=False)
+
+    @_monitored("update")
+    def update_many(self, query, update, upsert=False):
+        return self._update(query, update, upsert, many=True)
+
+    @_monitored("update")
+    def replace_one(self, query, replacement, upsert=False):
+        with self._lock:
+            found = self._matching(query)[:1]
+            if not found and not upsert:
+                return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+            doc = copy.deepcopy(replacement)
+            doc["_id"] = found[0]["_id"] if found else doc.get("_id", query.get("_id") or uuid.uuid4().hex)
+            self._put(doc)
+            self._log([{"op": "put", "doc": doc}])
+        return SimpleNamespace(
+            matched_count=len(found), modified_count=len(found), upserted_id=None if found else doc["_id"]
+        )
+
+    def _delete(self, query, many):
+        with self._lock:
+            targets = self._matching(query)
+            if not many:
+                targets = targets[:1]
+            for doc in targets:
+                self._index_remove(doc)
+                del self._docs[doc["_id"]]
+            self._log([{"op": "del", "_id": doc["_id"]} for doc in targets])
+        return SimpleNamespace(deleted_count=len(targets))
+
+    @_monitored("delete")
+    def delete_one(self, query):
+        return self._delete(query, many=False)
+
+    @_monitored("delete")
+    def delete_many(self, query):
+        return self._delete(query, many=True)
+
+    @_monitored("bulkWrite")
+    def bulk_write(self, requests, ordered=True):
+        """Acepta las operaciones de pymongo (UpdateOne, UpdateMany, DeleteOne, DeleteMany, InsertOne)."""
+        modified = deleted = inserted = 0
+        for op in requests:
+            kind = type(op).__name__
+            if kind == "InsertOne":
+                self.insert_one(op._doc)
+                inserted += 1
+            elif kind in ("UpdateOne", "UpdateMany"):
+                modified += self._update(op._filter, op._doc, op._upsert, many=kind == "UpdateMany").modified_count
+            elif kind in ("DeleteOne", "DeleteMany"):
+                deleted += self._delete(op._filter, many=kind == "DeleteMany").deleted_count
+            else:
+                raise ValueError(f"Operación no soportada en bulk_write: {kind}")
+        return SimpleNamespace(modified_count=modified, deleted_count=deleted, inserted_count=inserted)
+
+    def drop(self):
+        with self._lock:
+            self._docs.clear()
+            for index in self._indexes.values():
+                index.clear()
+            if self._journal_path:
+                self.compact()
+
+class DocumentDatabase:
+    """
+    Base de datos de documentos embebida. Con `path` cada colección se guarda
+    en <path>/<colección>.jsonl; sin él todo vive en memoria. Un solo proceso
+    debe abrir un mismo directorio (no hay coordinación entre procesos).
+    Se accede igual que en PyMongo: db.notes o db["notes"].
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._collections = {}
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(path, exist_ok=True)
+            for name in os.listdir(path):
+                if name.endswith(".jsonl"):
+                    self[name[:-len(".jsonl")]]
+
+    def __getitem__(self, name):
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is None:
+                journal = os.path.join(self.path, f"{name}.jsonl") if self.path else None
+                collection = self._collections[name] = Collection(name, journal)
+            return collection
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def list_collection_names(self):
+        with self._lock:
+            return list(self._collections)
+
+    def create_collection(self, name):
+        return self[name]
+
+    def compact(self):
+        for name in self.list_collection_names():
+            self[name].compact()
@@ -0,0 +1,233 @@
+# Réplicas de lectura de la base principal: las peticiones GET leen de una
+# réplica sana y el resto de la base principal. Tras una escritura el cliente
+# recibe un token de consistencia; mientras ninguna réplica haya aplicado los
+# cambios hasta ese momento, sus lecturas siguen yendo a la principal.
+
+import logging
+import os
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from itertools import count
+from flask import current_app, request
+from sqlalchemy import insert, select, update
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# URIs de las réplicas separadas por comas; vacío = todo en la base principal
+SQL_REPLICA_URLS = os.environ.get("SQL_REPLICA_URLS", "")
+# Retraso máximo (segundos) antes de dejar de leer de una réplica
+REPLICA_MAX_LAG = float(os.environ.get("REPLICA_MAX_LAG", "5"))
+# Cada cuánto se escribe el latido en la principal y se mide el retraso
+REPLICA_CHECK_INTERVAL = float(os.environ.get("REPLICA_CHECK_INTERVAL", "1"))
+# Vida de la cookie de consistencia: ventana tras una escritura en la que
+# el navegador o la app sin cabecera propia siguen leyendo lo que escribieron
+REPLICA_STICKY_SECONDS = int(os.environ.get("REPLICA_STICKY_SECONDS", "10"))
+
+CONSISTENCY_HEADER = "X-Consistency-Token"
+CONSISTENCY_COOKIE = "notenest_consistency"
+READ_SOURCE_HEADER = "X-Read-Source"
+READ_METHODS = frozenset({"GET", "HEAD"})
+# Clave de session.info con la réplica elegida para la petición
+_REPLICA = "replica"
+
+def replica_urls():
+    return [url.strip() for url in SQL_REPLICA_URLS.split(",") if url.strip()]
+
+def replica_bind_key(index):
+    return f"replica{index}"
+
+def reads_primary(view):
+    """Marca una vista GET que debe leer siempre de la base principal."""
+    view.reads_primary = True
+    return view
+
+class _ReplicaState:
+    __slots__ = ("applied", "lag", "healthy", "error")
+
+    def __init__(self):
+        self.applied = 0.0   # Último latido del primario visto en la réplica
+        self.lag = None      # Segundos de retraso en la última medida (None: sin medir)
+        self.healthy = False
+        self.error = None
+
+class ReplicaRouter:
+    """
+    Elige la réplica de cada petición de lectura y mide el retraso de todas.
+    Un hilo escribe cada REPLICA_CHECK_INTERVAL segundos un latido (la hora)
+    en la tabla replica_heartbeats de la principal y lo lee en cada réplica:
+    la diferencia es el retraso, y la réplica deja de usarse mientras supere
+    REPLICA_MAX_LAG o no responda. El latido leído también dice hasta qué
+    momento está al día la réplica, que es lo que se compara con el token.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._db = None
+        self._primary = None
+        self._table = None
+        self._engines = []
+        self._states = []
+        self._lock = threading.Lock()
+        self._round_robin = count()
+        self._thread = None
+        self.replica_reads = 0
+        self.primary_reads = 0
+
+    def init_app(self, app, db):
+        """Activa las réplicas si hay binds replicaN (ver app.config.db). Retorna si están activas."""
+        self._db = db
+        urls = app.config.get("SQL_REPLICA_URLS") or []
+        if not urls:
+            return False
+        from app.models.replica_heartbeat import ReplicaHeartbeat  # La tabla solo se crea con réplicas
+        with app.app_context():
+            self._primary = db.engine
+            self._engines = [db.engines[replica_bind_key(index)] for index in range(len(urls))]
+        self._table = ReplicaHeartbeat.__table__
+        self._states = [_ReplicaState() for _ in urls]
+        self.enabled = True
+        app.before_request(self._route_request)
+        app.after_request(self._mark_response)
+
+        from app.utils.metrics import registry
+        registry.register_collector(self._samples)
+        logger.info("📚 Lecturas repartidas entre %d réplicas", len(urls))
+        return True
+
+    def start(self, app):
+        """Primera medida del retraso y arranque del hilo que la repite (tras crear las tablas)."""
+        if not self.enabled or self._thread is not None:
+            return
+        self.check()
+        self._thread = threading.Thread(target=self._run, name="replica-monitor", daemon=True)
+        self._thread.start()
+
+    # -- Retraso ----------------------------------------------------------
+
+    def check(self):
+        """Escribe un latido en la principal y mide el retraso de cada réplica. Retorna los estados."""
+        beat = time.time()
+        table = self._table
+        with self._primary.begin() as connection:
+            if not connection.execute(update(table).where(table.c.id == 1).values(beat=beat)).rowcount:
+                connection.execute(insert(table).values(id=1, beat=beat))
+        for index, engine in enumerate(self._engines):
+            try:
+                with engine.connect() as connection:
+                    applied = connection.execute(select(table.c.beat).where(table.c.id == 1)).scalar()
+                error = None if applied is not None else "sin latido replicado"
+            except Exception as e:
+                applied, error = None, str(e).splitlines()[0]
+            self._update(index, beat, applied, error)
+        return self.status()
+
+    def _update(self, index, beat, applied, error):
+        with self._lock:
+            state = self._states[index]
+            was_healthy = state.healthy
+            if error is None:
+                state.applied = applied
+                state.lag = max(0.0, beat - applied)
+            state.error = error
+            state.healthy = error is None and state.lag <= REPLICA_MAX_LAG
+        if was_healthy and not state.healthy:
+            logger.warning("⚠️ Réplica %d retirada: %s", index, error or f"{state.lag:.1f} s de retraso")
+        elif state.healthy and not was_healthy:
+            logger.info("✅ Réplica %d disponible (%.1f s de retraso)", index, state.lag)
+
+    def status(self):
+        with self._lock:
+            return [{"replica": index, "healthy": state.healthy, "lag": state.lag, "error": state.error}
+                    for index, state in enumerate(self._states)]
+
+    def _run(self):
+        while True:
+            time.sleep(REPLICA_CHECK_INTERVAL)
+            try:
+                self.check()
+            except Exception as e:
+                logger.error("❌ Error midiendo el retraso de las réplicas: %s", str(e))
+                logger.debug(traceback.format_exc())
+
+    def _samples(self):
+        samples = [
+            ("counter", "notenest_replica_reads_total", (("target", "replica"),), self.replica_reads),
+            ("counter", "notenest_replica_reads_total", (("target", "primary"),), self.primary_reads),
+        ]
+        for entry in self.status():
+            labels = (("replica", str(entry["replica"])),)
+            samples.append(("gauge", "notenest_replica_healthy", labels, int(entry["healthy"])))
+            if entry["lag"] is not None:
+                samples.append(("gauge", "notenest_replica_lag_seconds", labels, round(entry["lag"], 3)))
+        return samples
+
+    # -- Elección ---------------------------------------------------------
+
+    def choose(self, token=None):
+        """
+        Réplica sana que ya aplicó los cambios hasta `token` (hora de la última
+        escritura del cliente), por turnos. None si ninguna sirve.
+        """
+        with self._lock:
+            candidates = [index for index, state in enumerate(self._states)
+                          if state.healthy and (token is None or state.applied >= token)]
+        if not candidates:
+            return None
+        return candidates[next(self._round_robin) % len(candidates)]
+
+    def _request_token(self):
+        value = request.headers.get(CONSISTENCY_HEADER) or request.cookies.get(CONSISTENCY_COOKIE)
+        try:
+            return float(value) if value else None
+        except ValueError:
+            return None
+
+    def _route_request(self):
+        if request.method not in READ_METHODS:
+            return
+        view = current_app.view_functions.get(request.endpoint)
+        if view is None or getattr(view, "reads_primary", False):
+            return
+        replica = self.choose(self._request_token())
+        if replica is None:
+            self.primary_reads += 1
+        else:
+            self.replica_reads += 1
+            self._db.session.info[_REPLICA] = replica
+
+    def _mark_response(self, response):
+        if request.method in READ_METHODS:
+            replica = self._db.session.info.get(_REPLICA)
+            response.headers[READ_SOURCE_HEADER] = "primary" if replica is None else replica_bind_key(replica)
+        elif response.status_code < 400:
+            # La escritura ya está confirmada: las lecturas con este token no irán a una réplica anterior
+            token = f"{time.time():.3f}"
+            response.headers[CONSISTENCY_HEADER] = token
+            response.set_cookie(CONSISTENCY_COOKIE, token, max_age=REPLICA_STICKY_SECONDS,
+                                httponly=True, samesite="Lax")
+        return response
+
+    def read_engine(self, session, clause):
+        """Motor de la réplica de la petición para una consulta SELECT; None si va a la principal."""
+        replica = session.info.get(_REPLICA)
+        if replica is None or clause is None or not getattr(clause, "is_select", False):
+            return None
+        if getattr(clause, "_for_update_arg", None) is not None:
+            return None  # SELECT ... FOR UPDATE bloquea filas: solo en la principal
+        return self._engines[replica]
+
+    @contextmanager
+    def primary(self):
+        """Las consultas dentro del bloque leen de la base principal."""
+        info = self._db.session.info if self.enabled else {}
+        replica = info.pop(_REPLICA, None)
+        try:
+            yield
+        finally:
+            if replica is not None:
+                info[_REPLICA] = replica
+
+replica_router = ReplicaRouter()
@@ -0,0 +1,349 @@
+# Reparto horizontal (sharding) por user_id entre varias bases de datos SQL:
+# las notas, sus archivos, likes y trabajos de limpieza, y las sesiones viven
+# en la base del dueño; los comentarios en la de su nota. Usuarios, blobs y
+# claves de idempotencia siguen en la base principal.
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from heapq import merge
+from itertools import chain, islice
+from flask import current_app, request
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import MetaData, event, inspect, select
+from sqlalchemy.orm import Session as SessionBase
+from sqlalchemy.sql.util import find_tables
+from app.config.replicas import replica_router
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# URIs de los shards separadas por comas; vacío = una sola base (sin sharding)
+SQL_SHARD_URLS = os.environ.get("SQL_SHARD_URLS", "")
+# Hilos para las consultas que se reparten entre todos los shards
+SHARD_SCATTER_WORKERS = int(os.environ.get("SHARD_SCATTER_WORKERS", "8"))
+# Segundos que un proceso recuerda dónde está un usuario o una nota (acota lo que
+# tarda en verse un traslado de shard-rebalance en los demás procesos)
+SHARD_PLACEMENT_TTL = float(os.environ.get("SHARD_PLACEMENT_TTL", "30"))
+SHARD_LOOKUP_CACHE = int(os.environ.get("SHARD_LOOKUP_CACHE", "100000"))
+
+SHARDED_TABLES = frozenset({"notes", "note_files", "comments", "note_likes", "note_cleanup_jobs", "sessions",
+                            "user_data_versions"})
+# Clave de session.info con el shard de la petición (o una función que lo calcula)
+_CURRENT = "shard"
+# Parámetros de la ruta y del cuerpo que deciden el shard, por orden de prioridad
+# (tabla donde buscar el id, o None si es un user_id)
+_ROUTE_ARGS = (("note_id", "notes"), ("comment_id", "comments"), ("file_id", "note_files"), ("user_id", None))
+_BODY_KEYS = (("noteId", "notes"), ("parentId", "comments"), ("userId", None))
+
+def shard_urls():
+    return [url.strip() for url in SQL_SHARD_URLS.split(",") if url.strip()]
+
+def shard_bind_key(index):
+    return f"shard{index}"
+
+class ShardError(RuntimeError):
+    """Sentencia sobre una tabla repartida sin shard elegido."""
+
+def shard_metadata(metadata):
+    """
+    Copia de las tablas repartidas para crearlas en cada shard, sin las claves
+    foráneas hacia tablas que solo existen en la base principal (users).
+    """
+    copy = MetaData()
+    for name in sorted(SHARDED_TABLES):
+        metadata.tables[name].to_metadata(copy)
+    for table in copy.tables.values():
+        for constraint in list(table.foreign_key_constraints):
+            if constraint.elements[0].target_fullname.split(".")[0] not in SHARDED_TABLES:
+                table.constraints.discard(constraint)
+                for element in constraint.elements:
+                    element.parent.foreign_keys.discard(element)
+                    table.foreign_keys.discard(element)
+    return copy
+
+class RoutingSession(FlaskSession):
+    """
+    Sesión de Flask-SQLAlchemy que, con sharding activo, envía las sentencias
+    sobre tablas repartidas al shard elegido para la petición, y con réplicas
+    de lectura, los SELECT del resto a la réplica elegida para la petición
+    (ver app/config/replicas.py); lo demás va a la base principal como siempre.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and shard_router.enabled and shard_router.is_sharded(mapper, clause):
+            return shard_router.engine(self.current_shard())
+        if bind is None and replica_router.enabled:
+            engine = replica_router.read_engine(self, clause)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def current_shard(self):
+        shard = self.info.get(_CURRENT)
+        if callable(shard):
+            shard = self.info[_CURRENT] = shard()
+        if shard is None:
+            raise ShardError("Consulta a una tabla repartida sin shard elegido")
+        return shard
+
+class ShardRouter:
+    """
+    Elige el shard de cada petición y reparte las consultas globales.
+    El shard de un usuario es el de su fila en user_shards o, si no la tiene,
+    el de rendezvous hashing sobre los shards configurados (añadir un shard
+    solo cambia el preferido de 1/N de los usuarios). Las notas, comentarios y
+    archivos se localizan por id preguntando a todos los shards a la vez, y
+    el resultado se recuerda SHARD_PLACEMENT_TTL segundos.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.count = 1
+        self.tables = {}
+        self._engines = []
+        self._db = None
+        self._scatter_pool = None
+        self._lookup_pool = None
+        self._cache = OrderedDict()  # (tabla, columna, valor) -> (shard, expira)
+        self._lock = threading.Lock()
+        self._installed = False
+        self.scatters = 0
+        self.lookups = 0
+
+    def init_app(self, app, db):
+        """Activa el reparto si hay shards en SQLALCHEMY_BINDS (ver app.config.db). Retorna si está activo."""
+        self._db = db
+        urls = app.config.get("SQL_SHARD_URLS") or []
+        if not urls:
+            return False
+        with app.app_context():
+            self._engines = [db.engines[shard_bind_key(index)] for index in range(len(urls))]
+        self.count = len(urls)
+        self.tables = {name: db.metadata.tables[name] for name in SHARDED_TABLES}
+        self.enabled = True
+        if self._scatter_pool is None:
+            self._scatter_pool = ThreadPoolExecutor(SHARD_SCATTER_WORKERS, thread_name_prefix="shard-scatter")
+            self._lookup_pool = ThreadPoolExecutor(SHARD_SCATTER_WORKERS, thread_name_prefix="shard-lookup")
+        app.before_request(self._route_request)
+        if not self._installed:
+            event.listen(SessionBase, "after_flush", self._remember_new)
+            self._installed = True
+
+        from app.utils.metrics import registry
+        registry.register_collector(lambda: [
+            ("gauge", "notenest_shards", (), self.count),
+            ("counter", "notenest_shard_scatter_total", (), self.scatters),
+            ("counter", "notenest_shard_lookups_total", (), self.lookups),
+        ])
+        logger.info("🧩 Sharding activo con %d bases de datos", self.count)
+        return True
+
+    def create_all(self):
+        """Crea las tablas repartidas en cada shard (la base principal las crea db.create_all)."""
+        if not self.enabled:
+            return
+        metadata = shard_metadata(self._db.metadata)
+        for engine in self._engines:
+            metadata.create_all(engine)
+
+    def engine(self, shard):
+        return self._engines[shard]
+
+    def is_sharded(self, mapper, clause):
+        if mapper is not None:
+            return inspect(mapper).local_table.name in SHARDED_TABLES
+        if clause is None:
+            return False
+        return any(table.name in SHARDED_TABLES for table in find_tables(clause, include_crud=True))
+
+    # -- Ubicación --------------------------------------------------------
+
+    def preferred_shard(self, user_id):
+        """Shard de rendezvous hashing para un usuario (donde se crean sus datos)."""
+        return max(range(self.count), key=lambda shard: hashlib.sha1(f"{shard}:{user_id}".encode("utf-8")).digest())
+
+    def shard_for_user(self, user_id):
+        """Shard con los datos del usuario (0 sin sharding)."""
+        if not self.enabled or not user_id:
+            return 0
+        key = ("user_shards", "user_id", user_id)
+        shard = self._cached(key)
+        if shard is None:
+            from app.models.user_shard import UserShard
+            shard = self._db.session.execute(select(UserShard.shard).where(UserShard.user_id == user_id)).scalar()
+            if shard is None or shard >= self.count:
+                shard = self.preferred_shard(user_id)
+            self._remember(key, shard)
+        return shard
+
+    def locate(self, model, value, column=None):
+        """
+        Shard donde está la fila con `column` = `value` (por defecto la clave
+        primaria de `model`). Retorna None si no está en ninguno, y 0 sin sharding.
+        """
+        if not self.enabled:
+            return 0
+        if not value:
+            return None
+        table = getattr(model, "__table__", model)
+        column = table.primary_key.columns.values()[0] if column is None else column
+        key = (table.name, column.key, value)
+        shard = self._cached(key)
+        if shard is not None:
+            return shard
+        self.lookups += 1
+        statement = select(column).where(column == value).limit(1)
+        hits = list(self._lookup_pool.map(lambda engine: _exists(engine, statement), self._engines))
+        shard = hits.index(True) if True in hits else None
+        if shard is not None:
+            self._remember(key, shard)
+        return shard
+
+    def forget(self, table, column, value):
+        with self._lock:
+            self._cache.pop((table, column, value), None)
+
+    def _cached(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                return None
+            self._cache.move_to_end(key)
+            return entry[0]
+
+    def _remember(self, key, shard):
+        with self._lock:
+            self._cache[key] = (shard, time.monotonic() + SHARD_PLACEMENT_TTL)
+            self._cache.move_to_end(key)
+            while len(self._cache) > SHARD_LOOKUP_CACHE:
+                self._cache.popitem(last=False)
+
+    def _remember_new(self, session, flush_context):
+        shard = session.info.get(_CURRENT)
+        if not self.enabled or not isinstance(shard, int):
+            return
+        for instance in session.new:
+            table = getattr(instance, "__table__", None)
+            if table is not None and table.name in ("notes", "comments", "note_files"):
+                self._remember((table.name, "id", instance.id), shard)
+
+    # -- Elección del shard -----------------------------------------------
+
+    def _route_request(self):
+        target = self._request_target()
+        if target is not None:
+            # Se resuelve en la primera sentencia que lo necesite: muchas rutas no tocan los shards
+            self._db.session.info[_CURRENT] = lambda: self.resolve(*target)
+
+    def _request_target(self):
+        view_args = request.view_args or {}
+        for name, table in _ROUTE_ARGS:
+            if view_args.get(name):
+                return table, view_args[name]
+        body = request.get_json(silent=True) if request.is_json else None
+        if isinstance(body, dict):
+            for key, table in _BODY_KEYS:
+                if isinstance(body.get(key), str) and body[key]:
+                    return table, body[key]
+        return None
+
+    def resolve(self, table, value):
+        """Shard para un user_id (table None) o para el id de una fila de `table`."""
+        if not self.enabled:
+            return 0
+        if table is None:
+            return self.shard_for_user(value)
+        shard = self.locate(self.tables[table], value)
+        if shard is None and table == "notes":
+            # /noteCleanup consulta notas que ya no existen
+            shard = self.locate(self.tables["note_cleanup_jobs"], value)
+        # Si no existe en ningún shard cualquiera responde "no encontrado"
+        return 0 if shard is None else shard
+
+    def use(self, shard):
+        """Fija el shard de la sesión actual (las sentencias siguientes van a él)."""
+        if self.enabled:
+            self._db.session.info[_CURRENT] = shard
+
+    @contextmanager
+    def using(self, shard):
+        """Como use, restaurando el shard anterior al salir."""
+        if not self.enabled:
+            yield
+            return
+        info = self._db.session.info
+        previous = info.get(_CURRENT)
+        info[_CURRENT] = shard
+        try:
+            yield
+        finally:
+            info[_CURRENT] = previous
+
+    def each(self):
+        """Recorre los shards uno tras otro con la sesión actual apuntando a cada uno."""
+        if not self.enabled:
+            yield 0
+            return
+        for shard in range(self.count):
+            with self.using(shard):
+                yield shard
+
+    def loader(self, model, load=None):
+        """Envuelve una carga por id para que busque primero en qué shard está la fila."""
+        def fetch(entity_id):
+            if load:
+                return load(entity_id)
+            from app.config.db import db
+            return db.session.get(model, entity_id)
+
+        def sharded_load(entity_id):
+            if not self.enabled:
+                return fetch(entity_id)
+            shard = self.locate(model, entity_id)
+            if shard is None:
+                return None
+            with self.using(shard):
+                return fetch(entity_id)
+        return sharded_load
+
+    # -- Consultas repartidas ---------------------------------------------
+
+    def scatter(self, fn):
+        """
+        Ejecuta fn() en todos los shards a la vez, cada uno en su propio hilo,
+        contexto de aplicación y sesión. Retorna la lista de resultados por
+        shard. Sin sharding retorna [fn()].
+        """
+        if not self.enabled:
+            return [fn()]
+        app = current_app._get_current_object()
+
+        def run(shard):
+            with app.app_context():
+                self.use(shard)
+                return fn()
+
+        self.scatters += 1
+        return list(self._scatter_pool.map(run, range(self.count)))
+
+    def gather(self, fn, key=None, reverse=False, limit=None):
+        """
+        Une en una lista las filas que fn() retorna en cada shard. Con `key`,
+        cada shard debe retornarlas ya ordenadas y se mezclan con un merge de
+        k vías (sin reordenar todo); `limit` corta el resultado.
+        """
+        parts = self.scatter(fn)
+        rows = merge(*parts, key=key, reverse=reverse) if key else chain.from_iterable(parts)
+        return list(islice(rows, limit))
+
+def _exists(engine, statement):
+    with engine.connect() as connection:
+        return connection.execute(statement).first() is not None
+
+shard_router = ShardRouter()
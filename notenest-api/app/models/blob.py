@@ -0,0 +1,39 @@
+from datetime import datetime
+from app.config.db import db
+
+class Blob(db.Model):
+    """
+    Contenido de un archivo adjunto, identificado por su SHA-256.
+    Varios NoteFile pueden apuntar al mismo blob; ref_count cuenta cuántos
+    lo usan y cuando llega a cero el contenido se borra del disco.
+    """
+    __tablename__ = 'blobs'
+
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    content_type = db.Column(db.String(100), nullable=True)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __init__(self, sha256=None, size=0, content_type=None, ref_count=0):
+        self.sha256 = sha256
+        self.size = size
+        self.content_type = content_type
+        self.ref_count = ref_count
+        self.created_at = datetime.utcnow()
+        self.updated_at = datetime.utcnow()
+
+    @property
+    def url(self):
+        return f"/api/blobs/{self.sha256}"
+
+    def to_dict(self):
+        return {
+            'blobId': self.sha256,
+            'size': self.size,
+            'contentType': self.content_type,
+            'url': self.url,
+            'refCount': self.ref_count,
+            'createdAt': self.created_at.isoformat() if self.created_at else None
+        }
@@ -2,6 +2,7 @@ from datetime import datetime
 import uuid
 from app.config.db import db
 from marshmallow import Schema, fields
+from app.utils.compression import CompressedText
 
 class Comment(db.Model):
     __tablename__ = "comments"
@@ -10,13 +11,16 @@ class Comment(db.Model):
     user_id      = db.Column(db.String(36), db.ForeignKey("users.id"), nullable=False)
     user_name    = db.Column(db.String(100))
     note_id      = db.Column(db.String(36), db.ForeignKey("notes.id"), nullable=False)
-    parent_id    = db.Column(db.String(36), db.ForeignKey("comments.id"))
-    root_comment = db.Column(db.String(36), nullable=False)
-    content      = db.Column(db.Text, nullable=False)
+    parent_id    = db.Column(db.String(36), db.ForeignKey("comments.id"), index=True)
+    root_comment = db.Column(db.String(36), nullable=False, index=True)
+    # Columna "content" tal como se guarda (comprimida si es larga); `content` es el texto
+    stored_content = db.Column("content", db.Text, nullable=False)
+    content        = CompressedText("stored_content")
     created_at   = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at   = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-    user = db.relationship("User", backref="comments", lazy="joined")
+    # Carga perezosa: to_dict no usa el usuario y un JOIN en cada consulta sobra
+    user = db.relationship("User", backref="comments", lazy="select")
 
     def __init__(
         self,
@@ -45,6 +49,13 @@ class Comment(db.Model):
         return value.isoformat() if value else None
 
     def to_dict(self):
+        return self._as_dict(self.content)
+
+    def to_document(self):
+        """Como to_dict, pero con el contenido tal como se guarda (comprimido) para MongoDB."""
+        return self._as_dict(self.stored_content)
+
+    def _as_dict(self, content):
         return {
             "_id":         self.id,  # MongoDB compatibility
             "id":          self.id,
@@ -53,7 +64,7 @@ class Comment(db.Model):
             "noteId":      self.note_id,
             "parentId":    self.parent_id,
             "rootComment": self.root_comment,
-            "content":     self.content,
+            "content":     content,
             "createdAt":   self._dt(self.created_at),
             "updatedAt":   self._dt(self.updated_at),
         }
@@ -0,0 +1,19 @@
+from datetime import datetime
+from app.config.db import db
+
+class IdempotencyKey(db.Model):
+    """
+    Respuesta guardada de una escritura con cabecera Idempotency-Key, para
+    que los reintentos la reciban tal cual aunque el proceso se haya reiniciado.
+    """
+    __tablename__ = 'idempotency_keys'
+
+    # SHA-256 de "método ruta clave"
+    scope_hash = db.Column(db.String(64), primary_key=True)
+    # SHA-256 del cuerpo de la petición original
+    fingerprint = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.Integer, nullable=False)
+    content_type = db.Column(db.String(100), nullable=True)
+    body = db.Column(db.LargeBinary, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -2,6 +2,7 @@ from datetime import datetime
 import uuid
 from app.config.db import db
 from marshmallow import Schema, fields
+from app.utils.compression import CompressedText
 
 class Note(db.Model):
     __tablename__ = 'notes'
@@ -9,13 +10,30 @@ class Note(db.Model):
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
     title = db.Column(db.String(100), nullable=False)
-    content = db.Column(db.Text, nullable=True)
+    # Columna "content" tal como se guarda (comprimida si es larga); `content` es el texto
+    stored_content = db.Column("content", db.Text, nullable=True)
+    content = CompressedText("stored_content")
     is_public = db.Column(db.Boolean, default=False)
     likes = db.Column(db.Integer, default=0)
+    # Contadores desnormalizados: los mantienen los endpoints de comentarios y archivos
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    file_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Marca de borrado: la limpieza real la hace un trabajo en segundo plano
+    deleted_at = db.Column(db.DateTime, nullable=True, index=True)
 
-    def __init__(self, id=None, user_id=None, title=None, content=None, is_public=False, likes=0, created_at=None, updated_at=None):
+    @classmethod
+    def active(cls):
+        """Consulta base que excluye las notas marcadas como eliminadas."""
+        return cls.query.filter(cls.deleted_at.is_(None))
+
+    @classmethod
+    def get_active(cls, note_id):
+        """Retorna la nota si existe y no está marcada como eliminada."""
+        return cls.active().filter(cls.id == note_id).first()
+
+    def __init__(self, id=None, user_id=None, title=None, content=None, is_public=False, likes=0, created_at=None, updated_at=None, comment_count=None, file_count=None):
         self.id = id or str(uuid.uuid4())
         self.user_id = user_id
         self.title = title
@@ -24,22 +42,37 @@ class Note(db.Model):
         self.likes = likes
         self.created_at = created_at or datetime.utcnow()
         self.updated_at = updated_at or datetime.utcnow()
+        # Solo se asignan si vienen explícitos, para que un merge no pise los valores guardados
+        if comment_count is not None:
+            self.comment_count = comment_count
+        if file_count is not None:
+            self.file_count = file_count
 
     def to_dict(self, include_sensitive=False):
+        return self._as_dict(self.content)
+
+    def to_document(self):
+        """Como to_dict, pero con el contenido tal como se guarda (comprimido) para MongoDB."""
+        return self._as_dict(self.stored_content)
+
+    def _as_dict(self, content):
         return {
             '_id': self.id,  # útil para MongoDB
             'id': self.id,
             'userId': self.user_id,
             'title': self.title,
-            'content': self.content,
+            'content': content,
             'isPublic': self.is_public,
             'likes': self.likes,
+            'commentCount': self.comment_count or 0,
+            'fileCount': self.file_count or 0,
             'createdAt': self.created_at.isoformat() if self.created_at else None,
             'updatedAt': self.updated_at.isoformat() if self.updated_at else None
         }
 
     @staticmethod
     def from_dict(data):
+        # commentCount y fileCount no se leen: el servidor es el dueño de esos contadores
         return Note(
             id=data.get('id') or data.get('_id'),
             user_id=data['userId'],
@@ -59,5 +92,7 @@ class NoteSchema(Schema):
     content = fields.Str(allow_none=True)
     isPublic = fields.Bool(attribute="is_public")
     likes = fields.Int()
+    commentCount = fields.Int(attribute="comment_count")
+    fileCount = fields.Int(attribute="file_count")
     createdAt = fields.DateTime(attribute="created_at")
     updatedAt = fields.DateTime(attribute="updated_at")
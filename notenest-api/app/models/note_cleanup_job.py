@@ -0,0 +1,45 @@
+from datetime import datetime
+from app.config.db import db
+
+class NoteCleanupJob(db.Model):
+    """
+    Trabajo de limpieza en segundo plano de una nota eliminada.
+    Guarda la fase y el progreso para poder reanudarse tras una caída.
+    """
+    __tablename__ = 'note_cleanup_jobs'
+
+    # Fases en el orden en que se ejecutan
+    PHASES = ('comments', 'files', 'mongo', 'note', 'done')
+
+    note_id = db.Column(db.String(36), primary_key=True)
+    phase = db.Column(db.String(20), nullable=False, default='comments')
+    comments_deleted = db.Column(db.Integer, nullable=False, default=0)
+    files_deleted = db.Column(db.Integer, nullable=False, default=0)
+    mongo_deleted = db.Column(db.Integer, nullable=False, default=0)
+    # Concesión del trabajo: evita que dos procesos lo ejecuten a la vez
+    locked_until = db.Column(db.DateTime, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __init__(self, note_id=None, phase='comments'):
+        self.note_id = note_id
+        self.phase = phase
+        self.comments_deleted = 0
+        self.files_deleted = 0
+        self.mongo_deleted = 0
+        self.created_at = datetime.utcnow()
+        self.updated_at = datetime.utcnow()
+
+    def to_dict(self):
+        return {
+            'noteId': self.note_id,
+            'phase': self.phase,
+            'done': self.phase == 'done',
+            'commentsDeleted': self.comments_deleted,
+            'filesDeleted': self.files_deleted,
+            'mongoDeleted': self.mongo_deleted,
+            'error': self.error,
+            'createdAt': self.created_at.isoformat() if self.created_at else None,
+            'updatedAt': self.updated_at.isoformat() if self.updated_at else None
+        }
@@ -1,4 +1,5 @@
 from app.config.db import db
+from app.utils.previews import thumbnail_url, preview_url
 from marshmallow import Schema, fields
 import uuid
 
@@ -8,21 +9,27 @@ class NoteFile(db.Model):
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     note_id = db.Column(db.String(36), db.ForeignKey('notes.id', ondelete='CASCADE'), nullable=False)
     file_url = db.Column(db.String(255), nullable=False)
+    # SHA-256 del contenido cuando el archivo está en el almacén local de blobs
+    blob_sha256 = db.Column(db.String(64), nullable=True, index=True)
 
     # Relación inversa opcional
     note = db.relationship('Note', backref=db.backref('files', cascade='all, delete-orphan', lazy=True))
 
-    def __init__(self, id=None, note_id=None, file_url=None):
+    def __init__(self, id=None, note_id=None, file_url=None, blob_sha256=None):
         self.id = id or str(uuid.uuid4())
         self.note_id = note_id
-        self.file_url = file_url
+        self.blob_sha256 = blob_sha256
+        self.file_url = file_url or (f"/api/blobs/{blob_sha256}" if blob_sha256 else None)
 
     def to_dict(self):
         return {
             '_id': self.id,  # Para MongoDB
             'id': self.id,
             'noteId': self.note_id,
-            'fileUrl': self.file_url
+            'fileUrl': self.file_url,
+            'blobId': self.blob_sha256,
+            'thumbnailUrl': thumbnail_url(self.blob_sha256),
+            'previewUrl': preview_url(self.blob_sha256)
         }
 
     @staticmethod
@@ -30,9 +37,14 @@ class NoteFile(db.Model):
         return NoteFile(
             id=data.get('id') or data.get('_id'),
             note_id=data['noteId'],
-            file_url=data['fileUrl']
+            file_url=data.get('fileUrl'),
+            blob_sha256=data.get('blobId')
         )
 class NoteFileSchema(Schema):
     id = fields.Str()
     noteId = fields.Str(attribute='note_id')
     fileUrl = fields.Str(attribute='file_url')
+    blobId = fields.Str(attribute='blob_sha256', allow_none=True)
+    # Solo tienen valor cuando el pipeline de vistas previas ya las generó
+    thumbnailUrl = fields.Function(lambda obj: thumbnail_url(obj.blob_sha256))
+    previewUrl = fields.Function(lambda obj: preview_url(obj.blob_sha256))
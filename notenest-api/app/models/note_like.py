@@ -0,0 +1,13 @@
+from datetime import datetime
+from app.config.db import db
+
+class NoteLike(db.Model):
+    """
+    "Me gusta" de un usuario a una nota. La clave primaria (usuario, nota)
+    impide que el mismo usuario sume dos veces a notes.likes.
+    """
+    __tablename__ = 'note_likes'
+
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), primary_key=True)
+    note_id = db.Column(db.String(36), db.ForeignKey('notes.id'), primary_key=True, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
@@ -0,0 +1,12 @@
+from app.config.db import db
+
+class ReplicaHeartbeat(db.Model):
+    """
+    Latido que se escribe en la base principal cada REPLICA_CHECK_INTERVAL
+    segundos (solo con réplicas de lectura). Leído en una réplica indica hasta
+    qué momento ha aplicado los cambios del primario.
+    """
+    __tablename__ = 'replica_heartbeats'
+
+    id = db.Column(db.Integer, primary_key=True)
+    beat = db.Column(db.Float, nullable=False)  # time.time() del proceso que lo escribió
@@ -0,0 +1,21 @@
+from datetime import datetime
+from app.config.db import db
+
+class UsageStats(db.Model):
+    """
+    Contadores de uso ya agregados: una fila por usuario (scope = su id) y
+    otra con los totales (scope = "global"). Los procesos suman aquí cada
+    pocos segundos lo que han contado; reconcile-stats los recalcula.
+    """
+    __tablename__ = 'usage_stats'
+
+    GLOBAL = "global"
+
+    scope = db.Column(db.String(36), primary_key=True)
+    users = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Solo en la fila global
+    notes = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    public_notes = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    likes_received = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    comments = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    reconciled_at = db.Column(db.DateTime, nullable=True)
@@ -13,7 +13,8 @@ class User(db.Model):
     salt = db.Column(db.LargeBinary, nullable=False)
     token = db.Column(db.String(36), unique=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Indexada: el directorio de usuarios lee solo las filas cambiadas desde su última sincronización
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     def __init__(self, id=None, email=None, name=None, password_hash=None, salt=None, token=None, created_at=None, updated_at=None):
         self.id = id or str(uuid.uuid4())
@@ -63,3 +64,9 @@ class UserSchema(Schema):
     # Optional fields for debug or internal API
     passwordHash = fields.Str(attribute='password_hash', dump_only=True)
     salt = fields.Str(attribute='salt', dump_only=True)
+
+# Esquema público para listados y búsquedas: sin hash, salt ni token
+class PublicUserSchema(Schema):
+    id = fields.Str()
+    email = fields.Str()
+    name = fields.Str()
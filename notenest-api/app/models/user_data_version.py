@@ -0,0 +1,15 @@
+from datetime import datetime
+from app.config.db import db
+
+class UserDataVersion(db.Model):
+    """
+    Versión de los datos de un usuario para /sync/bootstrap: cada transacción
+    que cambia sus notas, archivos o comentarios escribe un token nuevo. Con
+    sharding está en el shard del usuario, junto a sus notas, para cambiar en
+    la misma transacción.
+    """
+    __tablename__ = 'user_data_versions'
+
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), primary_key=True)
+    token = db.Column(db.String(32), nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
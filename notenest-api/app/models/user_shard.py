@@ -0,0 +1,13 @@
+from datetime import datetime
+from app.config.db import db
+
+class UserShard(db.Model):
+    """
+    Shard donde están los datos de un usuario (solo con sharding activo).
+    Se fija al registrarse; shard-rebalance la cambia al trasladar sus datos.
+    """
+    __tablename__ = 'user_shards'
+
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), primary_key=True)
+    shard = db.Column(db.Integer, nullable=False, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
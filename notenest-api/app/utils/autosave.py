@@ -0,0 +1,352 @@
+# Agrupación en memoria del autoguardado del editor: las llamadas a
+# updateNote con "autosave": true sobre la misma nota se acumulan durante una
+# ventana corta y solo el estado final se guarda, con una escritura en SQL y
+# otra en MongoDB, en lugar de una lectura, una escritura y un $set por tecla.
+
+import atexit
+import logging
+import os
+import signal
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from itertools import count
+from sqlalchemy import update
+from app.config.db import db
+from app.config.shards import shard_router
+from app.models.note import Note
+from app.utils.entity_cache import entity_cache
+from app.utils.events import publish_note_event
+from app.utils.text_patch import PatchError, VersionMismatch, apply_note_update, content_hash
+from app.utils.usage_stats import usage_stats
+from app.utils.bootstrap import mark_user_data_changed
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Segundos sin cambios tras los que se guarda una nota; 0 desactiva la agrupación
+NOTE_AUTOSAVE_WINDOW = float(os.environ.get("NOTE_AUTOSAVE_WINDOW", "0"))
+# Segundos como máximo entre el primer cambio pendiente y su escritura
+NOTE_AUTOSAVE_MAX_DELAY = float(os.environ.get("NOTE_AUTOSAVE_MAX_DELAY", "5"))
+# Notas con cambios pendientes a la vez; por encima, updateNote escribe directamente
+NOTE_AUTOSAVE_MAX_PENDING = int(os.environ.get("NOTE_AUTOSAVE_MAX_PENDING", "10000"))
+# Segundos de espera antes de reintentar una escritura que falló (se duplica en cada fallo, hasta 60)
+NOTE_AUTOSAVE_RETRY = float(os.environ.get("NOTE_AUTOSAVE_RETRY", "1"))
+# Intentos como máximo; después se descartan los cambios y se publica note.autosaveFailed
+NOTE_AUTOSAVE_MAX_ATTEMPTS = int(os.environ.get("NOTE_AUTOSAVE_MAX_ATTEMPTS", "8"))
+
+# Nombres de MongoDB (los de apply_note_update) -> atributos del modelo
+_SQL_FIELDS = {"content": "stored_content", "title": "title", "isPublic": "is_public", "updatedAt": "updated_at"}
+
+def _stored(note):
+    """Valores guardados de los campos que escribe el autoguardado."""
+    return {attr: getattr(note, attr) for attr in _SQL_FIELDS.values()}
+
+class _Pending:
+    """
+    Estado acumulado de una nota: una copia desligada de la sesión, los
+    campos cambiados, lo que se leyó de la base de datos (el UPDATE solo se
+    aplica si la fila sigue así) y las peticiones, para reaplicarlas si
+    otro proceso escribe la nota antes.
+    """
+    __slots__ = ("note", "loaded", "requests", "changes", "version", "first", "deadline", "not_before",
+                 "attempts", "lock", "closed")
+
+    def __init__(self, note, now, deadline):
+        self.note = note
+        self.loaded = _stored(note)
+        self.requests = []
+        self.changes = {}
+        self.version = 0
+        self.first = now
+        self.deadline = deadline
+        self.not_before = 0.0  # Tras un fallo, no se reintenta antes
+        self.attempts = 0  # Escrituras fallidas
+        self.lock = threading.Lock()
+        self.closed = False  # Ya escrita (o descartada): las peticiones nuevas abren otra
+
+    def rebase(self, note):
+        """
+        Reaplica las peticiones sobre `note`, lo guardado ahora. Lanza
+        VersionMismatch si un parche se calculó sobre un contenido que otro
+        proceso ya reemplazó (o PatchError), sin cambiar el estado pendiente.
+        """
+        loaded, changes, now = _stored(note), {}, datetime.utcnow()
+        for data in self.requests:
+            changes.update(apply_note_update(note, data, now))
+        self.note, self.loaded, self.changes = note, loaded, changes
+
+class NoteAutosave:
+    """
+    Cambios de autoguardado pendientes por nota. Cada petición se aplica sobre
+    el estado pendiente (los parches se validan contra su contentHash) y
+    recibe 202 con el número de versión pendiente; un hilo guarda la nota
+    cuando lleva NOTE_AUTOSAVE_WINDOW segundos sin cambios o
+    NOTE_AUTOSAVE_MAX_DELAY desde el primero, y publica note.updated con esa
+    versión. Todo lo pendiente se guarda también al cerrar el proceso.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.window = NOTE_AUTOSAVE_WINDOW
+        self.max_delay = NOTE_AUTOSAVE_MAX_DELAY
+        self._app = None
+        self._pending = {}  # note_id -> _Pending
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._versions = count(1)
+        self._thread = None
+        self.coalesced = 0  # Peticiones absorbidas por una escritura posterior
+        self.flushes = 0
+        self.conflicts = 0  # Escrituras descartadas porque otro proceso cambió la base de un parche
+        self.retries = 0
+        self.failures = 0  # Escrituras descartadas tras NOTE_AUTOSAVE_MAX_ATTEMPTS intentos (o al cerrar)
+
+    def init_app(self, app):
+        """Arranca el hilo de escritura si NOTE_AUTOSAVE_WINDOW > 0. Retorna si está activo."""
+        self.window = float(app.config.get("NOTE_AUTOSAVE_WINDOW", NOTE_AUTOSAVE_WINDOW))
+        self.max_delay = max(self.window, float(app.config.get("NOTE_AUTOSAVE_MAX_DELAY", NOTE_AUTOSAVE_MAX_DELAY)))
+        if self.window <= 0 or self._thread is not None:
+            return self.enabled
+        self._app = app
+        self.enabled = True
+        self._thread = threading.Thread(target=self._run, name="note-autosave", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush_all)
+        _exit_on_sigterm()
+
+        from app.utils.metrics import registry
+        registry.register_collector(lambda: [
+            ("gauge", "notenest_autosave_pending_notes", (), len(self._pending)),
+            ("counter", "notenest_autosave_coalesced_total", (), self.coalesced),
+            ("counter", "notenest_autosave_flushes_total", (), self.flushes),
+            ("counter", "notenest_autosave_conflicts_total", (), self.conflicts),
+            ("counter", "notenest_autosave_retries_total", (), self.retries),
+            ("counter", "notenest_autosave_failures_total", (), self.failures),
+        ])
+        return True
+
+    def accepts(self, note_id):
+        with self._lock:
+            return note_id in self._pending or len(self._pending) < NOTE_AUTOSAVE_MAX_PENDING
+
+    # -- Peticiones -------------------------------------------------------
+
+    def submit(self, note_id, data):
+        """
+        Aplica una petición de updateNote sobre el estado pendiente de la nota.
+        Retorna el acuse {"contentHash", "pendingVersion", "flushBy"}, o None
+        si la nota no existe. Lanza VersionMismatch o PatchError como updateNote.
+        """
+        while True:
+            entry = self._entry(note_id)
+            if entry is None:
+                return None
+            with entry.lock:
+                if entry.closed:
+                    continue  # Se escribió mientras tanto: se parte de lo guardado
+                changes = apply_note_update(entry.note, data, datetime.utcnow())
+                if entry.version:
+                    self.coalesced += 1
+                entry.changes.update(changes)
+                entry.requests.append(data)
+                entry.version = next(self._versions)
+                now = time.monotonic()
+                entry.deadline = max(min(entry.first + self.max_delay, now + self.window), entry.not_before)
+                flush_by = datetime.utcnow() + timedelta(seconds=entry.deadline - now)
+                return {
+                    "contentHash": content_hash(entry.note.content),
+                    "pendingVersion": entry.version,
+                    "flushBy": flush_by.isoformat(),
+                }
+
+    def _entry(self, note_id):
+        with self._lock:
+            entry = self._pending.get(note_id)
+        if entry is not None:
+            return entry
+        # Primera petición de la ráfaga: la única lectura de la nota
+        note = Note.active().filter(Note.id == note_id).first()
+        if note is None:
+            return None
+        db.session.expunge(note)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._pending.setdefault(note_id, _Pending(note, now, now + self.window))
+        self._wake.set()
+        return entry
+
+    def flush(self, *note_ids):
+        """Guarda ya los cambios pendientes de esas notas (antes de una escritura normal sobre ellas)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            entries = [self._pending[note_id] for note_id in note_ids if note_id in self._pending]
+        for entry in entries:
+            self._write(entry)
+
+    def discard(self, note_id):
+        """Olvida los cambios pendientes de una nota (p. ej. al eliminarla)."""
+        with self._lock:
+            entry = self._pending.pop(note_id, None)
+        if entry is not None:
+            with entry.lock:
+                entry.closed = True
+
+    # -- Escritura --------------------------------------------------------
+
+    def _write(self, entry, final=False):
+        """
+        Guarda la nota y la quita de las pendientes. Debe llamarse con contexto
+        de aplicación. Mientras escribe, las peticiones nuevas de esa nota
+        esperan: al seguir, leen ya lo guardado. Si la escritura falla, la
+        entrada sigue pendiente y se reintenta más tarde (ver _retry); con
+        `final` (al cerrar el proceso) no hay más intentos.
+        """
+        with entry.lock:
+            if entry.closed:
+                return
+            entry.closed = True
+            done = False
+            try:
+                done = not entry.changes or self._persist(entry)
+            finally:
+                if done or not self._retry(entry, final):
+                    with self._lock:
+                        if self._pending.get(entry.note.id) is entry:
+                            del self._pending[entry.note.id]
+
+    def _retry(self, entry, final):
+        """
+        Tras una escritura fallida, deja la entrada abierta con una espera que
+        se duplica en cada fallo. Si no quedan intentos, publica
+        note.autosaveFailed con el pendingVersion perdido y retorna False.
+        """
+        entry.attempts += 1
+        note = entry.note
+        if final or entry.attempts >= NOTE_AUTOSAVE_MAX_ATTEMPTS:
+            self.failures += 1
+            logger.error("❌ Autoguardado de la nota %s descartado tras %d intentos", note.id, entry.attempts)
+            publish_note_event("note.autosaveFailed", {"id": note.id, "userId": note.user_id, "isPublic": note.is_public},
+                               pendingVersion=entry.version)
+            return False
+        self.retries += 1
+        delay = min(NOTE_AUTOSAVE_RETRY * 2 ** (entry.attempts - 1), 60.0)
+        entry.not_before = entry.deadline = time.monotonic() + delay
+        entry.closed = False
+        self._wake.set()
+        logger.warning("⚠️ Autoguardado de la nota %s pendiente de reintento en %.1f s", note.id, delay)
+        return True
+
+    def _persist(self, entry):
+        """
+        Una sentencia UPDATE y un $set con el estado final. El UPDATE exige
+        que la fila siga como se leyó; si otro proceso la cambió entretanto,
+        se bloquea, se vuelve a leer y las peticiones pendientes se reaplican
+        sobre lo guardado. Si un parche ya no encaja, se descarta todo lo
+        pendiente y se publica note.autosaveConflict con el contentHash actual.
+        Retorna False si la escritura falló (hay que reintentarla).
+        """
+        note_id = entry.note.id
+        conflict = None
+        try:
+            shard_router.use(shard_router.resolve("notes", note_id))
+            written = self._update(entry)
+            if not written:
+                current = Note.active().filter(Note.id == note_id).with_for_update().first()
+                if current is not None:
+                    db.session.expunge(current)
+                    try:
+                        entry.rebase(current)
+                        written = self._update(entry)
+                    except (VersionMismatch, PatchError):
+                        conflict = current
+                        logger.warning("⚠️ Autoguardado de la nota %s descartado: otro proceso cambió "
+                                       "el contenido sobre el que se calcularon los parches", note_id)
+            note = entry.note
+            if written:
+                mark_user_data_changed(note.user_id)
+                if bool(note.is_public) != bool(entry.loaded["is_public"]):
+                    usage_stats.record(note.user_id, public_notes=1 if note.is_public else -1)
+            entity_cache.touch(Note, note_id)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("❌ Error guardando el autoguardado de la nota %s: %s", note_id, str(e))
+            logger.debug(traceback.format_exc())
+            return False
+        self.flushes += 1
+        if conflict is not None:
+            self.conflicts += 1
+            publish_note_event("note.autosaveConflict",
+                               {"id": note_id, "userId": conflict.user_id, "isPublic": conflict.is_public},
+                               contentHash=content_hash(conflict.content), pendingVersion=entry.version)
+            return True
+        if not written:
+            logger.info("📝 Autoguardado de la nota %s descartado: ya no existe", note_id)
+            return True
+        changes = entry.changes
+        publish_note_event("note.updated", {"id": note.id, "userId": note.user_id, "isPublic": note.is_public},
+                           fields=sorted(changes), contentHash=content_hash(note.content),
+                           updatedAt=changes["updatedAt"], pendingVersion=entry.version)
+        try:
+            self._app.config['MONGO_DB'].notes.update_one({"_id": note.id}, {"$set": changes})
+        except Exception as mongo_err:
+            logger.error("❌ Error al actualizar la nota %s en MongoDB: %s", note.id, str(mongo_err))
+        return True
+
+    def _update(self, entry):
+        """UPDATE de los campos cambiados si la fila sigue con los valores leídos. Retorna las filas escritas."""
+        note = entry.note
+        values = {_SQL_FIELDS[field]: getattr(note, _SQL_FIELDS[field]) for field in entry.changes}
+        unchanged = [getattr(Note, attr) == value for attr, value in entry.loaded.items()]
+        return db.session.execute(
+            update(Note).where(Note.id == note.id, Note.deleted_at.is_(None), *unchanged).values(**values)
+        ).rowcount
+
+    def _due(self, everything=False):
+        now = time.monotonic()
+        with self._lock:
+            entries = [entry for entry in self._pending.values() if everything or entry.deadline <= now]
+            following = min((entry.deadline for entry in self._pending.values() if entry not in entries), default=None)
+        return entries, None if following is None else max(0.0, following - now)
+
+    def flush_all(self):
+        """Guarda todo lo pendiente (al cerrar el proceso)."""
+        if not self.enabled:
+            return
+        entries, _ = self._due(everything=True)
+        if entries:
+            with self._app.app_context():
+                for entry in entries:
+                    self._write(entry, final=True)
+            logger.info("📝 %d notas con autoguardado pendiente guardadas al cerrar", len(entries))
+
+    def _run(self):
+        while True:
+            entries, wait = self._due()
+            if entries:
+                try:
+                    with self._app.app_context():
+                        for entry in entries:
+                            self._write(entry)
+                        db.session.remove()
+                except Exception as e:
+                    logger.error("❌ Error en el hilo de autoguardado: %s", str(e))
+                    logger.debug(traceback.format_exc())
+                continue
+            self._wake.wait(wait)
+            self._wake.clear()
+
+def _exit_on_sigterm():
+    """Con SIGTERM sin manejador propio, sale con SystemExit para que atexit guarde lo pendiente."""
+    if threading.current_thread() is not threading.main_thread():
+        return
+    if signal.getsignal(signal.SIGTERM) is signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, _raise_exit)
+
+def _raise_exit(signum, frame):
+    raise SystemExit(128 + signum)
+
+note_autosave = NoteAutosave()
@@ -0,0 +1,524 @@
+# Aplicación por lotes de las operaciones que el cliente offline acumula sin
+# conexión (/sync/batch). Cada bloque de operaciones se guarda en una sola
+# transacción, con las lecturas precargadas con IN, las inserciones agrupadas
+# y una escritura bulk por colección de MongoDB.
+
+import logging
+import os
+import uuid
+from collections import Counter
+from datetime import datetime
+from pymongo import DeleteMany, InsertOne, UpdateOne
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from app.config.db import db
+from app.config.shards import shard_router
+from app.models.blob import Blob
+from app.models.comment import Comment
+from app.models.note import Note
+from app.models.note_files import NoteFile
+from app.models.note_like import NoteLike
+from app.models.user import User
+from app.utils.autosave import note_autosave
+from app.utils.comment_tree import delete_comment_subtree
+from app.utils.note_counters import bump_note_counters
+from app.utils.like_index import like_index
+from app.utils.events import publish_note_event
+from app.utils.previews import preview_pipeline
+from app.utils.trending import trending_notes, LIKE_WEIGHT, COMMENT_WEIGHT
+from app.utils.text_patch import apply_note_update, content_hash, PatchError, VersionMismatch
+from app.utils.usage_stats import usage_stats
+from app.utils.bootstrap import mark_user_data_changed
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Operaciones por transacción
+BATCH_CHUNK = int(os.environ.get("SYNC_BATCH_CHUNK", "200"))
+# Operaciones como máximo por petición
+BATCH_MAX_OPERATIONS = int(os.environ.get("SYNC_BATCH_MAX_OPERATIONS", "5000"))
+
+# "$ref:<nombre>" se sustituye por el id creado por la operación con "ref": "<nombre>"
+REF_PREFIX = "$ref:"
+
+class OperationError(Exception):
+    """Operación rechazada; el resto del lote sigue adelante."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+def _is_ref(value):
+    return isinstance(value, str) and value.startswith(REF_PREFIX)
+
+def _resolve(value, refs):
+    if _is_ref(value):
+        name = value[len(REF_PREFIX):]
+        if name not in refs:
+            raise OperationError(400, f"Referencia desconocida: {name}")
+        return refs[name]
+    if isinstance(value, dict):
+        return {key: _resolve(item, refs) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_resolve(item, refs) for item in value]
+    return value
+
+class _Chunk:
+    """Estado de un bloque de operaciones que se confirma en una sola transacción."""
+
+    def __init__(self, refs):
+        self.refs = dict(refs)
+        self.notes = {}
+        self.comments = {}
+        self.users = set()
+        self.blobs = set()
+        # Notas nuevas (en orden) con los archivos creados junto a ellas
+        self.new_notes = {}
+        # Campos cambiados (nombres de MongoDB) de las notas existentes actualizadas
+        self.note_changes = {}
+        self.pending_comments = []
+        self.pending_files = []
+        self.new_likes = set()
+        self.known_likes = set()  # Ya estaban en note_likes: el índice se pone al día al confirmar
+        self.likes = Counter()
+        self.comment_delta = Counter()
+        self.file_delta = Counter()
+        self.blob_refs = Counter()
+        self.mongo_comments = []
+        self.mongo_files = []
+        self.previews = []
+        # Eventos (note_id, peso) para el ranking de tendencias, tras confirmar
+        self.trending = []
+        # Eventos para /events (tipo, nota, datos), tras confirmar
+        self.events = []
+
+    # -- Precarga ---------------------------------------------------------
+
+    def _known(self, value):
+        """Id literal o referencia a un bloque anterior; None si aún no se conoce."""
+        if _is_ref(value):
+            return self.refs.get(value[len(REF_PREFIX):])
+        return value if isinstance(value, str) else None
+
+    def preload(self, ops):
+        """Carga con una consulta por tabla las notas, comentarios, usuarios y blobs que se van a usar."""
+        note_ids, comment_ids, user_ids, blob_ids = set(), set(), set(), set()
+        for _, op in ops:
+            if not isinstance(op, dict):
+                continue
+            data = op.get("data") if isinstance(op.get("data"), dict) else {}
+            kind = op.get("op")
+            if kind in ("updateNote", "likeNote"):
+                note_ids.add(self._known(op.get("id")))
+            elif kind == "deleteComment":
+                comment_ids.add(self._known(op.get("id")))
+            elif kind == "addNote":
+                note_ids.add(self._known(data.get("id")))  # Para detectar ids repetidos
+            note_ids.add(self._known(data.get("noteId")))
+            comment_ids.add(self._known(data.get("parentId")))
+            user_ids.add(self._known(data.get("userId")))
+            blob_ids.add(self._known(data.get("blobId")))
+            for file_data in data.get("files") or []:
+                if isinstance(file_data, dict):
+                    blob_ids.add(self._known(file_data.get("blobId")))
+
+        for ids in (note_ids, comment_ids, user_ids, blob_ids):
+            ids.discard(None)
+        if note_ids:
+            self.notes = {note.id: note for note in Note.query.filter(Note.id.in_(note_ids))}
+        if comment_ids:
+            self.comments = {c.id: c for c in Comment.query.filter(Comment.id.in_(comment_ids))}
+        if user_ids:
+            self.users = set(db.session.scalars(db.select(User.id).where(User.id.in_(user_ids))))
+        if blob_ids:
+            self.blobs = set(db.session.scalars(db.select(Blob.sha256).where(Blob.sha256.in_(blob_ids))))
+
+    # -- Búsquedas --------------------------------------------------------
+
+    def _note(self, note_id):
+        note = self.notes.get(note_id)
+        if note is None and note_id not in self.notes:
+            note = self.notes[note_id] = db.session.get(Note, note_id)
+        if note is None or note.deleted_at is not None:
+            raise OperationError(404, "Nota no encontrada")
+        return note
+
+    def _comment(self, comment_id):
+        comment = self.comments.get(comment_id)
+        if comment is None:
+            # Puede haberse borrado en este bloque: se pregunta a la base de datos
+            self.flush_pending()
+            comment = Comment.query.filter_by(id=comment_id).first()
+        if comment is None:
+            raise OperationError(404, "Comentario no encontrado")
+        return comment
+
+    def _user(self, user_id):
+        if not user_id:
+            raise OperationError(400, "userId es requerido")
+        if user_id not in self.users:
+            if db.session.get(User, user_id) is None:
+                raise OperationError(400, "El usuario no existe")
+            self.users.add(user_id)
+
+    def _blob(self, blob_id):
+        if blob_id not in self.blobs:
+            if db.session.get(Blob, blob_id) is None:
+                raise OperationError(404, f"Blob no encontrado: {blob_id}")
+            self.blobs.add(blob_id)
+
+    def _event(self, event_type, note, **data):
+        # Toda operación que publica un evento cambia la instantánea de arranque del dueño
+        mark_user_data_changed(note.user_id)
+        self.events.append((event_type, {"id": note.id, "userId": note.user_id, "isPublic": note.is_public}, data))
+
+    # -- Operaciones ------------------------------------------------------
+
+    def add_note(self, _, data):
+        self._user(data.get("userId"))
+        if not data.get("title"):
+            raise OperationError(400, "title es requerido")
+        files = [f for f in data.pop("files", None) or [] if isinstance(f, dict)]
+        files = [f for f in files if f.get("blobId") or f.get("fileUrl")]
+        for file_data in files:
+            if file_data.get("blobId"):
+                self._blob(file_data["blobId"])
+        note_id = data.get("id") or data.get("_id")
+        if note_id and (note_id in self.new_notes or self.notes.get(note_id) is not None):
+            raise OperationError(409, "La nota ya existe")
+
+        note = Note.from_dict(data)
+        note_files = []
+        for file_data in files:
+            note_file = NoteFile(
+                id=file_data.get("id", str(uuid.uuid4())),
+                note_id=note.id,
+                file_url=file_data.get("fileUrl"),
+                blob_sha256=file_data.get("blobId"),
+            )
+            self.pending_files.append(note_file)
+            self.blob_refs[note_file.blob_sha256] += 1
+            note_files.append(note_file)
+        db.session.add(note)
+        self.notes[note.id] = note
+        self.new_notes[note.id] = (note, note_files)
+        usage_stats.record_note(note)
+        self._event("note.created", note, userId=note.user_id, title=note.title)
+        return {"id": note.id}
+
+    def update_note(self, note_id, data):
+        note = self._note(note_id)
+        try:
+            changes = apply_note_update(note, data, datetime.utcnow())
+        except VersionMismatch as e:
+            raise OperationError(409, f"La nota cambió desde la versión base (contentHash {e.current_hash})")
+        except PatchError as e:
+            raise OperationError(422, f"Parche inválido: {e}")
+        if note.id not in self.new_notes:
+            self.note_changes.setdefault(note.id, {}).update(changes)
+        if "isPublic" in changes:
+            usage_stats.record(note.user_id, public_notes=1 if note.is_public else -1)
+        new_hash = content_hash(note.content)
+        self._event("note.updated", note, fields=sorted(changes), contentHash=new_hash,
+                    updatedAt=changes["updatedAt"])
+        return {"id": note.id, "contentHash": new_hash}
+
+    def like_note(self, note_id, data):
+        note = self._note(note_id)
+        user_id = data.get("userId")
+        if user_id:
+            # Like por usuario: repetirlo (en este lote o antes) no vuelve a sumar. Decide
+            # la clave primaria de note_likes, no el índice en memoria (puede estar desfasado)
+            if (user_id, note.id) in self.new_likes:
+                return {"id": note.id, "likes": note.likes, "liked": True}
+            self._user(user_id)
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(insert(NoteLike).values(user_id=user_id, note_id=note.id))
+            except IntegrityError:
+                self.known_likes.add((user_id, note.id))
+                return {"id": note.id, "likes": note.likes, "liked": True}
+            self.new_likes.add((user_id, note.id))
+        note.likes = (note.likes or 0) + 1
+        if note.id not in self.new_notes:
+            self.likes[note.id] += 1
+        usage_stats.record(note.user_id, likes_received=1)
+        if note.is_public:
+            self.trending.append((note.id, LIKE_WEIGHT))
+        self._event("note.liked", note, likes=note.likes)
+        return {"id": note.id, "likes": note.likes, "liked": True}
+
+    def _add_comment(self, data):
+        note = self._note(data["noteId"])
+        self._user(data["userId"])
+        if not data.get("content"):
+            raise OperationError(400, "content es requerido")
+        comment = Comment.from_dict(data)
+        self.pending_comments.append(comment)
+        self.comments[comment.id] = comment
+        self.comment_delta[comment.note_id] += 1
+        usage_stats.record(comment.user_id, comments=1)
+        self.mongo_comments.append(InsertOne({**comment.to_document(), "from_flask": True}))
+        if note.is_public:
+            self.trending.append((note.id, COMMENT_WEIGHT))
+        self._event("comment.created", note, commentId=comment.id, parentId=comment.parent_id, userId=comment.user_id)
+        return {"id": comment.id}
+
+    def add_comment(self, _, data):
+        if not data.get("noteId") or not data.get("userId"):
+            raise OperationError(400, "noteId y userId son requeridos")
+        return self._add_comment(data)
+
+    def reply_comment(self, _, data):
+        if not data.get("noteId") or not data.get("userId") or not data.get("parentId"):
+            raise OperationError(400, "Faltan campos requeridos")
+        parent = self._comment(data["parentId"])
+        data["rootComment"] = parent.root_comment if parent.parent_id else parent.id
+        return self._add_comment(data)
+
+    def delete_comment(self, comment_id, _):
+        comment = self._comment(comment_id)
+        self.flush_pending()  # El subárbol puede incluir respuestas creadas en este bloque
+        deleted, mongo_filters = delete_comment_subtree(comment)
+        self.comment_delta[comment.note_id] -= deleted
+        self.mongo_comments.extend(DeleteMany(f) for f in mongo_filters)
+        # Las respuestas del hilo en memoria pueden estar borradas: se vuelven a consultar
+        root = comment.root_comment
+        self.comments = {cid: c for cid, c in self.comments.items() if c.root_comment != root}
+        note = self.notes.get(comment.note_id) or db.session.get(Note, comment.note_id)
+        if note is not None:
+            self._event("comment.deleted", note, commentId=comment_id, deleted=deleted)
+        return {"id": comment_id, "deleted": deleted}
+
+    def add_note_file(self, _, data):
+        note_id, file_url, blob_id = data.get("noteId"), data.get("fileUrl"), data.get("blobId")
+        if not note_id or not (file_url or blob_id):
+            raise OperationError(400, "Se requiere noteId y fileUrl o blobId")
+        note = self._note(note_id)
+        if blob_id:
+            self._blob(blob_id)
+        note_file = NoteFile(id=data.get("id", str(uuid.uuid4())), note_id=note_id,
+                             file_url=file_url, blob_sha256=blob_id)
+        self.pending_files.append(note_file)
+        self.blob_refs[blob_id] += 1
+        self.file_delta[note_id] += 1
+        self.mongo_files.append(InsertOne({
+            "_id": note_file.id, "noteId": note_id,
+            "fileUrl": note_file.file_url, "blobId": blob_id,
+        }))
+        self.previews.append(blob_id)
+        self._event("note.fileAdded", note, fileId=note_file.id)
+        return {"id": note_file.id, "fileUrl": note_file.file_url}
+
+    # Operación -> (método, si actúa sobre "id", estado HTTP equivalente)
+    HANDLERS = {
+        "addNote": (add_note, False, 201),
+        "updateNote": (update_note, True, 200),
+        "likeNote": (like_note, True, 200),
+        "addComment": (add_comment, False, 201),
+        "replyComment": (reply_comment, False, 201),
+        "deleteComment": (delete_comment, True, 200),
+        "addNoteFile": (add_note_file, False, 201),
+    }
+
+    def apply(self, op):
+        """
+        Aplica una operación; cada método valida todo antes de modificar nada.
+        Retorna (estado, resultado).
+        """
+        if not isinstance(op, dict) or op.get("op") not in self.HANDLERS:
+            raise OperationError(400, "Operación desconocida")
+        handler, takes_id, status = self.HANDLERS[op["op"]]
+        ref = op.get("ref")
+        if ref is not None and ref in self.refs:
+            raise OperationError(400, f"Referencia repetida: {ref}")
+        data = op.get("data") or {}
+        if not isinstance(data, dict):
+            raise OperationError(400, "data debe ser un objeto")
+        data = _resolve(data, self.refs)
+        target = None
+        if takes_id:
+            target = _resolve(op.get("id"), self.refs)
+            if not target:
+                raise OperationError(400, "id es requerido")
+        result = handler(self, target, data)
+        if ref is not None:
+            self.refs[ref] = result["id"]
+        return status, result
+
+    # -- Escritura --------------------------------------------------------
+
+    def flush_pending(self):
+        """Inserta lo pendiente respetando las claves foráneas: notas, comentarios y archivos."""
+        db.session.flush()
+        if self.pending_comments:
+            db.session.add_all(self.pending_comments)
+            self.pending_comments = []
+            db.session.flush()
+        if self.pending_files:
+            db.session.add_all(self.pending_files)
+            self.pending_files = []
+            db.session.flush()
+
+    def finish(self):
+        """
+        Cierra el bloque dentro de la transacción: contadores, referencias a
+        blobs e inserciones pendientes. Retorna las escrituras de MongoDB,
+        preparadas antes del commit para no recargar los objetos.
+        """
+        for note_id, (note, note_files) in self.new_notes.items():
+            note.comment_count = max(self.comment_delta.pop(note_id, 0), 0)
+            note.file_count = len(note_files) + self.file_delta.pop(note_id, 0)
+        for note_id in set(self.comment_delta) | set(self.file_delta):
+            bump_note_counters(note_id, comments=self.comment_delta[note_id], files=self.file_delta[note_id])
+        for sha256, count in self.blob_refs.items():
+            if sha256:
+                Blob.query.filter_by(sha256=sha256).update(
+                    {Blob.ref_count: Blob.ref_count + count}, synchronize_session=False
+                )
+        self.flush_pending()
+
+        notes = []
+        for note, note_files in self.new_notes.values():
+            files = [f.to_dict() for f in note_files]
+            notes.append(InsertOne({**note.to_document(), "files": files, "from_flask": True}))
+            self.mongo_files.extend(
+                InsertOne({"_id": f["id"], "noteId": f["noteId"], "fileUrl": f["fileUrl"], "blobId": f["blobId"]})
+                for f in files
+            )
+            self.previews.extend(f["blobId"] for f in files)
+        for note_id in set(self.note_changes) | set(self.likes) | set(self.comment_delta) | set(self.file_delta):
+            update = {}
+            if note_id in self.note_changes:
+                update["$set"] = self.note_changes[note_id]
+            inc = {"likes": self.likes[note_id], "commentCount": self.comment_delta[note_id],
+                   "fileCount": self.file_delta[note_id]}
+            inc = {key: value for key, value in inc.items() if value}
+            if inc:
+                update["$inc"] = inc
+            if update:
+                notes.append(UpdateOne({"_id": note_id}, update))
+        return {"notes": notes, "comments": self.mongo_comments, "note_files": self.mongo_files}
+
+def _result(index, op, status, **extra):
+    return {"index": index, "op": op.get("op") if isinstance(op, dict) else None, "status": status, **extra}
+
+def _apply_chunk(ops, refs):
+    chunk = _Chunk(refs)
+    chunk.preload(ops)
+    results = []
+    for index, op in ops:
+        try:
+            status, result = chunk.apply(op)
+            results.append(_result(index, op, status, **result))
+        except OperationError as e:
+            results.append(_result(index, op, e.status, error=e.message))
+        except (KeyError, TypeError, ValueError) as e:
+            # Campos con tipo o formato inválido (p. ej. una fecha mal escrita)
+            results.append(_result(index, op, 400, error=f"Datos inválidos: {e}"))
+    writes = chunk.finish()
+    db.session.commit()
+    return chunk, results, writes
+
+def _write_mongo(mongo, writes):
+    for collection, operations in writes.items():
+        if operations:
+            try:
+                mongo[collection].bulk_write(operations, ordered=True)
+            except Exception as mongo_err:
+                logger.error("❌ Error en la escritura bulk de %s en MongoDB: %s", collection, str(mongo_err))
+
+def _run_chunk(ops, refs, mongo):
+    try:
+        chunk, results, writes = _apply_chunk(ops, refs)
+    except Exception as e:
+        db.session.rollback()
+        if len(ops) > 1:
+            # Fallo al confirmar (p. ej. un id repetido): se reintenta de una en una
+            # para que solo falle la operación culpable
+            logger.warning("⚠️ Bloque de %d operaciones rechazado, se aplica de una en una: %s", len(ops), e)
+            results = []
+            for item in ops:
+                results += _run_chunk([item], refs, mongo)
+            return results
+        index, op = ops[0]
+        if isinstance(e, IntegrityError):
+            return [_result(index, op, 409, error="Conflicto con datos existentes")]
+        logger.error("❌ Error en la operación %d del lote: %s", index, str(e))
+        return [_result(index, op, 500, error="Error interno del servidor")]
+
+    refs.update(chunk.refs)
+    _write_mongo(mongo, writes)
+    for blob_id in chunk.previews:
+        preview_pipeline.submit(blob_id)
+    for note_id, weight in chunk.trending:
+        trending_notes.record(note_id, weight)
+    for user_id, note_id in chunk.new_likes | chunk.known_likes:
+        like_index.add(user_id, note_id)
+    for event_type, note, data in chunk.events:
+        publish_note_event(event_type, note, **data)
+    return results
+
+def apply_batch(operations, mongo, chunk_size=None):
+    """
+    Aplica en orden una lista de operaciones tipadas ({"op", "id", "data", "ref"}).
+    Las operaciones se agrupan en bloques de `chunk_size`, cada uno en una
+    transacción; una operación inválida no impide las demás.
+    Retorna (resultado por operación, ids creados por cada "ref").
+    """
+    chunk_size = chunk_size or BATCH_CHUNK
+    # updateNote del lote se aplica sobre lo ya guardado: antes se escribe el autoguardado pendiente
+    note_autosave.flush(*{op["id"] for op in operations
+                          if isinstance(op, dict) and op.get("op") == "updateNote"
+                          and isinstance(op.get("id"), str) and not _is_ref(op["id"])})
+    refs = {}
+    results = []
+    ref_shards = {}  # Con sharding: shard de la operación que creó cada ref
+    for start in range(0, len(operations), chunk_size):
+        ops = list(enumerate(operations[start:start + chunk_size], start))
+        if not shard_router.enabled:
+            results += _run_chunk(ops, refs, mongo)
+            continue
+        # Una transacción no puede abarcar dos shards: el bloque se corta cada
+        # vez que cambia el shard de las operaciones consecutivas
+        for shard, group in _by_shard(ops, ref_shards):
+            with shard_router.using(shard):
+                results += _run_chunk(group, refs, mongo)
+    return results, refs
+
+# Campo que decide el shard de cada operación: (origen, clave, tabla o None si es un user_id)
+_SHARD_KEYS = {
+    "addNote": ("data", "userId", None),
+    "updateNote": ("op", "id", "notes"),
+    "likeNote": ("op", "id", "notes"),
+    "addComment": ("data", "noteId", "notes"),
+    "replyComment": ("data", "parentId", "comments"),
+    "deleteComment": ("op", "id", "comments"),
+    "addNoteFile": ("data", "noteId", "notes"),
+}
+
+def _op_shard(op, ref_shards):
+    if not isinstance(op, dict) or op.get("op") not in _SHARD_KEYS:
+        return 0  # Falla igual en cualquier shard
+    source, key, table = _SHARD_KEYS[op["op"]]
+    container = op if source == "op" else op.get("data")
+    value = container.get(key) if isinstance(container, dict) else None
+    if not isinstance(value, str) or not value:
+        return 0
+    if _is_ref(value):
+        return ref_shards.get(value[len(REF_PREFIX):], 0)
+    return shard_router.resolve(table, value)
+
+def _by_shard(ops, ref_shards):
+    """Agrupa las operaciones consecutivas que van al mismo shard."""
+    groups = []
+    for index, op in ops:
+        shard = _op_shard(op, ref_shards)
+        if isinstance(op, dict) and isinstance(op.get("ref"), str):
+            ref_shards.setdefault(op["ref"], shard)
+        if groups and groups[-1][0] == shard:
+            groups[-1][1].append((index, op))
+        else:
+            groups.append((shard, [(index, op)]))
+    return groups
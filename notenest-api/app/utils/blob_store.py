@@ -0,0 +1,257 @@
+# Almacenamiento local de archivos adjuntos direccionado por contenido:
+# cada archivo se guarda una sola vez bajo su SHA-256, en directorios repartidos
+
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from app.config.db import db
+from app.models.blob import Blob
+
+CHUNK_SIZE = 64 * 1024
+_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+
+class UploadError(Exception):
+    """Error de una subida (offset incorrecto, tamaño excedido, sesión inexistente)."""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+def is_blob_id(value):
+    return isinstance(value, str) and bool(_SHA256.match(value))
+
+class BlobStore:
+    """
+    Guarda el contenido en <raíz>/objects/ab/cd/<sha256> y las subidas en curso
+    en <raíz>/uploads/<id>. El hash se calcula mientras llegan los bytes, así
+    que al completar una subida no hace falta volver a leer el archivo.
+    """
+
+    def __init__(self, root=None):
+        self.root = root
+        self.max_size = 0
+        self._hashers = {}  # upload_id -> (bytes hasheados, objeto sha256)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.root = os.path.abspath(
+            app.config.get('BLOB_STORAGE_DIR') or os.environ.get("BLOB_STORAGE_DIR", "data/blobs")
+        )
+        self.max_size = int(os.environ.get("BLOB_MAX_SIZE", str(100 * 1024 * 1024)))
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(self.root, "uploads"), exist_ok=True)
+        app.config['BLOB_STORE'] = self
+
+    # ------------------------------------------------------------------
+    # Rutas
+    # ------------------------------------------------------------------
+
+    def object_dir(self, sha256):
+        return os.path.join(self.root, "objects", sha256[:2], sha256[2:4])
+
+    def object_path(self, sha256):
+        return os.path.join(self.object_dir(sha256), sha256)
+
+    def exists(self, sha256):
+        return is_blob_id(sha256) and os.path.isfile(self.object_path(sha256))
+
+    def _upload_path(self, upload_id):
+        if not re.match(r"^[0-9a-f]{32}$", upload_id or ""):
+            raise UploadError("Subida no encontrada", status=404)
+        return os.path.join(self.root, "uploads", upload_id)
+
+    # ------------------------------------------------------------------
+    # Subidas reanudables
+    # ------------------------------------------------------------------
+
+    def begin_upload(self, content_type=None, size=None):
+        """Crea una sesión de subida vacía y retorna su id."""
+        if size is not None and self.max_size and size > self.max_size:
+            raise UploadError("El archivo supera el tamaño máximo permitido", status=413)
+        upload_id = uuid.uuid4().hex
+        path = self._upload_path(upload_id)
+        with open(path + ".json", "w") as meta:
+            json.dump({"contentType": content_type, "size": size}, meta)
+        open(path, "wb").close()
+        with self._lock:
+            self._hashers[upload_id] = (0, hashlib.sha256())
+        return upload_id
+
+    def upload_info(self, upload_id):
+        """Retorna los metadatos de la subida con el offset actual."""
+        path = self._upload_path(upload_id)
+        try:
+            with open(path + ".json") as meta:
+                info = json.load(meta)
+            info["offset"] = os.path.getsize(path)
+        except FileNotFoundError:
+            raise UploadError("Subida no encontrada", status=404)
+        return info
+
+    def _hasher_for(self, upload_id, path, offset):
+        """
+        Retorna el hash acumulado hasta `offset`. Si el proceso se reinició
+        (o la subida la empezó otro proceso) se recalcula leyendo lo ya subido.
+        """
+        with self._lock:
+            state = self._hashers.get(upload_id)
+        if state is not None and state[0] == offset:
+            return state[1]
+        hasher = hashlib.sha256()
+        with open(path, "rb") as partial:
+            for chunk in iter(lambda: partial.read(CHUNK_SIZE), b""):
+                hasher.update(chunk)
+        return hasher
+
+    def append(self, upload_id, stream, offset):
+        """
+        Añade al final de la subida los bytes leídos de `stream` por bloques,
+        sin cargarlos enteros en memoria. `offset` debe coincidir con lo ya
+        subido; si no, se lanza UploadError(409) con el offset correcto.
+        Retorna el nuevo offset.
+        """
+        info = self.upload_info(upload_id)
+        path = self._upload_path(upload_id)
+        limit = info.get("size") or self.max_size
+        with open(path, "ab") as partial:
+            # Un solo escritor por subida: un segundo PATCH simultáneo recibe 409
+            try:
+                fcntl.flock(partial, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadError("La subida está recibiendo otro bloque", status=409, offset=info["offset"])
+            current = os.path.getsize(path)
+            if offset != current:
+                raise UploadError("Offset de subida incorrecto", status=409, offset=current)
+
+            hasher = self._hasher_for(upload_id, path, offset)
+            written = offset
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                written += len(chunk)
+                if limit and written > limit:
+                    partial.truncate(offset)
+                    raise UploadError("El archivo supera el tamaño máximo permitido", status=413)
+                hasher.update(chunk)
+                partial.write(chunk)
+        with self._lock:
+            self._hashers[upload_id] = (written, hasher)
+        return written
+
+    def complete(self, upload_id):
+        """
+        Cierra la subida y mueve el contenido a su ruta definitiva.
+        Si ya existía un blob con el mismo hash se descarta la copia (deduplicación).
+        Retorna (sha256, tamaño, content_type).
+        """
+        info = self.upload_info(upload_id)
+        path = self._upload_path(upload_id)
+        if info.get("size") is not None and info["offset"] != info["size"]:
+            raise UploadError("La subida está incompleta", status=409, offset=info["offset"])
+
+        sha256 = self._hasher_for(upload_id, path, info["offset"]).hexdigest()
+        target = self.object_path(sha256)
+        if os.path.exists(target):
+            os.remove(path)
+        else:
+            os.makedirs(self.object_dir(sha256), exist_ok=True)
+            os.replace(path, target)
+        os.remove(path + ".json")
+        with self._lock:
+            self._hashers.pop(upload_id, None)
+        return sha256, info["offset"], info.get("contentType")
+
+    def put_stream(self, stream, content_type=None, size=None):
+        """Sube un archivo completo en una sola petición. Retorna lo mismo que complete()."""
+        upload_id = self.begin_upload(content_type, size)
+        try:
+            self.append(upload_id, stream, 0)
+            return self.complete(upload_id)
+        except Exception:
+            self.abort(upload_id)
+            raise
+
+    def abort(self, upload_id):
+        path = self._upload_path(upload_id)
+        for leftover in (path, path + ".json"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        with self._lock:
+            self._hashers.pop(upload_id, None)
+
+    def remove(self, sha256):
+        """Borra el contenido de un blob y cualquier archivo derivado guardado junto a él."""
+        directory = self.object_dir(sha256)
+        if not os.path.isdir(directory):
+            return
+        for name in os.listdir(directory):
+            if name == sha256 or name.startswith(sha256 + "."):
+                os.remove(os.path.join(directory, name))
+
+blob_store = BlobStore()
+
+# ----------------------------------------------------------------------
+# Conteo de referencias (dentro de la transacción del llamador)
+# ----------------------------------------------------------------------
+
+def register_blob(sha256, size, content_type):
+    """Crea la fila del blob tras completar una subida (sin referencias aún)."""
+    blob = db.session.get(Blob, sha256)
+    if blob is None:
+        blob = Blob(sha256=sha256, size=size, content_type=content_type)
+        db.session.add(blob)
+    return blob
+
+def acquire_blob(sha256):
+    """Suma una referencia al blob. Retorna False si el blob no existe."""
+    return Blob.query.filter_by(sha256=sha256).update(
+        {Blob.ref_count: Blob.ref_count + 1}, synchronize_session=False
+    ) == 1
+
+def release_blobs(shas):
+    """
+    Resta una referencia por cada aparición de cada hash en `shas` y elimina
+    las filas que se quedan sin referencias. Retorna los hashes cuyo contenido
+    debe borrarse del disco una vez confirmada la transacción.
+    """
+    reclaimed = []
+    for sha256, count in Counter(s for s in shas if s).items():
+        Blob.query.filter_by(sha256=sha256).update(
+            {Blob.ref_count: Blob.ref_count - count}, synchronize_session=False
+        )
+        if Blob.query.filter(Blob.sha256 == sha256, Blob.ref_count <= 0).delete(synchronize_session=False):
+            reclaimed.append(sha256)
+    return reclaimed
+
+def reclaim(shas):
+    """Borra del disco el contenido de los blobs ya eliminados de la base de datos."""
+    for sha256 in shas:
+        blob_store.remove(sha256)
+
+def collect_garbage(grace_hours=24):
+    """
+    Borra los blobs que nadie referencia (subidos pero nunca adjuntados) y las
+    subidas abandonadas con más de `grace_hours` horas. Retorna (blobs, subidas).
+    """
+    cutoff = datetime.utcnow() - timedelta(hours=grace_hours)
+    orphans = [blob.sha256 for blob in Blob.query.filter(Blob.ref_count <= 0, Blob.created_at < cutoff)]
+    if orphans:
+        Blob.query.filter(Blob.sha256.in_(orphans), Blob.ref_count <= 0).delete(synchronize_session=False)
+    db.session.commit()
+    reclaim(orphans)
+
+    uploads_dir = os.path.join(blob_store.root, "uploads")
+    expired = 0
+    limit = time.time() - grace_hours * 3600
+    for name in os.listdir(uploads_dir):
+        path = os.path.join(uploads_dir, name)
+        if not name.endswith(".json") and os.path.getmtime(path) < limit:
+            blob_store.abort(name)
+            expired += 1
+    return len(orphans), expired
@@ -0,0 +1,238 @@
+# Instantánea inicial de un dispositivo nuevo: las notas del usuario, sus
+# archivos y los comentarios de esas notas en un único flujo NDJSON comprimido
+# con gzip, que se genera en una sola pasada y se guarda en disco para los
+# siguientes inicios de sesión mientras los datos del usuario no cambien
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+import zlib
+from datetime import datetime
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session as SessionBase
+from app.config.db import db
+from app.config.shards import shard_router
+from app.models.comment import Comment
+from app.models.note import Note, NoteSchema
+from app.models.note_files import NoteFile, NoteFileSchema
+from app.models.user_data_version import UserDataVersion
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BOOTSTRAP_CACHE_DIR = os.environ.get("BOOTSTRAP_CACHE_DIR", "data/bootstrap")
+# Espacio máximo de las instantáneas guardadas; se borran primero las menos usadas
+BOOTSTRAP_CACHE_MAX_BYTES = int(os.environ.get("BOOTSTRAP_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+BOOTSTRAP_COMPRESSION_LEVEL = int(os.environ.get("BOOTSTRAP_COMPRESSION_LEVEL", "6"))
+# Filas por lectura de la base de datos durante la pasada
+BOOTSTRAP_YIELD_PER = 500
+# Se comprime y se envía cada vez que se acumulan estos bytes de NDJSON
+FLUSH_BYTES = 64 * 1024
+# Cambia si cambia el formato de las líneas (invalida todo lo guardado)
+SNAPSHOT_FORMAT = 2
+# Clave de session.info con los usuarios cuyos datos cambió la transacción en curso
+_CHANGED = "bootstrap_changed_users"
+
+_note_schema = NoteSchema()
+_file_schema = NoteFileSchema()
+
+def _line(kind, data):
+    return json.dumps({"type": kind, **data}, separators=(",", ":"), default=str).encode("utf-8") + b"\n"
+
+def data_version(user_id):
+    """
+    Versión de los datos de un usuario: el token de user_data_versions, que
+    cada transacción que cambia sus notas, sus archivos o los comentarios de
+    sus notas reemplaza por uno nuevo (ver mark_user_data_changed). Es una
+    lectura por clave primaria; los usuarios sin fila (datos anteriores a la
+    tabla) tienen versión fija hasta su siguiente escritura.
+    """
+    with shard_router.using(shard_router.shard_for_user(user_id)):
+        token = db.session.scalar(select(UserDataVersion.token).where(UserDataVersion.user_id == user_id))
+    fingerprint = json.dumps([SNAPSHOT_FORMAT, user_id, token])
+    return hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()[:32]
+
+def mark_user_data_changed(*user_ids):
+    """
+    Anota que la transacción en curso cambia la instantánea de esos usuarios:
+    al confirmarla se escribe un token nuevo en user_data_versions, dentro de
+    la misma transacción. Llamar desde cada escritura sobre notas, archivos
+    o comentarios, con el dueño de la nota.
+    """
+    changed = db.session.info.setdefault(_CHANGED, set())
+    changed.update(user_id for user_id in user_ids if user_id)
+
+def _write_versions(session):
+    changed = session.info.pop(_CHANGED, None)
+    if not changed:
+        return
+    now = datetime.utcnow()
+    for user_id in sorted(changed):
+        values = {"token": uuid.uuid4().hex, "updated_at": now}
+        with shard_router.using(shard_router.shard_for_user(user_id)):
+            if session.execute(update(UserDataVersion).where(UserDataVersion.user_id == user_id)
+                               .values(**values)).rowcount:
+                continue
+            try:
+                with session.begin_nested():
+                    session.execute(insert(UserDataVersion).values(user_id=user_id, **values))
+            except IntegrityError:
+                # Otro proceso creó la fila a la vez: basta con reemplazar su token
+                session.execute(update(UserDataVersion).where(UserDataVersion.user_id == user_id).values(**values))
+
+def _discard_versions(session):
+    session.info.pop(_CHANGED, None)
+
+class BootstrapCache:
+    """
+    Instantáneas en <dir>/<hash del usuario>-<versión>.ndjson.gz. La versión
+    forma parte del nombre, así que una escritura las invalida sin avisar a
+    la caché: la siguiente petición lee otro token y no encuentra el
+    archivo. Al guardar una versión nueva se borran las anteriores del usuario.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.max_bytes = BOOTSTRAP_CACHE_MAX_BYTES
+        self._lock = threading.Lock()
+        self._installed = False
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        from app.utils.metrics import register_cache
+        if not self._installed:
+            event.listen(SessionBase, "before_commit", _write_versions)
+            event.listen(SessionBase, "after_rollback", _discard_versions)
+            self._installed = True
+        self.root = os.path.abspath(app.config.get("BOOTSTRAP_CACHE_DIR") or BOOTSTRAP_CACHE_DIR)
+        os.makedirs(self.root, exist_ok=True)
+        # Temporales de pasadas que no terminaron (proceso reiniciado)
+        for name in os.listdir(self.root):
+            if name.endswith(".tmp"):
+                _remove(os.path.join(self.root, name))
+        register_cache("bootstrap", self.stats)
+
+    def _prefix(self, user_id):
+        # El id llega en la URL: se usa su hash para no construir rutas con él
+        return hashlib.sha256(user_id.encode("utf-8")).hexdigest()[:24]
+
+    def path(self, user_id, version):
+        return os.path.join(self.root, f"{self._prefix(user_id)}-{version}.ndjson.gz")
+
+    def lookup(self, user_id, version):
+        """Ruta de la instantánea guardada para esa versión, o None."""
+        path = self.path(user_id, version)
+        try:
+            os.utime(path)  # Marca de uso para el borrado de las menos recientes
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def generate(self, user_id, version):
+        """
+        Generador de la instantánea comprimida. Lee las notas, los archivos y
+        los comentarios con yield_per, comprime por bloques y escribe a la vez
+        un archivo temporal; si al terminar la versión sigue siendo la misma
+        (nadie escribió durante la pasada) lo guarda como la instantánea de
+        esa versión. Debe consumirse dentro de un contexto de aplicación.
+        """
+        compressor = zlib.compressobj(BOOTSTRAP_COMPRESSION_LEVEL, zlib.DEFLATED, 31)  # 31: formato gzip
+        temp_path = f"{self.path(user_id, version)}.{uuid.uuid4().hex}.tmp"
+        try:
+            handle = open(temp_path, "wb")
+        except OSError as e:
+            logger.warning("⚠️ No se puede guardar la instantánea de arranque: %s", e)
+            handle = None
+        completed = False
+        try:
+            pending = []
+            pending_bytes = 0
+            for line in self._lines(user_id, version):
+                pending.append(line)
+                pending_bytes += len(line)
+                if pending_bytes >= FLUSH_BYTES:
+                    chunk = compressor.compress(b"".join(pending))
+                    pending, pending_bytes = [], 0
+                    if chunk:
+                        if handle:
+                            handle.write(chunk)
+                        yield chunk
+            chunk = compressor.compress(b"".join(pending)) + compressor.flush()
+            if handle:
+                handle.write(chunk)
+            yield chunk
+            completed = True
+        finally:
+            if handle:
+                handle.close()
+                if completed and data_version(user_id) == version:
+                    self._store(user_id, temp_path, self.path(user_id, version))
+                else:
+                    _remove(temp_path)
+
+    def _lines(self, user_id, version):
+        yield _line("snapshot", {"userId": user_id, "version": version,
+                                 "generatedAt": datetime.utcnow().isoformat()})
+        totals = {"notes": 0, "files": 0, "comments": 0}
+        notes = Note.active().filter(Note.user_id == user_id).order_by(Note.id).yield_per(BOOTSTRAP_YIELD_PER)
+        for note in notes:
+            totals["notes"] += 1
+            yield _line("note", {"data": _note_schema.dump(note)})
+        owned = select(Note.id).where(Note.user_id == user_id, Note.deleted_at.is_(None))
+        files = NoteFile.query.filter(NoteFile.note_id.in_(owned)).order_by(NoteFile.note_id).yield_per(BOOTSTRAP_YIELD_PER)
+        for note_file in files:
+            totals["files"] += 1
+            yield _line("file", {"data": _file_schema.dump(note_file)})
+        comments = (Comment.query.filter(Comment.note_id.in_(owned))
+                    .order_by(Comment.note_id, Comment.created_at).yield_per(BOOTSTRAP_YIELD_PER))
+        for comment in comments:
+            totals["comments"] += 1
+            yield _line("comment", {"data": comment.to_dict()})
+        yield _line("end", totals)
+
+    def _store(self, user_id, temp_path, final_path):
+        prefix = self._prefix(user_id)
+        with self._lock:
+            os.replace(temp_path, final_path)
+            # Versiones anteriores del mismo usuario (ya no se pueden pedir)
+            for name in os.listdir(self.root):
+                if name.startswith(prefix) and name.endswith(".ndjson.gz") and os.path.join(self.root, name) != final_path:
+                    _remove(os.path.join(self.root, name))
+            self._prune()
+
+    def _prune(self):
+        entries = []
+        for name in os.listdir(self.root):
+            if name.endswith(".ndjson.gz"):
+                try:
+                    stat = os.stat(os.path.join(self.root, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            _remove(os.path.join(self.root, name))
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+bootstrap_cache = BootstrapCache()
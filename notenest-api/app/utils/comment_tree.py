@@ -0,0 +1,55 @@
+from sqlalchemy import func, select
+from app.config.db import db
+from app.models.comment import Comment
+from app.utils.entity_cache import entity_cache
+from app.utils.usage_stats import usage_stats
+
+# Tamaño máximo de las listas IN usadas al borrar subárboles a mitad de hilo
+DELETE_CHUNK = 1000
+
+def subtree_ids(comment_id):
+    """Ids del comentario y de todas sus respuestas (directas o indirectas) con un CTE recursivo."""
+    tree = select(Comment.id).where(Comment.id == comment_id).cte("subtree", recursive=True)
+    tree = tree.union_all(select(Comment.id).where(Comment.parent_id == tree.c.id))
+    return list(db.session.scalars(select(tree.c.id)))
+
+def _discount_authors(condition):
+    """Descuenta de las estadísticas de uso los comentarios que se van a borrar, por autor."""
+    for user_id, count in db.session.execute(
+        select(Comment.user_id, func.count()).where(condition).group_by(Comment.user_id)
+    ):
+        usage_stats.record(user_id, comments=-count)
+
+def delete_comment_subtree(comment):
+    """
+    Elimina un comentario junto con todo su subárbol de respuestas dentro de
+    la transacción actual, con un número acotado de sentencias:
+      - Si es un comentario raíz, todo el hilo comparte root_comment y basta
+        con dos sentencias filtradas por esa columna.
+      - Si está a mitad de hilo, se resuelve el subárbol con un CTE recursivo
+        y se borra en bloques de DELETE_CHUNK ids.
+    Antes de borrar se anula parent_id para que la FK autorreferenciada no
+    dependa del orden en que el motor elimina las filas.
+    Retorna (número de comentarios eliminados, filtros para MongoDB).
+    """
+    if comment.parent_id is None:
+        thread = Comment.query.filter(Comment.root_comment == comment.id)
+        _discount_authors(Comment.root_comment == comment.id)
+        thread.update({Comment.parent_id: None}, synchronize_session=False)
+        deleted = thread.delete(synchronize_session=False)
+        entity_cache.touch_where(Comment, lambda snapshot: snapshot["rootComment"] == comment.id)
+        return deleted, [{"rootComment": comment.id}]
+
+    ids = subtree_ids(comment.id)
+    chunks = [ids[start:start + DELETE_CHUNK] for start in range(0, len(ids), DELETE_CHUNK)]
+    # Primero se desenganchan todos los bloques: un bloque puede ser padre de otro
+    for chunk in chunks:
+        Comment.query.filter(Comment.id.in_(chunk)).update(
+            {Comment.parent_id: None}, synchronize_session=False
+        )
+    deleted = 0
+    for chunk in chunks:
+        _discount_authors(Comment.id.in_(chunk))
+        deleted += Comment.query.filter(Comment.id.in_(chunk)).delete(synchronize_session=False)
+    entity_cache.touch(Comment, *ids)
+    return deleted, [{"_id": {"$in": chunk}} for chunk in chunks]
@@ -0,0 +1,151 @@
+# Compresión en reposo del contenido de notas y comentarios. El valor
+# guardado (en SQL y en MongoDB) es el texto tal cual si es corto, o una
+# cabecera de 3 caracteres seguida del contenido comprimido en base64; así
+# sigue siendo texto válido en las columnas TEXT existentes y en JSON.
+
+import base64
+import logging
+import os
+import time
+import zlib
+from pymongo import UpdateOne
+
+# zstandard es opcional: sin él se usa zlib
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# zlib (por defecto), zstd o none para no comprimir las escrituras nuevas
+CONTENT_COMPRESSION = os.environ.get("CONTENT_COMPRESSION", "zlib")
+# Caracteres a partir de los cuales se comprime
+COMPRESSION_THRESHOLD = int(os.environ.get("COMPRESSION_THRESHOLD", "1024"))
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# Cabecera: ESC + "z" + algoritmo. Ningún texto guardado sin comprimir empieza así
+_MARKER = "\x1bz"
+_ZLIB = _MARKER + "l"
+_ZSTD = _MARKER + "s"
+
+if CONTENT_COMPRESSION == "zstd" and zstandard is None:
+    logger.warning("⚠️ CONTENT_COMPRESSION=zstd pero zstandard no está instalado; se usa zlib")
+    CONTENT_COMPRESSION = "zlib"
+
+def is_compressed(stored):
+    return isinstance(stored, str) and stored.startswith(_MARKER)
+
+def compress_text(text):
+    """Valor a guardar para `text`: comprimido si es largo y si de verdad ocupa menos."""
+    if text is None:
+        return None
+    # Un texto que imita la cabecera se comprime siempre para que no sea ambiguo
+    ambiguous = is_compressed(text)
+    if not ambiguous and (CONTENT_COMPRESSION == "none" or len(text) < COMPRESSION_THRESHOLD):
+        return text
+    raw = text.encode("utf-8")
+    if CONTENT_COMPRESSION == "zstd":
+        header, data = _ZSTD, zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    else:
+        header, data = _ZLIB, zlib.compress(raw, ZLIB_LEVEL)
+    stored = header + base64.b64encode(data).decode("ascii")
+    if len(stored) >= len(text) and not ambiguous:
+        return text
+    return stored
+
+def decompress_text(stored):
+    """Texto original de un valor guardado (comprimido o no)."""
+    if not is_compressed(stored):
+        return stored
+    data = base64.b64decode(stored[len(_ZLIB):])
+    if stored.startswith(_ZSTD):
+        if zstandard is None:
+            raise RuntimeError("Contenido comprimido con zstd y zstandard no está instalado")
+        return zstandard.ZstdDecompressor().decompress(data).decode("utf-8")
+    return zlib.decompress(data).decode("utf-8")
+
+class CompressedText:
+    """
+    Descriptor que expone como texto una columna guardada con compress_text.
+    Se descomprime al leer el atributo (p. ej. al serializar), no al cargar
+    la fila, y el resultado se recuerda mientras el valor guardado no cambie.
+    """
+
+    def __init__(self, stored_attr):
+        self.stored_attr = stored_attr
+        self.cache_attr = f"_{stored_attr}_text"
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        stored = getattr(obj, self.stored_attr)
+        cached = obj.__dict__.get(self.cache_attr)
+        if cached is not None and (cached[0] is stored or cached[0] == stored):
+            return cached[1]
+        text = decompress_text(stored)
+        obj.__dict__[self.cache_attr] = (stored, text)
+        return text
+
+    def __set__(self, obj, text):
+        stored = compress_text(text)
+        setattr(obj, self.stored_attr, stored)
+        obj.__dict__[self.cache_attr] = (stored, text)
+
+def compress_existing(mongo=None, batch_size=500, pause=0.0):
+    """
+    Comprime en bloques de `batch_size` filas el contenido guardado antes de
+    activar la compresión, en SQL y en MongoDB. Cada bloque es una transacción
+    corta, así que se puede ejecutar con el servidor en marcha: cada fila solo
+    se reescribe si su contenido sigue siendo el leído (una edición posterior
+    ya se guarda comprimida) y MongoDB solo se toca para las filas reescritas.
+    `pause` segundos entre bloques limitan la carga. Retorna {tabla: filas comprimidas}.
+    """
+    from sqlalchemy import bindparam, select, update
+    from app.config.db import db
+    from app.config.shards import shard_router
+    from app.models.comment import Comment
+    from app.models.note import Note
+
+    totals = {"notes": 0, "comments": 0}
+    for _ in shard_router.each():
+        for model, collection in ((Note, "notes"), (Comment, "comments")):
+            table = model.__table__
+            last_id, compressed = "", 0
+            while True:
+                rows = db.session.execute(
+                    select(table.c.id, table.c.content)
+                    .where(table.c.id > last_id).order_by(table.c.id).limit(batch_size)
+                ).all()
+                if not rows:
+                    break
+                last_id = rows[-1].id
+                changes = []
+                for row in rows:
+                    if row.content is None or is_compressed(row.content):
+                        continue
+                    stored = compress_text(row.content)
+                    if stored != row.content:
+                        changes.append({"b_id": row.id, "b_old": row.content, "b_content": stored})
+                # Una sentencia por fila para saber cuáles coincidieron (rowcount de un
+                # executemany es el total); updated_at se reasigna a sí mismo para que
+                # comprimir no cuente como edición
+                statement = (
+                    update(table).where(table.c.id == bindparam("b_id"), table.c.content == bindparam("b_old"))
+                    .values(content=bindparam("b_content"), updated_at=table.c.updated_at)
+                )
+                changes = [change for change in changes if db.session.execute(statement, change).rowcount]
+                db.session.commit()
+                if changes and mongo is not None:
+                    mongo[collection].bulk_write([
+                        UpdateOne({"_id": change["b_id"], "content": change["b_old"]},
+                                  {"$set": {"content": change["b_content"]}})
+                        for change in changes
+                    ], ordered=False)
+                compressed += len(changes)
+                if pause:
+                    time.sleep(pause)
+            totals[collection] += compressed
+    return totals
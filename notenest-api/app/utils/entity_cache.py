@@ -0,0 +1,195 @@
+# Caché de lectura de entidades por (modelo, id): guarda la versión
+# serializada de notas, usuarios, comentarios y sesiones para que las
+# comprobaciones de existencia y las lecturas de detalle no vayan a la base de
+# datos. Las escrituras la invalidan al confirmar la transacción.
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from itertools import count
+from sqlalchemy import event
+from sqlalchemy.orm import Session as SessionBase
+from app.config.db import db
+from app.config.replicas import replica_router
+from app.config.shards import shard_router
+from app.models.comment import Comment
+from app.models.note import Note, NoteSchema
+from app.models.session import Session, SessionSchema
+from app.models.user import User, UserSchema
+
+# Memoria máxima de las entradas (bytes aproximados del JSON); 0 desactiva la caché
+ENTITY_CACHE_MAX_BYTES = int(os.environ.get("ENTITY_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Segundos que vale una entrada: acota lo que tarda en verse una escritura de otro proceso
+ENTITY_CACHE_TTL = float(os.environ.get("ENTITY_CACHE_TTL", "30"))
+# Coste fijo estimado por entrada (clave, tupla, diccionario)
+_ENTRY_OVERHEAD = 200
+# Clave de session.info con lo que la transacción en curso ha modificado
+_PENDING = "entity_cache_pending"
+
+class _Entry:
+    __slots__ = ("version", "snapshot", "size", "expires")
+
+    def __init__(self, version, snapshot, size, expires):
+        self.version = version
+        self.snapshot = snapshot  # None: lápida de una entidad invalidada
+        self.size = size
+        self.expires = expires
+
+class EntityCache:
+    """
+    LRU de instantáneas serializadas, acotado por memoria. Cada entrada lleva
+    un número de versión que cambia al invalidarla: una lectura que fue a la
+    base de datos solo guarda su resultado si la versión no cambió mientras
+    tanto, así que una escritura concurrente nunca queda tapada por datos viejos.
+    Las instantáneas son compartidas: quien las recibe no debe modificarlas.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()  # (tabla, id) -> _Entry
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._versions = count(1)
+        self._models = {}  # modelo -> (serializar, cargar)
+        self._installed = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def register(self, model, serialize, load=None):
+        """
+        Declara un modelo cacheable. `serialize(instancia)` produce la
+        instantánea y `load(id)` la instancia (por defecto db.session.get);
+        si `load` retorna None no se guarda nada.
+        """
+        self._models[model] = (serialize, load or (lambda entity_id: db.session.get(model, entity_id)))
+
+    def init_app(self, app):
+        from app.utils.metrics import register_cache
+        register_cache("entity", self.stats)
+        if not self._installed:
+            event.listen(SessionBase, "after_flush", self._after_flush)
+            event.listen(SessionBase, "after_commit", self._after_end)
+            event.listen(SessionBase, "after_rollback", self._after_end)
+            self._installed = True
+
+    # -- Lectura ----------------------------------------------------------
+
+    def get(self, model, entity_id):
+        """Instantánea de la entidad, leída de la base de datos si no está en caché. None si no existe."""
+        if not entity_id:
+            return None
+        key = (model.__tablename__, entity_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.snapshot is not None and entry.expires > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.snapshot
+            seen = entry.version if entry is not None else None
+            self.misses += 1
+
+        serialize, load = self._models[model]
+        # Siempre de la principal: lo leído de una réplica atrasada se guardaría
+        # con la versión posterior a la escritura y taparía la lectura propia
+        with replica_router.primary():
+            instance = load(entity_id)
+        if instance is None:
+            return None
+        snapshot = serialize(instance)
+        if self._pending_in_transaction(key):
+            # La transacción en curso cambió esta entidad: puede no confirmarse
+            return snapshot
+
+        size = len(json.dumps(snapshot, default=str)) + _ENTRY_OVERHEAD
+        if size > ENTITY_CACHE_MAX_BYTES:
+            return snapshot
+        with self._lock:
+            current = self._entries.get(key)
+            if (current.version if current is not None else None) == seen:
+                self._put(key, _Entry(next(self._versions), snapshot, size, time.monotonic() + ENTITY_CACHE_TTL))
+        return snapshot
+
+    def _put(self, key, entry):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old.size
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while self._entries and self._bytes > ENTITY_CACHE_MAX_BYTES:
+            _, oldest = self._entries.popitem(last=False)
+            self._bytes -= oldest.size
+            self.evictions += 1
+
+    # -- Invalidación -----------------------------------------------------
+
+    def invalidate(self, model, *entity_ids):
+        """Descarta las entidades dejando una lápida con versión nueva."""
+        with self._lock:
+            for entity_id in entity_ids:
+                self._tombstone((model.__tablename__, entity_id))
+
+    def invalidate_where(self, model, predicate):
+        """Descarta las entidades del modelo cuya instantánea cumple `predicate`."""
+        table = model.__tablename__
+        with self._lock:
+            keys = [key for key, entry in self._entries.items()
+                    if key[0] == table and entry.snapshot is not None and predicate(entry.snapshot)]
+            for key in keys:
+                self._tombstone(key)
+
+    def _tombstone(self, key):
+        self.invalidations += 1
+        self._put(key, _Entry(next(self._versions), None, _ENTRY_OVERHEAD, 0))
+
+    def touch(self, model, *entity_ids):
+        """
+        Marca entidades modificadas con sentencias UPDATE/DELETE masivas (que
+        no pasan por los objetos de la sesión). Se invalidan ahora y otra vez
+        al terminar la transacción.
+        """
+        self.invalidate(model, *entity_ids)
+        pending = db.session.info.setdefault(_PENDING, [])
+        pending.extend((model, entity_id) for entity_id in entity_ids)
+
+    def touch_where(self, model, predicate):
+        """Como touch, para borrados masivos cuyos ids no se conocen (p. ej. un hilo entero)."""
+        self.invalidate_where(model, predicate)
+        db.session.info.setdefault(_PENDING, []).append((model, predicate))
+
+    def _pending_in_transaction(self, key):
+        for model, target in db.session.info.get(_PENDING, ()):
+            if model.__tablename__ == key[0] and (callable(target) or target == key[1]):
+                return True
+        return False
+
+    def _after_flush(self, session, flush_context):
+        pending = None
+        for instance in (*session.new, *session.dirty, *session.deleted):
+            if type(instance) in self._models:
+                if pending is None:
+                    pending = session.info.setdefault(_PENDING, [])
+                pending.append((type(instance), instance.id))
+                self.invalidate(type(instance), instance.id)
+
+    def _after_end(self, session):
+        for model, target in session.info.pop(_PENDING, ()):
+            if callable(target):
+                self.invalidate_where(model, target)
+            else:
+                self.invalidate(model, target)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "invalidations": self.invalidations, "entries": len(self._entries), "bytes": self._bytes}
+
+entity_cache = EntityCache()
+# Instantáneas con el mismo formato que retornan las rutas de detalle; las
+# tablas repartidas se buscan en su shard
+entity_cache.register(Note, NoteSchema().dump, load=shard_router.loader(Note, Note.get_active))
+entity_cache.register(User, UserSchema().dump)
+entity_cache.register(Comment, Comment.to_dict, load=shard_router.loader(Comment))
+entity_cache.register(Session, SessionSchema().dump, load=shard_router.loader(Session))
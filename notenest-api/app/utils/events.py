@@ -0,0 +1,174 @@
+# Difusión de cambios a los clientes por Server-Sent Events (/events): los
+# endpoints de escritura publican eventos compactos y cada suscriptor recibe
+# los de sus temas (su usuario, notas concretas o el feed público)
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Eventos pendientes por suscriptor; si un cliente lento lo llena recibe "reset"
+EVENTS_BUFFER = int(os.environ.get("EVENTS_BUFFER", "256"))
+# Últimos eventos guardados para reanudar con Last-Event-ID
+EVENTS_REPLAY = int(os.environ.get("EVENTS_REPLAY", "2048"))
+# Segundos entre latidos de una conexión sin eventos
+EVENTS_HEARTBEAT = float(os.environ.get("EVENTS_HEARTBEAT", "15"))
+EVENTS_MAX_SUBSCRIBERS = int(os.environ.get("EVENTS_MAX_SUBSCRIBERS", "10000"))
+# Temas por suscripción (notas concretas más usuario y público)
+EVENTS_MAX_TOPICS = int(os.environ.get("EVENTS_MAX_TOPICS", "200"))
+# Milisegundos que espera el navegador antes de reconectar
+RETRY_MS = 3000
+
+HEARTBEAT_FRAME = ": ping\n\n"
+# Sin id: el cliente conserva su Last-Event-ID hasta el siguiente evento real
+RESET_FRAME = "event: reset\ndata: {}\n\n"
+
+def note_topics(note):
+    """Temas de un cambio en una nota: la nota, su dueño y el feed si es pública."""
+    topics = [f"note:{note['id']}", f"user:{note['userId']}"]
+    if note.get("isPublic"):
+        topics.append("public")
+    return topics
+
+def _frame(event_id, event_type, data):
+    return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+class Subscriber:
+    __slots__ = ("topics", "buffer", "wake", "lagged", "active")
+
+    def __init__(self, topics):
+        self.topics = topics
+        self.buffer = deque()
+        self.wake = threading.Event()
+        self.lagged = False
+        self.active = True
+
+class EventHub:
+    """
+    Reparte cada evento a los suscriptores de sus temas. El evento se
+    serializa una sola vez y el reparto solo recorre los suscriptores de esos
+    temas, así que los suscriptores inactivos no cuestan nada al publicar;
+    mientras no hay eventos cada conexión solo espera en su threading.Event
+    hasta el siguiente latido.
+    Los ids son "<época>-<n>": la época cambia en cada arranque, y un
+    Last-Event-ID de otra época o demasiado antiguo recibe "reset" (el
+    cliente vuelve a pedir los datos completos).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._topics = {}  # tema -> set de Subscriber
+        self._subscribers = 0
+        self._replay = deque(maxlen=EVENTS_REPLAY)  # (n, temas, frame)
+        self._epoch = format(int(time.time() * 1000), "x")
+        self._sequence = 0
+        self.dropped = 0
+
+    def init_app(self, app):
+        from app.utils.metrics import registry
+        registry.register_collector(lambda: [
+            ("gauge", "notenest_events_subscribers", (), self._subscribers),
+            ("counter", "notenest_events_dropped_total", (), self.dropped),
+        ])
+
+    def cursor(self):
+        """Id del último evento publicado: como Last-Event-ID, recibe todo lo posterior."""
+        with self._lock:
+            return f"{self._epoch}-{self._sequence}"
+
+    def publish(self, topics, event_type, data):
+        """Publica un evento en los temas dados (llamar después del commit)."""
+        topics = tuple(topics)
+        with self._lock:
+            self._sequence += 1
+            frame = _frame(f"{self._epoch}-{self._sequence}", event_type, data)
+            self._replay.append((self._sequence, topics, frame))
+            delivered = set()
+            for topic in topics:
+                for subscriber in self._topics.get(topic, ()):
+                    if subscriber in delivered:
+                        continue
+                    delivered.add(subscriber)
+                    if len(subscriber.buffer) >= EVENTS_BUFFER:
+                        # Cliente demasiado lento: se descarta lo pendiente y se le pide recargar
+                        self.dropped += len(subscriber.buffer)
+                        subscriber.buffer.clear()
+                        subscriber.lagged = True
+                    else:
+                        subscriber.buffer.append(frame)
+                    subscriber.wake.set()
+
+    def subscribe(self, topics, last_event_id=None):
+        """
+        Registra un suscriptor. Retorna (suscriptor, frames a reenviar desde
+        last_event_id) o None si se alcanzó EVENTS_MAX_SUBSCRIBERS.
+        """
+        subscriber = Subscriber(frozenset(topics))
+        with self._lock:
+            if self._subscribers >= EVENTS_MAX_SUBSCRIBERS:
+                return None
+            for topic in subscriber.topics:
+                self._topics.setdefault(topic, set()).add(subscriber)
+            self._subscribers += 1
+            replay = self._replay_since(subscriber, last_event_id) if last_event_id else []
+        return subscriber, replay
+
+    def _replay_since(self, subscriber, last_event_id):
+        epoch, _, number = last_event_id.partition("-")
+        oldest = self._replay[0][0] if self._replay else self._sequence + 1
+        if epoch != self._epoch or not number.isdigit() or int(number) < oldest - 1:
+            return [RESET_FRAME]
+        return [frame for sequence, topics, frame in self._replay
+                if sequence > int(number) and not subscriber.topics.isdisjoint(topics)]
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            if not subscriber.active:
+                return
+            subscriber.active = False
+            for topic in subscriber.topics:
+                subscribers = self._topics.get(topic)
+                if subscribers is not None:
+                    subscribers.discard(subscriber)
+                    if not subscribers:
+                        del self._topics[topic]
+            self._subscribers -= 1
+
+    def next_frames(self, subscriber, timeout):
+        """Espera hasta `timeout` segundos y retorna los frames pendientes (lista vacía si no hay)."""
+        subscriber.wake.wait(timeout)
+        with self._lock:
+            frames = [RESET_FRAME] if subscriber.lagged else []
+            frames.extend(subscriber.buffer)
+            subscriber.buffer.clear()
+            subscriber.wake.clear()
+            subscriber.lagged = False
+        return frames
+
+    def stream(self, subscriber, replay):
+        """
+        Generador del cuerpo de la respuesta. Quien lo sirve debe llamar a
+        unsubscribe al cerrar la conexión (un generador que no llegó a
+        empezar no ejecuta su finally).
+        """
+        yield f"retry: {RETRY_MS}\n\n"
+        for frame in replay:
+            yield frame
+        while subscriber.active:
+            frames = self.next_frames(subscriber, EVENTS_HEARTBEAT)
+            if not frames:
+                yield HEARTBEAT_FRAME
+            for frame in frames:
+                yield frame
+
+event_hub = EventHub()
+
+def publish_note_event(event_type, note, **data):
+    """Publica un cambio relacionado con una nota. `note` es un dict con id, userId e isPublic."""
+    event_hub.publish(note_topics(note), event_type, {"noteId": note["id"], **data})
+
@@ -0,0 +1,225 @@
+# Soporte de la cabecera Idempotency-Key en las escrituras: la primera
+# respuesta se guarda (en memoria y opcionalmente en SQL) y los reintentos
+# con la misma clave la reciben sin volver a tocar MySQL ni MongoDB
+
+import functools
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from flask import Response, jsonify, make_response, request
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import IntegrityError
+from app.config.db import db
+from app.models.idempotency_key import IdempotencyKey
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+# Segundos que se conserva una respuesta
+IDEMPOTENCY_TTL = int(os.environ.get("IDEMPOTENCY_TTL", str(24 * 3600)))
+# Límites de la copia en memoria
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+IDEMPOTENCY_MAX_BYTES = int(os.environ.get("IDEMPOTENCY_MAX_BYTES", str(16 * 1024 * 1024)))
+# Segundos que un reintento espera a que termine la petición original
+IDEMPOTENCY_WAIT = float(os.environ.get("IDEMPOTENCY_WAIT", "30"))
+# Guardar también en la tabla idempotency_keys (sobrevive a reinicios y se comparte entre procesos)
+IDEMPOTENCY_SQL = os.environ.get("IDEMPOTENCY_SQL", "0") == "1"
+# Cada cuántas respuestas guardadas se purgan las caducadas de SQL
+_PRUNE_EVERY = 1000
+
+class StoredResponse:
+    __slots__ = ("fingerprint", "status", "content_type", "body", "expires")
+
+    def __init__(self, fingerprint, status, content_type, body, expires):
+        self.fingerprint = fingerprint
+        self.status = status
+        self.content_type = content_type
+        self.body = body
+        self.expires = expires
+
+    def to_response(self):
+        response = Response(self.body, status=self.status, content_type=self.content_type)
+        response.headers["Idempotent-Replayed"] = "true"
+        return response
+
+class IdempotencyStore:
+    """
+    Respuestas por clave con caducidad, en un LRU acotado por número de
+    entradas y por bytes. Las peticiones en curso se registran para que un
+    duplicado concurrente espere al original en lugar de ejecutarse.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._stored = 0
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        from app.utils.metrics import register_cache
+        register_cache("idempotency", self.stats)
+
+    # -- Memoria ----------------------------------------------------------
+
+    def _get(self, scope):
+        entry = self._entries.get(scope)
+        if entry is None:
+            return None
+        if entry.expires <= time.time():
+            self._discard(scope)
+            return None
+        self._entries.move_to_end(scope)
+        return entry
+
+    def _discard(self, scope):
+        entry = self._entries.pop(scope, None)
+        if entry is not None:
+            self._bytes -= len(entry.body)
+
+    def _put(self, scope, entry):
+        self._discard(scope)
+        self._entries[scope] = entry
+        self._bytes += len(entry.body)
+        while self._entries and (len(self._entries) > IDEMPOTENCY_MAX_ENTRIES or self._bytes > IDEMPOTENCY_MAX_BYTES):
+            _, oldest = self._entries.popitem(last=False)
+            self._bytes -= len(oldest.body)
+
+    # -- SQL --------------------------------------------------------------
+
+    def _sql_get(self, scope):
+        with db.engine.connect() as conn:
+            row = conn.execute(
+                select(IdempotencyKey.fingerprint, IdempotencyKey.status, IdempotencyKey.content_type,
+                       IdempotencyKey.body, IdempotencyKey.expires_at)
+                .where(IdempotencyKey.scope_hash == _hash(scope), IdempotencyKey.expires_at > datetime.utcnow())
+            ).first()
+        if row is None:
+            return None
+        expires = time.time() + (row.expires_at - datetime.utcnow()).total_seconds()
+        return StoredResponse(row.fingerprint, row.status, row.content_type, bytes(row.body), expires)
+
+    def _sql_put(self, scope, entry):
+        # Conexión propia: no se mezcla con lo que haya dejado la sesión de la vista
+        now = datetime.utcnow()
+        with db.engine.begin() as conn:
+            try:
+                conn.execute(insert(IdempotencyKey).values(
+                    scope_hash=_hash(scope), fingerprint=entry.fingerprint, status=entry.status,
+                    content_type=entry.content_type, body=entry.body,
+                    expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL), created_at=now,
+                ))
+            except IntegrityError:
+                return  # Otro proceso guardó antes la misma clave
+            self._stored += 1
+            if self._stored % _PRUNE_EVERY == 0:
+                conn.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at <= now))
+
+    # -- Ciclo de una petición ---------------------------------------------
+
+    def begin(self, scope):
+        """
+        Retorna la respuesta guardada para `scope` o None si esta petición
+        pasa a ser la original (debe llamar a finish). Si hay una original en
+        curso espera a que termine; TimeoutError si tarda más de IDEMPOTENCY_WAIT.
+        """
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT
+        while True:
+            with self._lock:
+                entry = self._get(scope)
+                if entry is not None:
+                    self.hits += 1
+                    return entry
+                event = self._inflight.get(scope)
+                if event is None:
+                    self._inflight[scope] = threading.Event()
+                    break
+            if not event.wait(max(deadline - time.monotonic(), 0)):
+                raise TimeoutError(scope)
+            # La original terminó: si no guardó respuesta (error 5xx) se repite el bucle y se ejecuta
+
+        if IDEMPOTENCY_SQL:
+            try:
+                entry = self._sql_get(scope)
+            except Exception:
+                self.finish(scope, None)  # No dejar esperando a los duplicados
+                raise
+            if entry is not None:
+                self.finish(scope, entry, persist=False)
+                self.hits += 1
+                return entry
+        self.misses += 1
+        return None
+
+    def finish(self, scope, entry, persist=True):
+        """Guarda la respuesta (si la hay) y libera a los duplicados que esperan."""
+        try:
+            if entry is not None and persist and IDEMPOTENCY_SQL:
+                self._sql_put(scope, entry)
+        finally:
+            with self._lock:
+                if entry is not None:
+                    self._put(scope, entry)
+                event = self._inflight.pop(scope, None)
+            if event is not None:
+                event.set()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "entries": len(self._entries), "bytes": self._bytes}
+
+def _hash(value):
+    return hashlib.sha256(value if isinstance(value, bytes) else value.encode("utf-8")).hexdigest()
+
+idempotency_store = IdempotencyStore()
+
+def idempotent(view):
+    """
+    Decorador para escrituras: con cabecera Idempotency-Key, la primera
+    respuesta (salvo errores 5xx, que se pueden reintentar) se guarda
+    IDEMPOTENCY_TTL segundos y se devuelve tal cual en los reintentos.
+    Reutilizar una clave con otro cuerpo retorna 422.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({"error": f"{HEADER} demasiado larga"}), 400
+
+        scope = f"{request.method} {request.path} {key}"
+        fingerprint = _hash(request.get_data())
+        try:
+            stored = idempotency_store.begin(scope)
+        except TimeoutError:
+            return jsonify({"error": "La petición original sigue en curso"}), 409
+        if stored is not None:
+            if stored.fingerprint != fingerprint:
+                return jsonify({"error": f"{HEADER} reutilizada con otro cuerpo"}), 422
+            logger.info("🔁 Respuesta repetida para %s %s", request.method, request.path)
+            return stored.to_response()
+
+        entry = None
+        try:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code < 500 and not response.is_streamed:
+                entry = StoredResponse(fingerprint, response.status_code, response.content_type,
+                                       response.get_data(), time.time() + IDEMPOTENCY_TTL)
+            return response
+        finally:
+            try:
+                idempotency_store.finish(scope, entry)
+            except Exception as e:
+                # La escritura ya se hizo: un fallo al guardar la respuesta no debe convertirla en error
+                logger.error("❌ No se pudo guardar la respuesta idempotente: %s", str(e))
+    return wrapper
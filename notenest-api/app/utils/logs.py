@@ -0,0 +1,199 @@
+# Registro estructurado y no bloqueante: los handlers encolan los registros y
+# un hilo en segundo plano los escribe como JSON. Los cuerpos de las peticiones
+# se resumen a un presupuesto de bytes y los campos sensibles se ocultan.
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from flask import has_request_context, request
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+# Bytes aproximados que puede ocupar el resumen de un payload en un registro
+PAYLOAD_BUDGET = int(os.environ.get("LOG_PAYLOAD_BYTES", "1024"))
+# Muestreo de registros INFO/DEBUG ruidosos: "logger=proporción,..."
+SAMPLING = os.environ.get("LOG_SAMPLING", "app.utils.query_stats=0.1")
+
+SENSITIVE_KEYS = {"password", "passwordhash", "password_hash", "salt", "token", "authorization", "secret"}
+REDACTED = "[REDACTED]"
+_MAX_DEPTH = 4
+_SAMPLE_ITEMS = 3
+
+# ----------------------------------------------------------------------
+# Resumen de payloads
+# ----------------------------------------------------------------------
+
+class _Budget:
+    __slots__ = ("remaining",)
+
+    def __init__(self, size):
+        self.remaining = size
+
+    def take(self, size):
+        self.remaining -= size
+        return self.remaining >= 0
+
+def _summarize(value, budget, depth):
+    if budget.remaining <= 0:
+        return "…"
+    if isinstance(value, dict):
+        if depth >= _MAX_DEPTH:
+            return f"<dict {len(value)} claves>"
+        result = {}
+        for index, (key, item) in enumerate(value.items()):
+            if not budget.take(len(str(key)) + 4):
+                result["…"] = f"+{len(value) - index} claves"
+                break
+            if str(key).lower() in SENSITIVE_KEYS:
+                result[key] = REDACTED
+            else:
+                result[key] = _summarize(item, budget, depth + 1)
+        return result
+    if isinstance(value, (list, tuple)):
+        if depth >= _MAX_DEPTH or len(value) > _SAMPLE_ITEMS:
+            # Las listas largas (p. ej. una sincronización masiva) se resumen con unos ejemplos
+            sample = [_summarize(item, budget, depth + 1) for item in value[:_SAMPLE_ITEMS]] if depth < _MAX_DEPTH else []
+            return {"count": len(value), "sample": sample}
+        return [_summarize(item, budget, depth + 1) for item in value]
+    if isinstance(value, bytes):
+        budget.take(16)
+        return f"<{len(value)} bytes>"
+    if isinstance(value, str):
+        room = max(budget.remaining, 0)
+        budget.take(len(value) + 2)
+        if len(value) > room:
+            return f"{value[:room]}…(+{len(value) - room} caracteres)"
+        return value
+    budget.take(8)
+    return value if isinstance(value, (int, float, bool)) or value is None else str(value)
+
+def summarize(payload, budget=None):
+    """
+    Resumen de un payload apto para registrar: como mucho ~`budget` bytes,
+    listas largas reducidas a su tamaño y unos ejemplos, y campos sensibles
+    (contraseñas, hashes, tokens) ocultos. El coste es proporcional al
+    presupuesto, no al tamaño del payload.
+    """
+    return _summarize(payload, _Budget(budget or PAYLOAD_BUDGET), 0)
+
+# ----------------------------------------------------------------------
+# Formato, muestreo y cola
+# ----------------------------------------------------------------------
+
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+class JSONFormatter(logging.Formatter):
+    """Una línea JSON por registro, con los campos de `extra` incluidos."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "thread": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class SamplingFilter(logging.Filter):
+    """Deja pasar solo una proporción de los registros INFO/DEBUG de ciertos loggers."""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.name)
+        return rate is None or random.random() < rate
+
+def _parse_sampling(spec):
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Encola sin esperar: si la cola está llena el registro se descarta y se
+    cuenta. El mensaje se formatea en el hilo escritor, no en el de la
+    petición; aquí solo se añaden los datos de la petición y la traza.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Los argumentos que no son valores simples se resumen ya: el objeto
+        # podría cambiar (o ser una instancia del ORM) antes de que se escriba
+        if isinstance(record.args, tuple):
+            record.args = tuple(
+                arg if isinstance(arg, (str, int, float, bool, type(None))) else summarize(arg)
+                for arg in record.args
+            )
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        if has_request_context() and not hasattr(record, "http"):
+            record.http = {"method": request.method, "path": request.path}
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+_listener = None
+_handler = None
+
+def dropped_records():
+    return _handler.dropped if _handler is not None else 0
+
+def init_logging():
+    """
+    Sustituye los handlers del logger raíz por una cola acotada y un hilo que
+    escribe en stderr (JSON por defecto, LOG_FORMAT=text para el formato clásico).
+    """
+    global _listener, _handler
+    if _listener is not None:
+        return
+    log_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    output = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == "json":
+        output.setFormatter(JSONFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+
+    _handler = NonBlockingQueueHandler(log_queue)
+    _handler.addFilter(SamplingFilter(_parse_sampling(SAMPLING)))
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_handler)
+    root.setLevel(LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    # Vaciar la cola al salir para no perder los últimos registros
+    atexit.register(_listener.stop)
+
+    from app.utils.metrics import registry
+    registry.register_collector(
+        lambda: [("counter", "notenest_log_records_dropped_total", (), dropped_records())]
+    )
@@ -0,0 +1,383 @@
+# Métricas en formato Prometheus: peticiones por ruta y estado, histogramas
+# de latencia (total, SQL, MongoDB y serialización), peticiones en curso,
+# tasas de acierto de cachés y estado de los pools de conexiones
+
+import atexit
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from flask import g, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+from app.utils.query_stats import current_stats
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Directorio compartido para juntar las métricas de varios procesos (gunicorn -w N)
+MULTIPROC_DIR = os.environ.get("METRICS_MULTIPROC_DIR")
+FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "5"))
+
+HELP = {
+    "notenest_http_requests_total": ("counter", "Peticiones atendidas por ruta, método y estado"),
+    "notenest_http_requests_in_flight": ("gauge", "Peticiones en curso por ruta"),
+    "notenest_http_request_duration_seconds": ("histogram", "Duración de la petición hasta generar la respuesta"),
+    "notenest_sql_duration_seconds": ("histogram", "Tiempo en la base de datos SQL por petición"),
+    "notenest_mongo_duration_seconds": ("histogram", "Tiempo en el almacén de documentos por petición"),
+    "notenest_serialization_duration_seconds": ("histogram", "Tiempo serializando JSON por petición"),
+    "notenest_cache_hits_total": ("counter", "Aciertos por caché"),
+    "notenest_cache_misses_total": ("counter", "Fallos por caché"),
+    "notenest_cache_hit_ratio": ("gauge", "Proporción de aciertos por caché"),
+    "notenest_db_pool_connections": ("gauge", "Conexiones del pool SQL por estado"),
+    "notenest_preview_queue_pending": ("gauge", "Vistas previas pendientes de generar"),
+    "notenest_log_records_dropped_total": ("counter", "Registros de log descartados por cola llena"),
+    "notenest_events_subscribers": ("gauge", "Conexiones abiertas a /events"),
+    "notenest_shards": ("gauge", "Bases de datos SQL entre las que se reparten los datos de usuario"),
+    "notenest_shard_scatter_total": ("counter", "Consultas repartidas entre todos los shards"),
+    "notenest_shard_lookups_total": ("counter", "Búsquedas en todos los shards del shard de una fila"),
+    "notenest_events_dropped_total": ("counter", "Eventos descartados por suscriptores demasiado lentos"),
+    "notenest_replica_reads_total": ("counter", "Peticiones de lectura por base de la que leen (réplica o principal)"),
+    "notenest_replica_healthy": ("gauge", "1 si la réplica recibe lecturas, 0 si está retirada"),
+    "notenest_replica_lag_seconds": ("gauge", "Retraso de la réplica respecto a la base principal"),
+    "notenest_autosave_pending_notes": ("gauge", "Notas con cambios de autoguardado pendientes de escribir"),
+    "notenest_autosave_coalesced_total": ("counter", "Peticiones de autoguardado absorbidas por una escritura posterior"),
+    "notenest_autosave_flushes_total": ("counter", "Escrituras de notas con los cambios de autoguardado acumulados"),
+    "notenest_usage_stats_pending_scopes": ("gauge", "Usuarios (y totales) con cambios de estadísticas de uso sin guardar"),
+    "notenest_usage_stats_checkpoints_total": ("counter", "Escrituras de los cambios acumulados en usage_stats"),
+}
+
+# ----------------------------------------------------------------------
+# Acumuladores por hilo
+# ----------------------------------------------------------------------
+
+class _Shard:
+    """Métricas de un solo hilo: solo él escribe, así que no necesita candados."""
+
+    __slots__ = ("counters", "gauges", "histograms")
+
+    def __init__(self):
+        self.counters = {}    # (nombre, etiquetas) -> valor
+        self.gauges = {}
+        self.histograms = {}  # (nombre, etiquetas) -> [cubetas..., suma, cuenta]
+
+    def merge_into(self, counters, gauges, histograms):
+        for key, value in self.counters.copy().items():
+            counters[key] = counters.get(key, 0) + value
+        for key, value in self.gauges.copy().items():
+            gauges[key] = gauges.get(key, 0) + value
+        for key, values in self.histograms.copy().items():
+            values = list(values)
+            total = histograms.get(key)
+            if total is None:
+                histograms[key] = values
+            else:
+                for index, value in enumerate(values):
+                    total[index] += value
+
+class Registry:
+    """
+    Cada hilo escribe en su propio _Shard (sin candados en el camino caliente);
+    al leer se suman todos. Los shards de hilos terminados se pliegan en uno
+    "retirado" para que la lista no crezca con servidores de un hilo por petición.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []  # (hilo, shard)
+        self._retired = _Shard()
+        self._collectors = []
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                if len(self._shards) >= 64:
+                    self._retire_dead()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _retire_dead(self):
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                shard.merge_into(self._retired.counters, self._retired.gauges, self._retired.histograms)
+        self._shards = alive
+
+    def inc(self, name, labels, value=1):
+        counters = self._shard().counters
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def add_gauge(self, name, labels, value):
+        gauges = self._shard().gauges
+        key = (name, labels)
+        gauges[key] = gauges.get(key, 0) + value
+
+    def observe(self, name, labels, seconds):
+        histograms = self._shard().histograms
+        key = (name, labels)
+        values = histograms.get(key)
+        if values is None:
+            values = histograms[key] = [0] * (len(BUCKETS) + 3)
+        values[bisect.bisect_left(BUCKETS, seconds)] += 1
+        values[-2] += seconds
+        values[-1] += 1
+
+    def register_collector(self, collector):
+        """collector() -> lista de (tipo, nombre, etiquetas, valor), evaluada en cada lectura."""
+        self._collectors.append(collector)
+
+    def snapshot(self):
+        """Suma de todos los hilos más los colectores. Retorna (contadores, gauges, histogramas)."""
+        counters, gauges, histograms = {}, {}, {}
+        with self._lock:
+            self._retire_dead()
+            shards = [shard for _, shard in self._shards] + [self._retired]
+        for shard in shards:
+            shard.merge_into(counters, gauges, histograms)
+        for collector in self._collectors:
+            try:
+                for kind, name, labels, value in collector():
+                    target = counters if kind == "counter" else gauges
+                    target[(name, labels)] = target.get((name, labels), 0) + value
+            except Exception as e:
+                logger.error("❌ Error en un colector de métricas: %s", str(e))
+        return counters, gauges, histograms
+
+registry = Registry()
+
+# ----------------------------------------------------------------------
+# Varios procesos: cada uno vuelca su snapshot a un archivo y se suman al leer
+# ----------------------------------------------------------------------
+
+_START = int(time.time())
+
+def _snapshot_path():
+    return os.path.join(MULTIPROC_DIR, f"metrics_{os.getpid()}_{_START}.json")
+
+def _encode(mapping):
+    return [[name, list(map(list, labels)), value] for (name, labels), value in mapping.items()]
+
+def _decode(items):
+    return {(name, tuple(map(tuple, labels))): value for name, labels, value in items}
+
+def flush():
+    """Escribe el snapshot de este proceso en METRICS_MULTIPROC_DIR (escritura atómica)."""
+    if not MULTIPROC_DIR:
+        return
+    counters, gauges, histograms = registry.snapshot()
+    path = _snapshot_path()
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as handle:
+        json.dump({
+            "pid": os.getpid(),
+            "counters": _encode(counters),
+            "gauges": _encode(gauges),
+            "histograms": _encode(histograms),
+        }, handle)
+    os.replace(tmp, path)
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+def collect():
+    """Métricas a exponer: las de este proceso, o las de todos si hay directorio compartido."""
+    if not MULTIPROC_DIR:
+        return registry.snapshot()
+    flush()
+    counters, gauges, histograms = {}, {}, {}
+    for path in glob.glob(os.path.join(MULTIPROC_DIR, "metrics_*.json")):
+        try:
+            with open(path) as handle:
+                data = json.load(handle)
+        except (OSError, ValueError):
+            continue
+        for key, value in _decode(data["counters"]).items():
+            counters[key] = counters.get(key, 0) + value
+        # Los gauges de procesos muertos ya no son ciertos; los contadores sí se conservan
+        if _pid_alive(data["pid"]):
+            for key, value in _decode(data["gauges"]).items():
+                gauges[key] = gauges.get(key, 0) + value
+        for key, values in _decode(data["histograms"]).items():
+            total = histograms.get(key)
+            if total is None:
+                histograms[key] = list(values)
+            else:
+                for index, value in enumerate(values):
+                    total[index] += value
+    return counters, gauges, histograms
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception as e:
+            logger.error("❌ Error volcando métricas: %s", str(e))
+
+# ----------------------------------------------------------------------
+# Formato de texto de Prometheus
+# ----------------------------------------------------------------------
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render():
+    counters, gauges, histograms = collect()
+    by_name = {}
+    for mapping in (counters, gauges):
+        for (name, labels), value in mapping.items():
+            by_name.setdefault(name, []).append((labels, value))
+    for (name, labels), values in histograms.items():
+        by_name.setdefault(name, []).append((labels, values))
+
+    lines = []
+    for name in sorted(by_name):
+        kind, description = HELP.get(name, ("untyped", name))
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(by_name[name]):
+            if kind != "histogram":
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (float("inf"),), value[:len(BUCKETS) + 1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{_labels(labels, [('le', le)])} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(value[-2])}")
+            lines.append(f"{name}_count{_labels(labels)} {value[-1]}")
+    return "\n".join(lines) + "\n"
+
+# ----------------------------------------------------------------------
+# Cachés y pools
+# ----------------------------------------------------------------------
+
+def register_cache(name, stats):
+    """
+    Publica la tasa de aciertos de una caché. `stats()` debe retornar un dict
+    con al menos 'hits' y 'misses' acumulados.
+    """
+    def collector():
+        values = stats()
+        hits, misses = values.get("hits", 0), values.get("misses", 0)
+        labels = (("cache", name),)
+        samples = [
+            ("counter", "notenest_cache_hits_total", labels, hits),
+            ("counter", "notenest_cache_misses_total", labels, misses),
+        ]
+        if not MULTIPROC_DIR and hits + misses:
+            # Con varios procesos la proporción se calcula en Prometheus a partir de los contadores
+            samples.append(("gauge", "notenest_cache_hit_ratio", labels, round(hits / (hits + misses), 4)))
+        return samples
+    registry.register_collector(collector)
+
+def _pool_collector(app):
+    def collector():
+        from app.config.db import db
+        with app.app_context():
+            pool = db.engine.pool
+        samples = []
+        for state in ("checkedout", "checkedin", "overflow", "size"):
+            method = getattr(pool, state, None)
+            if callable(method):
+                # overflow() es negativo mientras el pool no está lleno
+                value = max(0, method())
+                samples.append(("gauge", "notenest_db_pool_connections", (("state", state),), value))
+        return samples
+    return collector
+
+def _preview_collector():
+    from app.utils.previews import preview_pipeline
+    return [("gauge", "notenest_preview_queue_pending", (), preview_pipeline.pending())]
+
+# ----------------------------------------------------------------------
+# Integración con Flask
+# ----------------------------------------------------------------------
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Proveedor JSON de Flask que acumula en la petición el tiempo de serialización."""
+
+    def dumps(self, obj, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            if has_request_context():
+                g._metrics_serialize = g.get("_metrics_serialize", 0.0) + time.perf_counter() - start
+
+def _route():
+    return request.url_rule.endpoint if request.url_rule is not None else "unmatched"
+
+def _start_request():
+    g._metrics_start = time.perf_counter()
+    g._metrics_route = _route()
+    registry.add_gauge("notenest_http_requests_in_flight", (("route", g._metrics_route),), 1)
+
+def _record(status):
+    route = g._metrics_route
+    method = request.method
+    labels = (("route", route), ("method", method))
+    registry.inc("notenest_http_requests_total", labels + (("status", str(status)),))
+    registry.observe("notenest_http_request_duration_seconds", labels, time.perf_counter() - g._metrics_start)
+    stats = current_stats()
+    if stats is not None:
+        registry.observe("notenest_sql_duration_seconds", labels, stats.sql_time)
+        registry.observe("notenest_mongo_duration_seconds", labels, stats.mongo_time)
+    registry.observe("notenest_serialization_duration_seconds", labels, g.get("_metrics_serialize", 0.0))
+    g._metrics_recorded = True
+
+def _after_request(response):
+    if "_metrics_start" in g:
+        _record(response.status_code)
+    return response
+
+def _end_request(exc=None):
+    if "_metrics_start" not in g:
+        return
+    if not g.get("_metrics_recorded"):
+        _record(500)  # Excepción sin manejar: after_request no se llegó a ejecutar
+    registry.add_gauge("notenest_http_requests_in_flight", (("route", g._metrics_route),), -1)
+
+def init_metrics(app):
+    """
+    Instrumenta las peticiones y registra los colectores de pools.
+    Debe llamarse después de init_query_stats (usa sus tiempos de SQL y MongoDB).
+    Se desactiva con METRICS_ENABLED=0.
+    """
+    if os.environ.get("METRICS_ENABLED", "1") != "1":
+        return False
+    app.json = TimedJSONProvider(app)
+    app.before_request(_start_request)
+    app.after_request(_after_request)
+    app.teardown_request(_end_request)
+    registry.register_collector(_pool_collector(app))
+    registry.register_collector(_preview_collector)
+    if MULTIPROC_DIR:
+        os.makedirs(MULTIPROC_DIR, exist_ok=True)
+        atexit.register(flush)
+        threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True).start()
+    return True
@@ -0,0 +1,207 @@
+# Limpieza en segundo plano de las notas eliminadas: borra comentarios,
+# archivos y documentos de MongoDB en lotes acotados, sin bloquear la petición
+
+import logging
+import os
+import threading
+import traceback
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from app.config.db import db
+from app.config.shards import shard_router
+from app.models.comment import Comment
+from app.models.note import Note
+from app.models.note_files import NoteFile
+from app.models.note_cleanup_job import NoteCleanupJob
+from app.models.note_like import NoteLike
+from app.utils.blob_store import release_blobs, reclaim
+from app.utils.entity_cache import entity_cache
+from app.utils.like_index import like_index
+from app.utils.usage_stats import usage_stats
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.environ.get("NOTE_CLEANUP_BATCH", "500"))
+POLL_INTERVAL = float(os.environ.get("NOTE_CLEANUP_INTERVAL", "30"))
+LEASE = timedelta(seconds=int(os.environ.get("NOTE_CLEANUP_LEASE", "60")))
+
+def _claim(note_id):
+    """Toma (o renueva) la concesión del trabajo. Retorna False si otro proceso lo tiene."""
+    now = datetime.utcnow()
+    claimed = NoteCleanupJob.query.filter(
+        NoteCleanupJob.note_id == note_id,
+        NoteCleanupJob.phase != 'done',
+        (NoteCleanupJob.locked_until.is_(None)) | (NoteCleanupJob.locked_until < now),
+    ).update({NoteCleanupJob.locked_until: now + LEASE}, synchronize_session=False)
+    db.session.commit()
+    return claimed == 1
+
+def _renew(job):
+    job.locked_until = datetime.utcnow() + LEASE
+
+def _delete_comments_batch(note_id):
+    """
+    Borra un lote de comentarios de la nota. Primero se desenganchan las
+    respuestas (parent_id = NULL) para que la FK autorreferenciada no dependa
+    del orden; cuando no quedan respuestas enganchadas se borra por lotes.
+    Retorna el número de comentarios borrados (0 si ya no queda ninguno).
+    """
+    attached = list(db.session.scalars(
+        select(Comment.id)
+        .where(Comment.note_id == note_id, Comment.parent_id.isnot(None))
+        .limit(BATCH_SIZE)
+    ))
+    if attached:
+        Comment.query.filter(Comment.id.in_(attached)).update(
+            {Comment.parent_id: None}, synchronize_session=False
+        )
+        return -1  # Hay trabajo pendiente pero aún no se ha borrado nada
+
+    rows = db.session.execute(
+        select(Comment.id, Comment.user_id).where(Comment.note_id == note_id).limit(BATCH_SIZE)
+    ).all()
+    if not rows:
+        return 0
+    ids = [row[0] for row in rows]
+    for user_id, count in Counter(row[1] for row in rows).items():
+        usage_stats.record(user_id, comments=-count)
+    entity_cache.touch(Comment, *ids)
+    return Comment.query.filter(Comment.id.in_(ids)).delete(synchronize_session=False)
+
+def _delete_files_batch(note_id):
+    """
+    Borra un lote de archivos de la nota y libera sus referencias a blobs.
+    Retorna (archivos borrados, hashes de blobs que ya no usa nadie).
+    """
+    rows = db.session.execute(
+        select(NoteFile.id, NoteFile.blob_sha256).where(NoteFile.note_id == note_id).limit(BATCH_SIZE)
+    ).all()
+    if not rows:
+        return 0, []
+    deleted = NoteFile.query.filter(NoteFile.id.in_([row[0] for row in rows])).delete(synchronize_session=False)
+    return deleted, release_blobs([row[1] for row in rows])
+
+def _delete_mongo_batch(mongo, collection, note_id):
+    ids = [doc["_id"] for doc in mongo[collection].find({"noteId": note_id}, {"_id": 1}).limit(BATCH_SIZE)]
+    if not ids:
+        return 0
+    return mongo[collection].delete_many({"_id": {"$in": ids}}).deleted_count
+
+def process_job(job, mongo):
+    """
+    Ejecuta un trabajo de limpieza hasta el final. Cada lote se confirma en su
+    propia transacción y es idempotente, así que tras una caída basta con
+    volver a llamar a esta función para continuar donde se quedó.
+    """
+    note_id = job.note_id
+
+    while job.phase == 'comments':
+        deleted = _delete_comments_batch(note_id)
+        if deleted > 0:
+            job.comments_deleted += deleted
+        elif deleted == 0:
+            job.phase = 'files'
+        _renew(job)
+        db.session.commit()
+
+    while job.phase == 'files':
+        deleted, reclaimed = _delete_files_batch(note_id)
+        if deleted:
+            job.files_deleted += deleted
+        else:
+            job.phase = 'mongo'
+        _renew(job)
+        db.session.commit()
+        reclaim(reclaimed)
+
+    while job.phase == 'mongo':
+        deleted = (_delete_mongo_batch(mongo, "comments", note_id)
+                   or _delete_mongo_batch(mongo, "note_files", note_id))
+        if deleted:
+            job.mongo_deleted += deleted
+        else:
+            job.phase = 'note'
+        _renew(job)
+        db.session.commit()
+
+    if job.phase == 'note':
+        NoteLike.query.filter_by(note_id=note_id).delete(synchronize_session=False)
+        Note.query.filter_by(id=note_id).delete(synchronize_session=False)
+        entity_cache.touch(Note, note_id)
+        mongo.notes.delete_one({"_id": note_id})
+        job.phase = 'done'
+        job.locked_until = None
+        db.session.commit()
+        like_index.forget_note(note_id)
+        logger.info("🧹 Limpieza de la nota %s terminada (%d comentarios, %d archivos)",
+                    note_id, job.comments_deleted, job.files_deleted)
+
+def run_pending_jobs(mongo):
+    """Procesa todos los trabajos pendientes que no tenga otro proceso. Retorna cuántos terminó."""
+    finished = 0
+    for _ in shard_router.each():
+        finished += _run_shard_jobs(mongo)
+    return finished
+
+def _run_shard_jobs(mongo):
+    """Trabajos pendientes del shard actual (de la única base sin sharding)."""
+    finished = 0
+    pending = list(db.session.scalars(
+        select(NoteCleanupJob.note_id)
+        .where(NoteCleanupJob.phase != 'done')
+        .order_by(NoteCleanupJob.created_at)
+    ))
+    for note_id in pending:
+        if not _claim(note_id):
+            continue
+        job = db.session.get(NoteCleanupJob, note_id)
+        try:
+            process_job(job, mongo)
+            finished += 1
+        except Exception as e:
+            logger.error("❌ Error limpiando la nota %s: %s", note_id, str(e))
+            logger.debug(traceback.format_exc())
+            db.session.rollback()
+            # Se guarda el error y se libera la concesión para reintentar en la próxima vuelta
+            job = db.session.get(NoteCleanupJob, note_id)
+            job.error = str(e)
+            job.locked_until = None
+            db.session.commit()
+    return finished
+
+class NoteCleanupWorker:
+    """Hilo en segundo plano que procesa los trabajos de limpieza de notas."""
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._thread = None
+
+    def init_app(self, app):
+        """Arranca el hilo (se desactiva con NOTE_CLEANUP_WORKER=0)."""
+        if os.environ.get("NOTE_CLEANUP_WORKER", "1") != "1" or self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, args=(app,), name="note-cleanup", daemon=True
+        )
+        self._thread.start()
+
+    def notify(self):
+        """Despierta al hilo para que procese un trabajo recién creado."""
+        self._wake.set()
+
+    def _run(self, app):
+        # Al arrancar se reanudan los trabajos que quedaron a medias
+        while True:
+            try:
+                with app.app_context():
+                    run_pending_jobs(app.config['MONGO_DB'])
+                    db.session.remove()
+            except Exception as e:
+                logger.error("❌ Error en el hilo de limpieza de notas: %s", str(e))
+                logger.debug(traceback.format_exc())
+            self._wake.wait(POLL_INTERVAL)
+            self._wake.clear()
+
+note_cleanup_worker = NoteCleanupWorker()
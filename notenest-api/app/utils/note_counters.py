@@ -0,0 +1,111 @@
+from sqlalchemy import case, func, literal, select, union_all, update
+from pymongo import UpdateOne
+from app.config.db import db
+from app.config.shards import shard_router
+from app.models.note import Note
+from app.models.comment import Comment
+from app.models.note_files import NoteFile
+from app.utils.bootstrap import mark_user_data_changed
+from app.utils.entity_cache import entity_cache
+
+# Notas por bulk_write al reescribir los contadores en MongoDB
+MONGO_BATCH = 1000
+
+def _clamped(column, delta):
+    """Expresión SQL `column + delta` que nunca baja de cero."""
+    return case((column + delta < 0, 0), else_=column + delta)
+
+def bump_note_counters(note_id, comments=0, files=0):
+    """
+    Suma (o resta) a los contadores de una nota dentro de la transacción actual.
+    El UPDATE es atómico en la base de datos, así que dos peticiones concurrentes
+    no se pisan. Retorna el número de filas afectadas (0 si la nota no existe
+    o está marcada como eliminada).
+    """
+    values = {}
+    if comments:
+        values[Note.comment_count] = _clamped(Note.comment_count, comments)
+    if files:
+        values[Note.file_count] = _clamped(Note.file_count, files)
+    if not values:
+        return 0
+    # Se fija updated_at a sí mismo para que el onupdate no marque la nota como editada
+    values[Note.updated_at] = Note.updated_at
+    entity_cache.touch(Note, note_id)
+    return Note.active().filter(Note.id == note_id).update(values, synchronize_session=False)
+
+def bump_note_likes(note_id, delta):
+    """
+    Suma `delta` a notes.likes (sin bajar de cero) con un UPDATE atómico, sin
+    leer la nota. Retorna el número de filas afectadas (0 si no existe o está eliminada).
+    """
+    entity_cache.touch(Note, note_id)
+    return Note.active().filter(Note.id == note_id).update(
+        {Note.likes: _clamped(Note.likes, delta)}, synchronize_session=False
+    )
+
+def bump_mongo_note_counters(mongo, note_id, comments=0, files=0):
+    """Aplica el mismo incremento sobre el documento de la nota en MongoDB."""
+    inc = {}
+    if comments:
+        inc["commentCount"] = comments
+    if files:
+        inc["fileCount"] = files
+    if inc:
+        mongo.notes.update_one({"_id": note_id}, {"$inc": inc})
+
+def recompute_note_counters(mongo=None):
+    """
+    Recalcula commentCount y fileCount de todas las notas con un único
+    agregado agrupado sobre comentarios y archivos.
+    En SQL solo escribe las notas cuyo contador guardado no coincide; en
+    MongoDB reescribe los de todas (por lotes de MONGO_BATCH), porque allí
+    pueden haberse desviado aunque SQL esté bien.
+    Retorna el número de notas corregidas en SQL.
+    """
+    # Las notas, sus comentarios y sus archivos están siempre en el mismo shard
+    return sum(_recompute_shard(mongo) for _ in shard_router.each())
+
+def _recompute_shard(mongo):
+    rows = union_all(
+        select(Comment.note_id.label("note_id"), literal(1).label("c"), literal(0).label("f")),
+        select(NoteFile.note_id.label("note_id"), literal(0).label("c"), literal(1).label("f")),
+    ).subquery()
+    counted = {
+        note_id: (int(c or 0), int(f or 0))
+        for note_id, c, f in db.session.execute(
+            select(rows.c.note_id, func.sum(rows.c.c), func.sum(rows.c.f)).group_by(rows.c.note_id)
+        )
+    }
+
+    fixes, checked = [], []
+    owners = set()
+    for note_id, user_id, comment_count, file_count, updated_at in db.session.execute(
+        select(Note.id, Note.user_id, Note.comment_count, Note.file_count, Note.updated_at)
+    ):
+        expected = counted.get(note_id, (0, 0))
+        checked.append((note_id, expected))
+        if (comment_count, file_count) != expected:
+            # updated_at se reenvía tal cual para que la reparación no cuente como edición
+            fixes.append({
+                "id": note_id,
+                "comment_count": expected[0],
+                "file_count": expected[1],
+                "updated_at": updated_at,
+            })
+            owners.add(user_id)
+
+    if fixes:
+        db.session.execute(update(Note), fixes)
+        entity_cache.touch(Note, *(fix["id"] for fix in fixes))
+        mark_user_data_changed(*owners)
+    db.session.commit()
+
+    if mongo is not None:
+        for start in range(0, len(checked), MONGO_BATCH):
+            mongo.notes.bulk_write([
+                UpdateOne({"_id": note_id}, {"$set": {"commentCount": comments, "fileCount": files}})
+                for note_id, (comments, files) in checked[start:start + MONGO_BATCH]
+            ], ordered=False)
+
+    return len(fixes)
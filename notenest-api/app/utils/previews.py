@@ -0,0 +1,188 @@
+# Generación en segundo plano de miniaturas y vistas previas de texto para
+# los archivos adjuntos guardados en el almacén de blobs
+
+import logging
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from app.utils.blob_store import blob_store, is_blob_id
+
+# Pillow y pypdf son opcionales: sin ellos no se generan miniaturas o vistas previas de PDF
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover
+    Image = None
+try:
+    from pypdf import PdfReader
+except ImportError:  # pragma: no cover
+    PdfReader = None
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.environ.get("PREVIEW_WORKERS", "2"))
+QUEUE_SIZE = int(os.environ.get("PREVIEW_QUEUE", "64"))
+THUMBNAIL_SIZE = int(os.environ.get("THUMBNAIL_SIZE", "256"))
+# Límites de memoria: tamaño del archivo de origen y píxeles de la imagen decodificada
+MAX_SOURCE_BYTES = int(os.environ.get("PREVIEW_MAX_SOURCE", str(50 * 1024 * 1024)))
+MAX_PIXELS = int(os.environ.get("PREVIEW_MAX_PIXELS", str(40_000_000)))
+PREVIEW_CHARS = 2000
+PREVIEW_LINES = 40
+
+THUMBNAIL_SUFFIX = ".thumb.jpg"
+PREVIEW_SUFFIX = ".preview.txt"
+
+def thumbnail_path(sha256):
+    return blob_store.object_path(sha256) + THUMBNAIL_SUFFIX
+
+def preview_path(sha256):
+    return blob_store.object_path(sha256) + PREVIEW_SUFFIX
+
+def thumbnail_url(sha256):
+    """URL de la miniatura si ya se generó, o None."""
+    if is_blob_id(sha256) and os.path.exists(thumbnail_path(sha256)):
+        return f"/api/blobs/{sha256}/thumbnail"
+    return None
+
+def preview_url(sha256):
+    """URL de la vista previa de texto si ya se generó, o None."""
+    if is_blob_id(sha256) and os.path.exists(preview_path(sha256)):
+        return f"/api/blobs/{sha256}/preview"
+    return None
+
+def _write_atomic(path, write):
+    """Escribe en un temporal y lo renombra, para no servir nunca un archivo a medias."""
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def _write_text(path, text):
+    def write(tmp):
+        with open(tmp, "w", encoding="utf-8") as handle:
+            handle.write(text)
+    _write_atomic(path, write)
+
+def _first_page(text):
+    lines = text.splitlines()[:PREVIEW_LINES]
+    return "\n".join(lines)[:PREVIEW_CHARS]
+
+def _make_thumbnail(source, sha256):
+    if Image is None:
+        return False
+    try:
+        image = Image.open(source)
+    except Exception:
+        return False  # No es una imagen
+    with image:
+        width, height = image.size
+        if width * height > MAX_PIXELS:
+            logger.warning("⚠️ Imagen %s demasiado grande para miniatura (%dx%d)", sha256, width, height)
+            return True
+        # En JPEG, draft decodifica directamente a menor resolución (menos CPU y memoria)
+        image.draft("RGB", (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        _write_atomic(thumbnail_path(sha256), lambda tmp: image.save(tmp, "JPEG", quality=80))
+    return True
+
+def _make_pdf_preview(source, sha256):
+    with open(source, "rb") as handle:
+        if handle.read(5) != b"%PDF-":
+            return False
+    if PdfReader is None:
+        return True
+    reader = PdfReader(source)
+    text = reader.pages[0].extract_text() if reader.pages else ""
+    _write_text(preview_path(sha256), _first_page(text or ""))
+    return True
+
+def _make_text_preview(source, sha256):
+    with open(source, "rb") as handle:
+        head = handle.read(PREVIEW_CHARS * 4)
+    if b"\x00" in head:
+        return False  # Binario
+    try:
+        text = head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # Puede haberse cortado un carácter multibyte al final del bloque leído
+        if e.start < len(head) - 4:
+            return False
+        text = head[:e.start].decode("utf-8")
+    _write_text(preview_path(sha256), _first_page(text))
+    return True
+
+def generate(sha256):
+    """Genera la miniatura o la vista previa de un blob según su contenido."""
+    source = blob_store.object_path(sha256)
+    if not os.path.exists(source) or os.path.getsize(source) > MAX_SOURCE_BYTES:
+        return
+    if _make_thumbnail(source, sha256):
+        return
+    if _make_pdf_preview(source, sha256):
+        return
+    _make_text_preview(source, sha256)
+
+class PreviewPipeline:
+    """
+    Pool acotado de hilos que genera las vistas previas. submit() nunca bloquea:
+    si la cola está llena el trabajo se descarta y se reintentará la próxima
+    vez que alguien pida los archivos de la nota.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._skipped = set()  # Blobs que fallaron o no admiten vista previa
+
+    def init_app(self, app):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="previews")
+
+    def pending(self):
+        """Número de blobs en cola o generándose."""
+        with self._lock:
+            return len(self._pending)
+
+    def has_output(self, sha256):
+        return os.path.exists(thumbnail_path(sha256)) or os.path.exists(preview_path(sha256))
+
+    def submit(self, sha256):
+        """Encola la generación para un blob (idempotente y sin bloquear)."""
+        if self._executor is None or not is_blob_id(sha256):
+            return False
+        with self._lock:
+            if sha256 in self._pending or sha256 in self._skipped or len(self._pending) >= QUEUE_SIZE:
+                return False
+            self._pending.add(sha256)
+        if self.has_output(sha256):
+            with self._lock:
+                self._pending.discard(sha256)
+            return False
+        self._executor.submit(self._run, sha256)
+        return True
+
+    def _run(self, sha256):
+        try:
+            generate(sha256)
+            if self.has_output(sha256):
+                logger.info("🖼️ Vista previa generada para %s", sha256)
+            else:
+                with self._lock:
+                    self._skipped.add(sha256)
+        except Exception as e:
+            logger.error("❌ Error generando vista previa de %s: %s", sha256, str(e))
+            logger.debug(traceback.format_exc())
+            with self._lock:
+                self._skipped.add(sha256)
+        finally:
+            with self._lock:
+                self._pending.discard(sha256)
+
+preview_pipeline = PreviewPipeline()
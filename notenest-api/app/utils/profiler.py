@@ -0,0 +1,255 @@
+# Perfilado bajo demanda de peticiones reales: un hilo muestrea la pila del
+# hilo que atiende la petición y guarda las pilas agregadas (formato "folded"
+# de los flame graphs) en un directorio local rotativo
+
+import hashlib
+import hmac
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from flask import g, request
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Perfilar 1 de cada N peticiones (0 = solo con la cabecera firmada)
+PROFILE_EVERY = int(os.environ.get("PROFILE_EVERY", "0"))
+# Clave para firmar la cabecera X-Profile y proteger las rutas de perfiles
+PROFILE_SECRET = os.environ.get("PROFILE_SECRET", "")
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "data/profiles")
+PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", "200"))
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "5"))
+
+HEADER = "X-Profile"
+
+# ----------------------------------------------------------------------
+# Tokens firmados
+# ----------------------------------------------------------------------
+
+def _signature(secret, expires):
+    return hmac.new(secret.encode("utf-8"), str(expires).encode("ascii"), hashlib.sha256).hexdigest()
+
+def make_token(secret, ttl=300):
+    """Token "<expira>.<firma>" válido durante `ttl` segundos."""
+    expires = int(time.time()) + ttl
+    return f"{expires}.{_signature(secret, expires)}"
+
+def verify_token(secret, token):
+    if not secret or not token:
+        return False
+    expires, _, signature = token.partition(".")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(signature, _signature(secret, int(expires)))
+
+# ----------------------------------------------------------------------
+# Muestreo de pilas
+# ----------------------------------------------------------------------
+
+# Marco a partir del cual empieza la parte interesante de la pila
+_DISPATCH = "flask.app:full_dispatch_request"
+
+def _frame_name(frame):
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}"
+
+def _stack(frame):
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    names.reverse()
+    # Descartar el servidor WSGI: la raíz del flame graph es el despacho de Flask
+    if _DISPATCH in names:
+        names = names[names.index(_DISPATCH):]
+    return ";".join(names)
+
+class Profile:
+    """Pilas muestreadas de una petición."""
+
+    __slots__ = ("id", "route", "method", "path", "started", "stacks", "samples")
+
+    def __init__(self, route, method, path):
+        self.id = uuid.uuid4().hex[:16]
+        self.route = route
+        self.method = method
+        self.path = path
+        self.started = time.time()
+        self.stacks = Counter()
+        self.samples = 0
+
+    def add(self, stack):
+        self.stacks[stack] += 1
+        self.samples += 1
+
+class RequestProfiler:
+    """
+    Perfilador por muestreo. Solo trabaja mientras hay alguna petición
+    perfilada: el hilo de muestreo duerme en un Event el resto del tiempo.
+    Las muestras son de tiempo de pared, así que incluyen las esperas de
+    MySQL/MongoDB además del tiempo de CPU en Python y en bcrypt.
+    """
+
+    def __init__(self):
+        self.every = 0
+        self.secret = ""
+        self.root = None
+        self.max_files = PROFILE_MAX_FILES
+        self.interval = PROFILE_INTERVAL_MS / 1000
+        self._counter = itertools.count(1)
+        self._active = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def init_app(self, app):
+        """
+        Prepara el perfilador. Si no hay PROFILE_EVERY ni PROFILE_SECRET no se
+        instala ningún hook y retorna False (coste cero).
+        """
+        self.every = int(app.config.get("PROFILE_EVERY", PROFILE_EVERY))
+        self.secret = app.config.get("PROFILE_SECRET", PROFILE_SECRET)
+        if not self.every and not self.secret:
+            return False
+        self.root = os.path.abspath(app.config.get("PROFILE_DIR", PROFILE_DIR))
+        os.makedirs(self.root, exist_ok=True)
+        app.before_request(self._start_request)
+        app.teardown_request(self._end_request)
+        return True
+
+    # -- Selección de peticiones ------------------------------------------
+
+    def authorized(self):
+        """True si la petición trae un token X-Profile válido."""
+        return verify_token(self.secret, request.headers.get(HEADER))
+
+    def _wanted(self):
+        if request.blueprint == "route_profiles":
+            return False  # Consultar los perfiles no debe rotar los que se están mirando
+        if HEADER in request.headers and self.authorized():
+            return True
+        return self.every > 0 and next(self._counter) % self.every == 0
+
+    def _start_request(self):
+        if not self._wanted():
+            return
+        route = request.url_rule.endpoint if request.url_rule is not None else "unmatched"
+        profile = Profile(route, request.method, request.path)
+        g._profile = profile
+        g._profile_start = time.perf_counter()
+        with self._lock:
+            self._active[threading.get_ident()] = profile
+            self._ensure_thread()
+            self._wake.set()
+
+    def _end_request(self, exc=None):
+        profile = g.pop("_profile", None)
+        if profile is None:
+            return
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+            if not self._active:
+                self._wake.clear()
+        duration = time.perf_counter() - g.pop("_profile_start")
+        try:
+            self._save(profile, duration, exc)
+        except OSError as e:
+            logger.warning("⚠️ No se pudo guardar el perfil %s: %s", profile.id, e)
+
+    # -- Muestreo ---------------------------------------------------------
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            frames = sys._current_frames()
+            # Con el lock tomado: _end_request no guarda un perfil a medio actualizar
+            with self._lock:
+                for ident, profile in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        profile.add(_stack(frame))
+            del frames
+            time.sleep(self.interval)
+
+    # -- Almacenamiento ---------------------------------------------------
+
+    def _save(self, profile, duration, exc):
+        entry = {
+            "id": profile.id,
+            "route": profile.route,
+            "method": profile.method,
+            "path": profile.path,
+            "createdAt": profile.started,
+            "durationMs": round(duration * 1000, 2),
+            "intervalMs": self.interval * 1000,
+            "samples": profile.samples,
+            "error": repr(exc) if exc is not None else None,
+            "stacks": dict(profile.stacks),
+        }
+        name = f"{int(profile.started * 1000)}-{profile.id}.json"
+        tmp = os.path.join(self.root, f".{name}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp, os.path.join(self.root, name))
+        self._rotate()
+
+    def _files(self):
+        """Ficheros de perfiles, del más antiguo al más reciente."""
+        return sorted(name for name in os.listdir(self.root) if name.endswith(".json"))
+
+    def _rotate(self):
+        files = self._files()
+        for name in files[:max(len(files) - self.max_files, 0)]:
+            try:
+                os.remove(os.path.join(self.root, name))
+            except FileNotFoundError:
+                pass  # Otro proceso lo borró antes
+
+    def _load(self, name):
+        try:
+            with open(os.path.join(self.root, name), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None  # Rotado mientras se leía
+
+    def profiles(self, route=None):
+        """Resumen de los perfiles guardados (sin las pilas), del más reciente al más antiguo."""
+        result = []
+        for name in reversed(self._files()):
+            entry = self._load(name)
+            if entry is None or (route and entry["route"] != route):
+                continue
+            entry.pop("stacks")
+            result.append(entry)
+        return result
+
+    def get(self, profile_id):
+        for name in self._files():
+            if name.endswith(f"-{profile_id}.json"):
+                return self._load(name)
+        return None
+
+    def aggregate(self, route):
+        """Pilas de todos los perfiles guardados de una ruta, sumadas."""
+        stacks = Counter()
+        for name in self._files():
+            entry = self._load(name)
+            if entry is not None and entry["route"] == route:
+                stacks.update(entry["stacks"])
+        return stacks
+
+def folded(stacks):
+    """Formato "pila;de;marcos N" que aceptan flamegraph.pl y speedscope."""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+profiler = RequestProfiler()
@@ -0,0 +1,208 @@
+# Instrumentación de consultas por petición: cuenta las sentencias SQL y los
+# comandos de MongoDB que ejecuta cada request y detecta patrones N+1
+
+import hashlib
+import logging
+import os
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+from flask import request
+from pymongo import monitoring
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.config.docstore import register_listener as register_docstore_listener
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Número de repeticiones de una misma sentencia a partir del cual se marca como N+1
+N_PLUS_ONE_THRESHOLD = int(os.environ.get("QUERY_STATS_N_PLUS_ONE", "5"))
+
+# Estadísticas de la petición en curso (None fuera de una petición)
+_current = ContextVar("query_stats", default=None)
+_installed = False
+
+_WHITESPACE = re.compile(r"\s+")
+# Listas expandidas de parámetros: "IN (%(id_1)s, %(id_2)s)" o "IN (?, ?, ?)"
+_PARAM_LIST = re.compile(r"(%\(\w+\)s|\?)(\s*,\s*(%\(\w+\)s|\?))+")
+
+def sql_fingerprint(statement):
+    """Normaliza una sentencia para que las repeticiones con distintos parámetros coincidan."""
+    statement = _WHITESPACE.sub(" ", statement.strip())
+    return _PARAM_LIST.sub("?...", statement)
+
+def mongo_fingerprint(command_name, command):
+    """Huella de un comando de MongoDB: operación, colección y forma del filtro."""
+    collection = command.get(command_name)
+    spec = command.get("filter")
+    if spec is None and command_name in ("update", "delete"):
+        ops = command.get("updates") or command.get("deletes") or []
+        spec = ops[0].get("q") if ops else None
+    keys = ",".join(sorted(spec)) if isinstance(spec, dict) else ""
+    return f"{command_name} {collection} {{{keys}}}"
+
+def _short_hash(fingerprint):
+    return hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()[:8]
+
+class RequestQueryStats:
+    """Acumulador de las consultas ejecutadas durante una petición."""
+
+    __slots__ = ("sql_count", "sql_time", "mongo_count", "mongo_time",
+                 "sql_fingerprints", "mongo_fingerprints", "_mongo_pending")
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.mongo_count = 0
+        self.mongo_time = 0.0
+        self.sql_fingerprints = Counter()
+        self.mongo_fingerprints = Counter()
+        self._mongo_pending = {}
+
+    def record_sql(self, statement, elapsed):
+        self.sql_count += 1
+        self.sql_time += elapsed
+        self.sql_fingerprints[sql_fingerprint(statement)] += 1
+
+    def record_mongo(self, fingerprint, elapsed):
+        self.mongo_count += 1
+        self.mongo_time += elapsed
+        self.mongo_fingerprints[fingerprint] += 1
+
+    def duplicates(self):
+        """Sentencias (SQL y Mongo) ejecutadas más de una vez, con su número de repeticiones."""
+        repeated = [(fp, n) for fp, n in self.sql_fingerprints.items() if n > 1]
+        repeated += [(fp, n) for fp, n in self.mongo_fingerprints.items() if n > 1]
+        return sorted(repeated, key=lambda item: -item[1])
+
+    def n_plus_one(self, threshold=None):
+        """Sentencias repetidas suficientes veces como para sospechar un patrón N+1."""
+        threshold = threshold or N_PLUS_ONE_THRESHOLD
+        return [(fp, n) for fp, n in self.duplicates() if n >= threshold]
+
+    def summary(self):
+        return {
+            "sqlCount": self.sql_count,
+            "sqlTimeMs": round(self.sql_time * 1000, 2),
+            "mongoCount": self.mongo_count,
+            "mongoTimeMs": round(self.mongo_time * 1000, 2),
+            "duplicates": len(self.duplicates()),
+            "nPlusOne": [{"fingerprint": fp, "count": n} for fp, n in self.n_plus_one()],
+        }
+
+def current_stats():
+    """Retorna las estadísticas de la petición en curso, o None."""
+    return _current.get()
+
+# ---------------------------------------------------------------------------
+# Eventos de SQLAlchemy
+# ---------------------------------------------------------------------------
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("query_stats_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    starts = conn.info.get("query_stats_start")
+    if stats is None or not starts:
+        return
+    stats.record_sql(statement, time.perf_counter() - starts.pop())
+
+# ---------------------------------------------------------------------------
+# Monitorización de comandos de PyMongo
+# ---------------------------------------------------------------------------
+
+class MongoQueryListener(monitoring.CommandListener):
+    """Listener de PyMongo que suma cada comando a la petición en curso."""
+
+    def started(self, event):
+        stats = _current.get()
+        if stats is not None:
+            stats._mongo_pending[event.request_id] = mongo_fingerprint(event.command_name, event.command)
+
+    def _finished(self, event):
+        stats = _current.get()
+        if stats is None:
+            return
+        fingerprint = stats._mongo_pending.pop(event.request_id, event.command_name)
+        stats.record_mongo(fingerprint, event.duration_micros / 1_000_000)
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event)
+
+def _docstore_listener(collection, command_name, spec, elapsed):
+    """Lo mismo que MongoQueryListener, para el almacén de documentos embebido."""
+    stats = _current.get()
+    if stats is not None:
+        keys = ",".join(sorted(spec)) if spec else ""
+        stats.record_mongo(f"{command_name} {collection} {{{keys}}}", elapsed)
+
+# ---------------------------------------------------------------------------
+# Integración con Flask
+# ---------------------------------------------------------------------------
+
+def _start_request():
+    request.environ["query_stats.token"] = _current.set(RequestQueryStats())
+
+def _report(response, app):
+    stats = _current.get()
+    if stats is None:
+        return response
+
+    summary = stats.summary()
+    suspects = stats.n_plus_one()
+    if app.debug:
+        # En modo debug el resumen viaja en las cabeceras de la respuesta
+        response.headers["X-Query-Count"] = str(summary["sqlCount"])
+        response.headers["X-Query-Time-Ms"] = str(summary["sqlTimeMs"])
+        response.headers["X-Mongo-Count"] = str(summary["mongoCount"])
+        response.headers["X-Mongo-Time-Ms"] = str(summary["mongoTimeMs"])
+        response.headers["X-Query-Duplicates"] = str(summary["duplicates"])
+        if suspects:
+            response.headers["X-N-Plus-One"] = ", ".join(
+                f"{_short_hash(fp)}x{n}" for fp, n in suspects
+            )
+
+    logger.info(
+        "📊 %s %s -> sql=%d (%.1f ms) mongo=%d (%.1f ms) duplicadas=%d",
+        request.method, request.path,
+        summary["sqlCount"], summary["sqlTimeMs"],
+        summary["mongoCount"], summary["mongoTimeMs"], summary["duplicates"],
+    )
+    for fp, n in suspects:
+        logger.warning("⚠️ Posible N+1 en %s %s: %d x [%s] %s",
+                       request.method, request.path, n, _short_hash(fp), fp)
+    return response
+
+def _end_request(exc=None):
+    token = request.environ.pop("query_stats.token", None)
+    if token is not None:
+        _current.reset(token)
+
+def init_query_stats(app):
+    """
+    Activa la instrumentación de consultas para la aplicación.
+    Debe llamarse antes de crear el cliente de MongoDB, porque PyMongo solo
+    notifica a los listeners registrados en el momento de crear el cliente.
+    Se desactiva con QUERY_STATS_ENABLED=0.
+    """
+    global _installed
+    if os.environ.get("QUERY_STATS_ENABLED", "1") != "1":
+        return
+
+    if not _installed:
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        monitoring.register(MongoQueryListener())
+        register_docstore_listener(_docstore_listener)
+        _installed = True
+
+    app.before_request(_start_request)
+    app.after_request(lambda response: _report(response, app))
+    app.teardown_request(_end_request)
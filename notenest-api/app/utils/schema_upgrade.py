@@ -0,0 +1,82 @@
+# Actualización del esquema de bases de datos creadas con versiones anteriores:
+# db.create_all solo crea las tablas que faltan, nunca añade columnas ni
+# índices a las que ya existen (por ejemplo, el volumen mysql_data de
+# docker-compose). Cada paso comprueba antes si ya está aplicado, así que se
+# ejecuta en cada arranque, antes de que nada lea las tablas.
+
+import logging
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+from app.config.db import db
+from app.config.shards import shard_router
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Columnas añadidas a tablas que ya existían (con su índice, si el modelo lo declara)
+UPGRADE_COLUMNS = [
+    ("notes", "comment_count"),
+    ("notes", "file_count"),
+    ("notes", "deleted_at"),
+    ("note_files", "blob_sha256"),
+]
+# Índices añadidos a columnas que ya existían
+UPGRADE_INDEXES = [
+    ("comments", "parent_id"),
+    ("comments", "root_comment"),
+    ("users", "updated_at"),
+]
+
+def _engines():
+    """Base principal y, con sharding, cada shard (las tablas repartidas viven en ellos)."""
+    engines = [db.engine]
+    if shard_router.enabled:
+        engines.extend(shard_router.engine(shard) for shard in range(shard_router.count))
+    return engines
+
+def _add_column(conn, table_name, column_name):
+    column = db.metadata.tables[table_name].c[column_name]
+    # CreateColumn genera "nombre TIPO DEFAULT ... NOT NULL" en el dialecto de la base
+    definition = CreateColumn(column).compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {definition}"))
+
+def _add_indexes(conn, inspector, table_name, column_name):
+    """Crea los índices del modelo sobre la columna, salvo que otro índice ya empiece por ella."""
+    if any(index["column_names"][:1] == [column_name] for index in inspector.get_indexes(table_name)):
+        return 0
+    created = 0
+    for index in db.metadata.tables[table_name].indexes:
+        if [column.name for column in index.columns][:1] == [column_name]:
+            index.create(conn)
+            created += 1
+    return created
+
+def upgrade_schema(mongo=None):
+    """
+    Añade a las tablas existentes las columnas de UPGRADE_COLUMNS y los
+    índices de UPGRADE_INDEXES que les falten, en la base principal y en cada
+    shard, y rellena las columnas que lo necesitan (los contadores de las
+    notas se recalculan con recompute_note_counters).
+    Retorna los "tabla.columna" añadidos (vacío si el esquema ya estaba al día).
+    """
+    added = []
+    for engine in _engines():
+        with engine.begin() as conn:
+            inspector = inspect(conn)
+            tables = set(inspector.get_table_names())
+            for table_name, column_name in UPGRADE_COLUMNS:
+                if table_name not in tables:
+                    continue
+                if column_name not in {column["name"] for column in inspector.get_columns(table_name)}:
+                    _add_column(conn, table_name, column_name)
+                    added.append(f"{table_name}.{column_name}")
+                    logger.info("🛠️ Columna %s.%s añadida (%s)", table_name, column_name, engine.url.database)
+            for table_name, column_name in UPGRADE_COLUMNS + UPGRADE_INDEXES:
+                if table_name in tables and _add_indexes(conn, inspector, table_name, column_name):
+                    logger.info("🛠️ Índice sobre %s.%s creado (%s)", table_name, column_name, engine.url.database)
+
+    if {"notes.comment_count", "notes.file_count"} & set(added):
+        from app.utils.note_counters import recompute_note_counters
+        fixed = recompute_note_counters(mongo)
+        logger.info("🛠️ Contadores de comentarios y archivos rellenados en %d notas", fixed)
+    return added
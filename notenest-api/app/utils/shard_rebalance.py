@@ -0,0 +1,172 @@
+# Traslado de usuarios entre shards (flask --app app shard-rebalance): tras
+# añadir un shard, los usuarios cuyo shard preferido cambió se copian al nuevo
+# con el servidor en marcha y después se borran del anterior
+
+import logging
+import time
+from datetime import datetime
+from sqlalchemy import delete, insert, select, update
+from app.config.db import db
+from app.config.shards import shard_router, SHARD_PLACEMENT_TTL
+from app.models.user import User
+from app.models.user_shard import UserShard
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Orden de copia (respeta las claves foráneas); el borrado va en orden inverso
+_COPY_ORDER = ("notes", "note_files", "comments", "note_likes", "note_cleanup_jobs", "sessions",
+               "user_data_versions")
+
+def _owned(tables, user_id):
+    """Condición por tabla para las filas de un usuario: sus notas, lo que cuelga de ellas y sus sesiones."""
+    notes = tables["notes"]
+    note_ids = select(notes.c.id).where(notes.c.user_id == user_id).scalar_subquery()
+    return {
+        "notes": notes.c.user_id == user_id,
+        "note_files": tables["note_files"].c.note_id.in_(note_ids),
+        "comments": tables["comments"].c.note_id.in_(note_ids),
+        "note_likes": tables["note_likes"].c.note_id.in_(note_ids),
+        "note_cleanup_jobs": tables["note_cleanup_jobs"].c.note_id.in_(note_ids),
+        "sessions": tables["sessions"].c.user_id == user_id,
+        "user_data_versions": tables["user_data_versions"].c.user_id == user_id,
+    }
+
+def _parents_first(rows):
+    """Ordena los comentarios para que cada respuesta vaya después de su padre."""
+    by_id = {row["id"]: row for row in rows}
+    ordered, seen = [], set()
+
+    def visit(row):
+        chain = []
+        while row is not None and row["id"] not in seen:
+            seen.add(row["id"])
+            chain.append(row)
+            row = by_id.get(row["parent_id"])
+        ordered.extend(reversed(chain))
+
+    for row in rows:
+        visit(row)
+    return ordered
+
+def _sync(user_id, source, target):
+    """
+    Copia las filas del usuario de un shard a otro: inserta las que faltan y
+    actualiza las que en el origen tienen un updated_at más reciente.
+    Retorna {tabla: filas escritas}.
+    """
+    tables = shard_router.tables
+    owned = _owned(tables, user_id)
+    written = {}
+    with shard_router.engine(source).connect() as reader, shard_router.engine(target).begin() as writer:
+        for name in _COPY_ORDER:
+            table = tables[name]
+            key = list(table.primary_key.columns)
+            rows = [dict(row._mapping) for row in reader.execute(select(table).where(owned[name]))]
+            if name == "comments":
+                rows = _parents_first(rows)
+            existing = {}
+            if rows:
+                stamp = table.c.updated_at if "updated_at" in table.c else None
+                columns = key + ([stamp] if stamp is not None else [])
+                for row in writer.execute(select(*columns).where(_owned(tables, user_id)[name])):
+                    existing[tuple(row[:len(key)])] = row[len(key)] if stamp is not None else None
+            count = 0
+            for row in rows:
+                identity = tuple(row[column.key] for column in key)
+                if identity not in existing:
+                    writer.execute(insert(table).values(**row))
+                    count += 1
+                elif "updated_at" in row and row["updated_at"] and (existing[identity] is None or row["updated_at"] > existing[identity]):
+                    condition = [column == row[column.key] for column in key]
+                    writer.execute(update(table).where(*condition).values(**row))
+                    count += 1
+            written[name] = count
+    return written
+
+def _purge(user_id, shard):
+    """Borra del shard las filas del usuario (ya copiadas a su shard nuevo)."""
+    tables = shard_router.tables
+    removed = {}
+    with shard_router.engine(shard).begin() as connection:
+        owned = _owned(tables, user_id)
+        ids = {name: list(connection.execute(select(tables[name].c.id).where(owned[name])).scalars())
+               for name in ("notes", "comments", "note_files")}
+        # Las respuestas apuntan a su padre: se sueltan antes de borrar
+        connection.execute(update(tables["comments"]).where(owned["comments"]).values(parent_id=None))
+        for name in reversed(_COPY_ORDER):
+            removed[name] = connection.execute(delete(tables[name]).where(owned[name])).rowcount
+    for name, values in ids.items():
+        for value in values:
+            shard_router.forget(name, "id", value)
+    return removed
+
+def _pin(user_id, shard):
+    placement = db.session.get(UserShard, user_id)
+    if placement is None:
+        db.session.add(UserShard(user_id=user_id, shard=shard))
+    else:
+        placement.shard = shard
+        placement.updated_at = datetime.utcnow()
+    db.session.commit()
+    shard_router.forget("user_shards", "user_id", user_id)
+
+def move_users(moves, drain=None):
+    """
+    Traslada los datos de cada usuario de [(usuario, destino)]: copia, cambia
+    su fila de user_shards, espera `drain` segundos (por defecto
+    SHARD_PLACEMENT_TTL, una sola vez para todos) para que ningún proceso siga
+    escribiendo en el shard anterior, vuelve a copiar lo escrito entretanto y
+    borra el origen. Retorna {usuario: (origen, filas copiadas)}.
+    """
+    moved = {}
+    for user_id, target in moves:
+        source = shard_router.shard_for_user(user_id)
+        if source != target:
+            moved[user_id] = (source, target, _sync(user_id, source, target))
+            _pin(user_id, target)
+    if not moved:
+        return {}
+    time.sleep(SHARD_PLACEMENT_TTL if drain is None else drain)
+    for user_id, (source, target, copied) in moved.items():
+        for name, count in _sync(user_id, source, target).items():
+            copied[name] += count
+        _purge(user_id, source)
+        logger.info("🧩 Usuario %s trasladado del shard %d al %d: %s", user_id, source, target, copied)
+    return {user_id: (source, copied) for user_id, (source, _, copied) in moved.items()}
+
+def _data_shard(user_id):
+    """Shard que ya tiene notas o sesiones del usuario, o None."""
+    notes, sessions = shard_router.tables["notes"], shard_router.tables["sessions"]
+    for shard in range(shard_router.count):
+        with shard_router.engine(shard).connect() as connection:
+            if connection.execute(select(notes.c.id).where(notes.c.user_id == user_id).limit(1)).first() \
+                    or connection.execute(select(sessions.c.id).where(sessions.c.user_id == user_id).limit(1)).first():
+                return shard
+    return None
+
+def rebalance(limit=None, dry_run=False, drain=None):
+    """
+    Fija en user_shards a los usuarios que no tienen fila (en el shard donde
+    ya están sus datos, o en el preferido) y traslada hasta `limit` usuarios
+    cuyo shard no es el preferido con los shards actuales.
+    Retorna [(usuario, origen, destino)] de los traslados (hechos o, con
+    dry_run, pendientes).
+    """
+    if not shard_router.enabled:
+        return []
+    pins = dict(db.session.execute(select(UserShard.user_id, UserShard.shard)).all())
+    for user_id in list(db.session.scalars(select(User.id))):
+        if user_id not in pins:
+            shard = _data_shard(user_id)
+            pins[user_id] = shard_router.preferred_shard(user_id) if shard is None else shard
+            if not dry_run:
+                db.session.add(UserShard(user_id=user_id, shard=pins[user_id]))
+    db.session.commit()
+
+    moves = [(user_id, shard, shard_router.preferred_shard(user_id))
+             for user_id, shard in sorted(pins.items()) if shard != shard_router.preferred_shard(user_id)]
+    moves = moves[:limit] if limit else moves
+    if not dry_run:
+        move_users([(user_id, target) for user_id, _, target in moves], drain=drain)
+    return moves
@@ -0,0 +1,78 @@
+import hashlib
+
+class PatchError(ValueError):
+    """Parche mal formado o que no encaja con el texto base."""
+
+def content_hash(text):
+    """SHA-256 (hex) del contenido en UTF-8; el cliente lo usa como versión base de los parches."""
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+def apply_patch(text, ops):
+    """
+    Aplica una lista de operaciones de diff sobre `text`, recorriéndolo de
+    principio a fin (el formato de diff-match-patch y similares):
+      {"retain": n}   conserva n caracteres
+      {"delete": n}   elimina n caracteres
+      {"insert": "…"} inserta el texto
+    Lo que queda tras la última operación se conserva. Las longitudes se
+    cuentan en caracteres Unicode (code points). El coste es proporcional al
+    tamaño del texto, pero solo viaja por la red el tamaño de la edición.
+    """
+    text = text or ""
+    if not isinstance(ops, list):
+        raise PatchError("El parche debe ser una lista de operaciones")
+    parts = []
+    position = 0
+    for op in ops:
+        if not isinstance(op, dict) or len(op) != 1:
+            raise PatchError(f"Operación inválida: {op!r}")
+        (kind, value), = op.items()
+        if kind == "insert":
+            if not isinstance(value, str):
+                raise PatchError("insert requiere un texto")
+            parts.append(value)
+            continue
+        if kind not in ("retain", "delete") or not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            raise PatchError(f"Operación inválida: {op!r}")
+        if position + value > len(text):
+            raise PatchError("El parche excede la longitud del texto base")
+        if kind == "retain":
+            parts.append(text[position:position + value])
+        position += value
+    parts.append(text[position:])
+    return "".join(parts)
+
+class VersionMismatch(Exception):
+    """El contenido cambió desde la versión sobre la que se calculó el parche."""
+
+    def __init__(self, current_hash):
+        super().__init__(current_hash)
+        self.current_hash = current_hash
+
+def apply_note_update(note, data, now):
+    """
+    Aplica a `note` los campos de una petición de updateNote: title, isPublic
+    y content o bien patch + baseHash. Retorna solo los campos que cambiaron,
+    con los nombres y el formato de MongoDB (contenido comprimido), para
+    que el $set no reescriba el resto.
+    Lanza VersionMismatch o PatchError sin haber modificado la nota.
+    """
+    changes = {}
+    if data.get("patch") is not None:
+        current_hash = content_hash(note.content)
+        if data.get("baseHash") != current_hash:
+            raise VersionMismatch(current_hash)
+        content = apply_patch(note.content, data["patch"])
+        if content != note.content:
+            note.content = content
+            changes["content"] = note.stored_content
+    elif "content" in data and data["content"] != note.content:
+        note.content = data["content"]
+        changes["content"] = note.stored_content
+    if "title" in data and data["title"] != note.title:
+        note.title = changes["title"] = data["title"]
+    if "isPublic" in data and data["isPublic"] != note.is_public:
+        note.is_public = changes["isPublic"] = data["isPublic"]
+    note.updated_at = now
+    changes["updatedAt"] = now.isoformat()
+    return changes
@@ -0,0 +1,213 @@
+# Ranking en memoria de las notas públicas en tendencia: cada "me gusta" y
+# cada comentario suma a la puntuación de la nota un peso que decae con el
+# tiempo, y /trendingNotes lee las K primeras sin consultar la base de datos
+
+import heapq
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+from app.config.db import db
+from app.config.shards import shard_router
+from app.models.comment import Comment
+from app.models.note import Note
+from app.models.note_like import NoteLike
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Ventanas disponibles; en cada una la puntuación se reduce a la mitad cada ventana
+TRENDING_WINDOWS = os.environ.get("TRENDING_WINDOWS", "1h,24h,7d")
+TRENDING_DEFAULT_WINDOW = os.environ.get("TRENDING_DEFAULT_WINDOW", "24h")
+# Notas que se mantienen ordenadas por ventana (máximo de ?limit=)
+TRENDING_TOP_K = int(os.environ.get("TRENDING_TOP_K", "100"))
+LIKE_WEIGHT = 1.0
+COMMENT_WEIGHT = 2.0
+# Al arrancar se leen los eventos de las últimas HORIZON vidas medias (lo anterior pesa < 0,1 %)
+HORIZON = 10
+# Cada cuántas vidas medias se reescalan las puntuaciones y se olvidan las despreciables
+REBASE_AFTER = 32
+NEGLIGIBLE = 0.01
+
+def parse_window(window):
+    """Segundos de una ventana como '1h' o '7d'. ValueError si no es válida."""
+    units = {"m": 60, "h": 3600, "d": 86400}
+    if len(window) < 2 or window[-1] not in units or not window[:-1].isdigit() or int(window[:-1]) <= 0:
+        raise ValueError(f"Ventana inválida: {window}")
+    return int(window[:-1]) * units[window[-1]]
+
+class _Ranking:
+    """
+    Puntuaciones de una ventana. Para no recalcular el decaimiento de todas
+    las notas, cada evento suma peso * 2^((t - base) / vida_media): los
+    valores crecen con el tiempo, pero el orden entre notas es el mismo que
+    el de las puntuaciones decaídas y nunca hay que recalcularlo.
+    `top` guarda ordenadas las `capacity` mejores; `bound` es una cota
+    superior de la puntuación de cualquier nota fuera de `top`.
+    """
+
+    def __init__(self, half_life, capacity, now):
+        self.half_life = half_life
+        self.capacity = capacity
+        self.base = now
+        self.scores = {}  # note_id -> puntuación escalada
+        self.top = []     # Lista ordenada de (puntuación escalada, note_id)
+        self.bound = 0.0
+
+    def _scale(self, now):
+        return 2.0 ** ((now - self.base) / self.half_life)
+
+    def add(self, note_id, weight, now):
+        """Suma un evento. O(log K) comparaciones, más el desplazamiento de la lista de K."""
+        if now - self.base > REBASE_AFTER * self.half_life:
+            self._rebase(now)
+        old = self.scores.get(note_id, 0.0)
+        new = old + weight * self._scale(now)
+        if new > NEGLIGIBLE * self._scale(now):
+            self.scores[note_id] = new
+        else:
+            self.scores.pop(note_id, None)
+            new = 0.0
+
+        in_top = False
+        if old:
+            index = bisect_left(self.top, (old, note_id))
+            if index < len(self.top) and self.top[index] == (old, note_id):
+                del self.top[index]
+                in_top = True
+        if not new:
+            return
+        if in_top or len(self.top) < self.capacity or new > self.top[0][0]:
+            insort(self.top, (new, note_id))
+            if len(self.top) > self.capacity:
+                evicted, _ = self.top.pop(0)
+                self.bound = max(self.bound, evicted)
+        else:
+            self.bound = max(self.bound, new)
+
+    def discard(self, note_id):
+        old = self.scores.pop(note_id, None)
+        if old is not None:
+            index = bisect_left(self.top, (old, note_id))
+            if index < len(self.top) and self.top[index] == (old, note_id):
+                del self.top[index]
+
+    def leaders(self, now):
+        """
+        Notas en orden de puntuación, como (note_id, puntuación actual).
+        Solo se retornan las que están por encima de `bound` (su orden es
+        exacto); si los "no me gusta" dejaron menos de la mitad de `top` por
+        encima de la cota, se reconstruye `top` desde las puntuaciones en memoria.
+        """
+        exact = len(self.top) - bisect_left(self.top, (self.bound, ""))
+        if exact < min(len(self.scores), self.capacity // 2):
+            self._rebuild()
+            exact = len(self.top)
+        scale = self._scale(now)
+        return [(note_id, score / scale) for score, note_id in reversed(self.top[len(self.top) - exact:])]
+
+    def _rebuild(self):
+        best = heapq.nlargest(self.capacity + 1, ((score, note_id) for note_id, score in self.scores.items()))
+        self.bound = best[self.capacity][0] if len(best) > self.capacity else 0.0
+        self.top = sorted(best[:self.capacity])
+
+    def _rebase(self, now):
+        factor = 1.0 / self._scale(now)
+        self.scores = {note_id: score * factor for note_id, score in self.scores.items()
+                       if score * factor > NEGLIGIBLE}
+        self.base = now
+        self._rebuild()
+
+class TrendingNotes:
+    """Un ranking por ventana; los endpoints de likes y comentarios le envían sus eventos."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.windows = {}
+        self.default_window = TRENDING_DEFAULT_WINDOW
+        now = time.time()
+        for window in filter(None, (w.strip() for w in TRENDING_WINDOWS.split(","))):
+            self.windows[window] = _Ranking(parse_window(window), TRENDING_TOP_K * 2, now)
+        if self.default_window not in self.windows:
+            self.default_window = next(iter(self.windows), None)
+
+    def record(self, note_id, weight, at=None):
+        """Suma un evento (peso positivo o negativo) a la nota en todas las ventanas."""
+        now = at or time.time()
+        with self._lock:
+            for ranking in self.windows.values():
+                ranking.add(note_id, weight, now)
+
+    def discard(self, note_id):
+        with self._lock:
+            for ranking in self.windows.values():
+                ranking.discard(note_id)
+
+    def leaders(self, window):
+        """(note_id, puntuación) de la ventana, de mayor a menor. KeyError si no existe."""
+        with self._lock:
+            return self.windows[window].leaders(time.time())
+
+    def load(self):
+        """
+        Reconstruye los rankings al arrancar a partir de los comentarios y los
+        "me gusta" (note_likes) de notas públicas. Los likes sin usuario solo
+        existen en el contador de la nota, así que se fechan en su updated_at
+        (la última vez que cambió, por ejemplo por un like).
+        """
+        if not self.windows:
+            return
+        now = time.time()
+        longest = max(ranking.half_life for ranking in self.windows.values())
+        since = datetime.utcnow() - timedelta(seconds=HORIZON * longest)
+        public = (Note.is_public.is_(True), Note.deleted_at.is_(None))
+        offset = now - datetime.utcnow().timestamp()  # Las fechas guardadas están en UTC sin zona
+
+        rankings = {window: _Ranking(r.half_life, r.capacity, now) for window, r in self.windows.items()}
+        events = 0
+        # Con sharding cada shard aporta los eventos de sus notas
+        for _ in shard_router.each():
+            comments = db.session.execute(
+                select(Comment.note_id, Comment.created_at)
+                .join(Note, Note.id == Comment.note_id)
+                .where(*public, Comment.created_at >= since)
+                .execution_options(yield_per=1000)
+            )
+            for note_id, created_at in comments:
+                for ranking in rankings.values():
+                    ranking.add(note_id, COMMENT_WEIGHT, created_at.timestamp() + offset)
+                events += 1
+            likes = db.session.execute(
+                select(NoteLike.note_id, NoteLike.created_at)
+                .join(Note, Note.id == NoteLike.note_id)
+                .where(*public, NoteLike.created_at >= since)
+                .execution_options(yield_per=1000)
+            )
+            for note_id, created_at in likes:
+                for ranking in rankings.values():
+                    ranking.add(note_id, LIKE_WEIGHT, created_at.timestamp() + offset)
+                events += 1
+
+            per_user = dict(db.session.execute(
+                select(NoteLike.note_id, func.count()).join(Note, Note.id == NoteLike.note_id)
+                .where(*public).group_by(NoteLike.note_id)
+            ).all())
+            counters = db.session.execute(
+                select(Note.id, Note.likes, Note.updated_at)
+                .where(*public, Note.likes > 0, Note.updated_at >= since)
+            )
+            for note_id, count, updated_at in counters:
+                anonymous = count - per_user.get(note_id, 0)
+                if anonymous > 0:
+                    for ranking in rankings.values():
+                        ranking.add(note_id, LIKE_WEIGHT * anonymous, updated_at.timestamp() + offset)
+                    events += anonymous
+
+        with self._lock:
+            self.windows = rankings
+        logger.info("📈 Ranking de tendencias reconstruido con %d eventos", events)
+
+trending_notes = TrendingNotes()
@@ -0,0 +1,231 @@
+# Estadísticas de uso (/stats/user/<id> y /stats/global) mantenidas de forma
+# incremental: las rutas de escritura anotan cuánto cambia cada contador
+# dentro de su transacción, cada proceso suma lo confirmado a la tabla
+# usage_stats cada pocos segundos y reconcile-stats los recalcula de noche
+# con agregados agrupados. Leerlas es una consulta por clave primaria.
+
+import atexit
+import logging
+import os
+import threading
+import time
+import traceback
+from collections import Counter, defaultdict
+from datetime import datetime
+from sqlalchemy import bindparam, case, event, func, insert, select, update
+from sqlalchemy.orm import Session as SessionBase
+from app.config.db import db
+from app.config.shards import shard_router
+from app.models.comment import Comment
+from app.models.note import Note
+from app.models.usage_stats import UsageStats
+from app.models.user import User
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Segundos entre escrituras de los contadores acumulados en usage_stats
+USAGE_STATS_CHECKPOINT = float(os.environ.get("USAGE_STATS_CHECKPOINT", "10"))
+
+# Contadores por usuario; la fila global cuenta además los usuarios
+FIELDS = ("notes", "public_notes", "likes_received", "comments")
+GLOBAL_FIELDS = ("users",) + FIELDS
+# Nombres en la respuesta de /stats
+_USER_KEYS = {"notes": "notes", "public_notes": "publicNotes", "likes_received": "likesReceived",
+              "comments": "comments"}
+_GLOBAL_KEYS = {"users": "users", "notes": "notes", "public_notes": "publicNotes", "likes_received": "likes",
+                "comments": "comments"}
+# Clave de session.info con los cambios de la transacción en curso
+_STAGED = "usage_stats_staged"
+
+class UsageCounters:
+    """
+    Cambios de los contadores confirmados en este proceso y aún no escritos
+    en usage_stats. record() los anota en la transacción en curso: al
+    confirmarla pasan a pendientes y al deshacerla se descartan, así que
+    nunca cuentan escrituras que no llegaron a la base de datos. Un hilo los
+    suma a las filas (UPDATE ... SET notes = notes + n, sin pisar lo que
+    sumen otros procesos) cada USAGE_STATS_CHECKPOINT segundos.
+    """
+
+    def __init__(self):
+        self.interval = USAGE_STATS_CHECKPOINT
+        self._app = None
+        self._pending = defaultdict(Counter)  # scope -> cambios por campo
+        self._lock = threading.Lock()
+        self._thread = None
+        self._installed = False
+        self.checkpoints = 0
+
+    def init_app(self, app):
+        self.interval = float(app.config.get("USAGE_STATS_CHECKPOINT", USAGE_STATS_CHECKPOINT))
+        self._app = app
+        if not self._installed:
+            event.listen(SessionBase, "after_commit", self._after_commit)
+            event.listen(SessionBase, "after_rollback", self._after_rollback)
+            self._installed = True
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="usage-stats", daemon=True)
+            self._thread.start()
+            atexit.register(self._checkpoint_at_exit)
+
+            from app.utils.metrics import registry
+            registry.register_collector(lambda: [
+                ("gauge", "notenest_usage_stats_pending_scopes", (), len(self._pending)),
+                ("counter", "notenest_usage_stats_checkpoints_total", (), self.checkpoints),
+            ])
+
+    # -- Anotación --------------------------------------------------------
+
+    def record(self, user_id, **deltas):
+        """Suma `deltas` (campos de GLOBAL_FIELDS) al usuario y a los totales al confirmar la transacción."""
+        deltas = {field: value for field, value in deltas.items() if value}
+        if not deltas:
+            return
+        staged = db.session.info.setdefault(_STAGED, defaultdict(Counter))
+        if user_id:
+            staged[user_id].update({field: value for field, value in deltas.items() if field in FIELDS})
+        staged[UsageStats.GLOBAL].update(deltas)
+
+    def record_note(self, note, sign=1):
+        """Cuenta (sign=1) o descuenta (sign=-1) una nota activa con sus likes."""
+        self.record(note.user_id, notes=sign, public_notes=sign if note.is_public else 0,
+                    likes_received=sign * (note.likes or 0))
+
+    def _after_commit(self, session):
+        staged = session.info.pop(_STAGED, None)
+        if staged:
+            with self._lock:
+                for scope, deltas in staged.items():
+                    self._pending[scope].update(deltas)
+
+    def _after_rollback(self, session):
+        session.info.pop(_STAGED, None)
+
+    # -- Lectura ----------------------------------------------------------
+
+    def user(self, user_id):
+        """Contadores de un usuario (lo guardado más lo pendiente de este proceso)."""
+        return self._read(user_id, FIELDS, _USER_KEYS)
+
+    def totals(self):
+        return self._read(UsageStats.GLOBAL, GLOBAL_FIELDS, _GLOBAL_KEYS)
+
+    def _read(self, scope, fields, keys):
+        row = db.session.get(UsageStats, scope)
+        with self._lock:
+            pending = Counter(self._pending.get(scope, ()))
+        stats = {keys[field]: max(0, (getattr(row, field) if row else 0) + pending[field]) for field in fields}
+        stats["updatedAt"] = row.updated_at.isoformat() if row and row.updated_at else None
+        stats["reconciledAt"] = row.reconciled_at.isoformat() if row and row.reconciled_at else None
+        return stats
+
+    # -- Escritura --------------------------------------------------------
+
+    def checkpoint(self):
+        """
+        Suma a usage_stats lo pendiente con un UPDATE por lotes (crea antes las
+        filas que falten). Si falla, lo pendiente se conserva para el siguiente
+        intento. Retorna el número de filas actualizadas.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(Counter)
+        if not pending:
+            return 0
+        table = UsageStats.__table__
+        try:
+            existing = set(db.session.scalars(select(UsageStats.scope).where(UsageStats.scope.in_(list(pending)))))
+            missing = [scope for scope in pending if scope not in existing]
+            if missing:
+                db.session.execute(insert(table), [
+                    {"scope": scope, **dict.fromkeys(GLOBAL_FIELDS, 0)} for scope in missing
+                ])
+            db.session.execute(
+                update(table).where(table.c.scope == bindparam("b_scope")).values(
+                    updated_at=bindparam("b_updated_at"),
+                    **{field: table.c[field] + bindparam(f"b_{field}") for field in GLOBAL_FIELDS},
+                ),
+                [{"b_scope": scope, "b_updated_at": datetime.utcnow(),
+                  **{f"b_{field}": deltas[field] for field in GLOBAL_FIELDS}}
+                 for scope, deltas in pending.items()],
+            )
+            db.session.commit()
+        except Exception as e:
+            # Por ejemplo, otro proceso creó la misma fila a la vez: se reintenta en el siguiente
+            db.session.rollback()
+            with self._lock:
+                for scope, deltas in pending.items():
+                    self._pending[scope].update(deltas)
+            logger.error("❌ Error guardando las estadísticas de uso: %s", str(e).splitlines()[0])
+            logger.debug(traceback.format_exc())
+            return 0
+        self.checkpoints += 1
+        return len(pending)
+
+    def _checkpoint_at_exit(self):
+        if self._pending:
+            with self._app.app_context():
+                self.checkpoint()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self._app.app_context():
+                    self.checkpoint()
+                    db.session.remove()
+            except Exception as e:
+                logger.error("❌ Error en el hilo de estadísticas de uso: %s", str(e))
+                logger.debug(traceback.format_exc())
+
+    # -- Reconciliación ---------------------------------------------------
+
+    def reconcile(self):
+        """
+        Recalcula todas las filas con agregados agrupados por usuario (uno
+        sobre las notas activas y otro sobre los comentarios, en cada shard)
+        y corrige solo las que no coinciden. Los cambios que otros procesos
+        aún no han guardado (como mucho USAGE_STATS_CHECKPOINT segundos de
+        escrituras) pueden quedar contados dos veces o ninguna hasta la
+        siguiente reconciliación; por eso se ejecuta de noche.
+        Retorna el número de filas corregidas.
+        """
+        self.checkpoint()
+        expected = defaultdict(Counter)
+        for _ in shard_router.each():
+            for user_id, notes, public_notes, likes in db.session.execute(
+                select(Note.user_id, func.count(), func.sum(case((Note.is_public.is_(True), 1), else_=0)),
+                       func.sum(Note.likes))
+                .where(Note.deleted_at.is_(None)).group_by(Note.user_id)
+            ):
+                expected[user_id].update(notes=notes, public_notes=int(public_notes or 0),
+                                         likes_received=int(likes or 0))
+            for user_id, comments in db.session.execute(
+                select(Comment.user_id, func.count()).group_by(Comment.user_id)
+            ):
+                expected[user_id]["comments"] += comments
+        totals = Counter(users=db.session.scalar(select(func.count()).select_from(User)))
+        for counters in expected.values():
+            totals.update(counters)
+        expected[UsageStats.GLOBAL] = totals
+
+        now = datetime.utcnow()
+        stored = {row.scope: row for row in db.session.execute(select(*UsageStats.__table__.c))}
+        fixes, inserts = [], []
+        for scope in set(stored) | set(expected):
+            values = {field: expected[scope][field] for field in GLOBAL_FIELDS}
+            if scope not in stored:
+                inserts.append({"scope": scope, "updated_at": now, **values})
+            elif any(getattr(stored[scope], field) != value for field, value in values.items()):
+                fixes.append({"scope": scope, "updated_at": now, **values})
+        if inserts:
+            db.session.execute(insert(UsageStats), inserts)
+        if fixes:
+            db.session.execute(update(UsageStats), fixes)
+        # También las filas que ya estaban bien quedan marcadas como comprobadas
+        db.session.execute(update(UsageStats).values(reconciled_at=now))
+        db.session.commit()
+        logger.info("📊 Estadísticas de uso reconciliadas: %d filas nuevas, %d corregidas", len(inserts), len(fixes))
+        return len(inserts) + len(fixes)
+
+usage_stats = UsageCounters()
@@ -0,0 +1,144 @@
+# Directorio de usuarios en memoria para buscar personas con quien compartir
+# notas por prefijo de nombre o email, sin recorrer la tabla de usuarios
+
+import base64
+import json
+import os
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from app.config.db import db
+from app.models.user import User
+
+# Cada cuánto se incorporan los cambios hechos por otros procesos (segundos)
+REFRESH_INTERVAL = float(os.environ.get("USER_DIRECTORY_REFRESH", "30"))
+# Segundos que cada refresco vuelve a leer antes del último updated_at visto: cubre
+# las filas con el mismo instante y las confirmadas después de otras más recientes
+REFRESH_OVERLAP = float(os.environ.get("USER_DIRECTORY_REFRESH_OVERLAP", "10"))
+MAX_LIMIT = 50
+
+def normalize(text):
+    """Minúsculas y sin tildes, para que 'Álvaro' se encuentre con 'alv'."""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold().strip()
+
+def _keys_for(name, email):
+    """Claves indexadas de un usuario: nombre completo, cada palabra del nombre y el email."""
+    full = normalize(name)
+    keys = {full, normalize(email)}
+    keys.update(full.split())
+    keys.discard("")
+    return keys
+
+def encode_cursor(entry):
+    return base64.urlsafe_b64encode(json.dumps(list(entry)).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor):
+    """Retorna la entrada (clave, user_id) del cursor, o None si no es válido."""
+    try:
+        key, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return (str(key), str(user_id))
+    except (ValueError, TypeError):
+        return None
+
+class UserDirectory:
+    """
+    Índice ordenado de (clave normalizada, id de usuario).
+    La búsqueda por prefijo es una búsqueda binaria más un recorrido de los
+    k resultados pedidos. Solo guarda id, nombre y email: nunca columnas sensibles.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = []   # Lista ordenada de (clave, user_id)
+        self._users = {}     # user_id -> {"id", "name", "email"}
+        self._keys = {}      # user_id -> claves indexadas del usuario
+        self._synced_at = None
+        self._checked_at = 0.0
+
+    def load(self):
+        """Construye el índice completo (se llama una vez al arrancar)."""
+        rows = db.session.execute(select(User.id, User.name, User.email, User.updated_at)).all()
+        entries, users, keys = [], {}, {}
+        synced_at = None
+        for user_id, name, email, updated_at in rows:
+            users[user_id] = {"id": user_id, "name": name, "email": email}
+            keys[user_id] = _keys_for(name, email)
+            entries.extend((key, user_id) for key in keys[user_id])
+            if updated_at and (synced_at is None or updated_at > synced_at):
+                synced_at = updated_at
+        entries.sort()
+        with self._lock:
+            self._entries, self._users, self._keys = entries, users, keys
+            self._synced_at = synced_at or datetime.utcnow()
+            self._checked_at = time.monotonic()
+
+    def upsert(self, user_id, name, email):
+        """Añade o actualiza un usuario (register_user y update_user)."""
+        new_keys = _keys_for(name, email)
+        with self._lock:
+            for key in self._keys.get(user_id, ()):
+                index = bisect_left(self._entries, (key, user_id))
+                if index < len(self._entries) and self._entries[index] == (key, user_id):
+                    del self._entries[index]
+            for key in new_keys:
+                insort(self._entries, (key, user_id))
+            self._keys[user_id] = new_keys
+            self._users[user_id] = {"id": user_id, "name": name, "email": email}
+
+    def refresh(self):
+        """
+        Incorpora los usuarios creados o modificados por otros procesos desde la
+        última sincronización. Usa el índice de users.updated_at, así que solo
+        lee las filas cambiadas (y las de los últimos REFRESH_OVERLAP segundos,
+        que se saltan si ya están como en el índice).
+        """
+        if self._synced_at is None or time.monotonic() - self._checked_at < REFRESH_INTERVAL:
+            return
+        self._checked_at = time.monotonic()
+        since = self._synced_at - timedelta(seconds=REFRESH_OVERLAP)
+        rows = db.session.execute(
+            select(User.id, User.name, User.email, User.updated_at).where(User.updated_at >= since)
+        ).all()
+        for user_id, name, email, updated_at in rows:
+            if self._users.get(user_id) != {"id": user_id, "name": name, "email": email}:
+                self.upsert(user_id, name, email)
+            if updated_at > self._synced_at:
+                self._synced_at = updated_at
+
+    def search(self, prefix, limit=20, cursor=None):
+        """
+        Retorna (usuarios, cursor siguiente) cuyos nombres o email empiezan por
+        `prefix`, en orden de clave. Un usuario aparece una sola vez: en la
+        primera de sus claves que coincide con el prefijo.
+        """
+        prefix = normalize(prefix)
+        cursor = decode_cursor(cursor) if cursor else None
+        limit = max(1, min(limit, MAX_LIMIT))
+        results = []
+        with self._lock:
+            if cursor:
+                start = bisect_right(self._entries, cursor)
+            else:
+                start = bisect_left(self._entries, (prefix, ""))
+            index = start
+            while index < len(self._entries) and len(results) < limit:
+                key, user_id = self._entries[index]
+                index += 1
+                if not key.startswith(prefix):
+                    break
+                first_match = min(k for k in self._keys[user_id] if k.startswith(prefix))
+                if key == first_match:
+                    results.append(((key, user_id), dict(self._users[user_id])))
+
+            more = (index < len(self._entries) and self._entries[index][0].startswith(prefix))
+        next_cursor = encode_cursor(results[-1][0]) if results and more else None
+        return [user for _, user in results], next_cursor
+
+    def __len__(self):
+        return len(self._users)
+
+user_directory = UserDirectory()
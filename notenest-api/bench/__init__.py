@@ -0,0 +1,2 @@
+# Suite de benchmarks de carga y latencia de la API
+# Uso: python -m bench.run --help (desde notenest-api/)
@@ -0,0 +1,185 @@
+# Generación del conjunto de datos sintético de los benchmarks: usuarios,
+# notas de tamaños realistas, hilos de comentarios y archivos adjuntos.
+# Con la misma semilla se obtiene exactamente el mismo conjunto de datos.
+
+import io
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+from app.config.db import db
+from app.config.shards import shard_router
+from app.models.user import User
+from app.models.note import Note
+from app.models.comment import Comment
+from app.models.note_files import NoteFile
+from app.models.blob import Blob
+from app.utils.blob_store import blob_store
+from app.utils.compression import compress_text
+from app.utils.password_utils import hash_password
+
+PASSWORD = "benchmark"
+WORDS = (
+    "nota idea tarea lista compra reunión proyecto viaje receta libro código "
+    "revisar enviar llamar estudiar examen clase resumen borrador plan semana "
+    "mañana importante pendiente hecho cliente equipo diseño prueba error mejora"
+).split()
+
+class Dataset:
+    """Identificadores de todo lo sembrado, para que la carga elija objetivos reales."""
+
+    def __init__(self):
+        self.users = []        # dicts con id, email y name
+        self.notes = []        # ids de notas
+        self.public_notes = []
+        self.note_owner = {}   # note_id -> user_id
+        self.comments = []     # (note_id, comment_id)
+        self.files = []        # ids de archivos adjuntos
+        self.blobs = []        # SHA-256 de los blobs
+
+    def summary(self):
+        return {
+            "users": len(self.users),
+            "notes": len(self.notes),
+            "publicNotes": len(self.public_notes),
+            "comments": len(self.comments),
+            "files": len(self.files),
+            "blobs": len(self.blobs),
+        }
+
+def _uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+def _text(rng, size):
+    """Texto de aproximadamente `size` caracteres."""
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:size]
+
+def note_size(rng):
+    # La mayoría de las notas son cortas, pero hay una cola larga de notas extensas
+    return min(int(rng.lognormvariate(6.5, 1.0)), 64 * 1024)
+
+def blob_content(rng, size):
+    return rng.randbytes(size)
+
+def seed(rng, users=50, notes_per_user=20, comments_per_note=8, files_per_note=1, public_ratio=0.3):
+    """
+    Siembra MySQL (o SQLite) y el almacén de documentos con datos sintéticos.
+    Debe llamarse dentro de un contexto de aplicación. Retorna un Dataset.
+    """
+    from flask import current_app
+    mongo = current_app.config['MONGO_DB']
+    dataset = Dataset()
+    start = datetime(2024, 1, 1)
+    # Un solo hash para todos: bcrypt es deliberadamente lento
+    password_hash, salt = hash_password(PASSWORD)
+
+    user_rows = []
+    for index in range(users):
+        user_id = _uuid(rng)
+        name = f"{rng.choice(WORDS).capitalize()} {rng.choice(WORDS).capitalize()} {index}"
+        email = f"user{index}@bench.notenest"
+        user_rows.append({
+            "id": user_id, "email": email, "name": name,
+            "password_hash": password_hash, "salt": salt,
+            "created_at": start, "updated_at": start,
+        })
+        dataset.users.append({"id": user_id, "email": email, "name": name})
+    db.session.execute(insert(User), user_rows)
+
+    # Un conjunto pequeño de blobs compartidos: el mismo archivo adjunto en varias notas
+    blob_refs = {}
+    for _ in range(max(1, users // 2)):
+        content = blob_content(rng, rng.randint(2 * 1024, 256 * 1024))
+        sha256, size, _ = blob_store.put_stream(io.BytesIO(content), "application/octet-stream")
+        blob_refs[sha256] = [size, 0]
+    dataset.blobs = list(blob_refs)
+
+    note_rows, comment_rows, file_rows = [], [], []
+    for user in dataset.users:
+        for _ in range(notes_per_user):
+            note_id = _uuid(rng)
+            created = start + timedelta(minutes=rng.randint(0, 60 * 24 * 365))
+            is_public = rng.random() < public_ratio
+            n_comments = rng.randint(0, comments_per_note * 2)
+            n_files = rng.randint(0, files_per_note * 2)
+            note_rows.append({
+                "id": note_id, "user_id": user["id"],
+                "title": _text(rng, rng.randint(8, 60)),
+                "stored_content": compress_text(_text(rng, note_size(rng))),
+                "is_public": is_public, "likes": rng.randint(0, 50),
+                "comment_count": n_comments, "file_count": n_files,
+                "created_at": created, "updated_at": created,
+            })
+            dataset.notes.append(note_id)
+            dataset.note_owner[note_id] = user["id"]
+            if is_public:
+                dataset.public_notes.append(note_id)
+
+            # Hilos: cada comentario responde a uno anterior con cierta probabilidad
+            thread = []
+            for position in range(n_comments):
+                author = rng.choice(dataset.users)
+                comment_id = _uuid(rng)
+                parent = thread[rng.randrange(len(thread))] if thread and rng.random() < 0.4 else None
+                comment_rows.append({
+                    "id": comment_id, "user_id": author["id"], "user_name": author["name"],
+                    "note_id": note_id,
+                    "parent_id": parent["id"] if parent else None,
+                    "root_comment": parent["root_comment"] if parent else comment_id,
+                    "stored_content": compress_text(_text(rng, rng.randint(20, 400))),
+                    "created_at": created + timedelta(minutes=position + 1),
+                    "updated_at": created + timedelta(minutes=position + 1),
+                })
+                thread.append(comment_rows[-1])
+                dataset.comments.append((note_id, comment_id))
+
+            for _ in range(n_files):
+                sha256 = rng.choice(dataset.blobs)
+                blob_refs[sha256][1] += 1
+                file_id = _uuid(rng)
+                file_rows.append({
+                    "id": file_id, "note_id": note_id,
+                    "file_url": f"/api/blobs/{sha256}", "blob_sha256": sha256,
+                })
+                dataset.files.append(file_id)
+
+    db.session.execute(insert(Blob), [
+        {"sha256": sha256, "size": size, "content_type": "application/octet-stream",
+         "ref_count": refs, "created_at": start, "updated_at": start}
+        for sha256, (size, refs) in blob_refs.items()
+    ])
+    # Con sharding cada nota va, con sus comentarios y archivos, al shard de su dueño
+    note_shard = {row["id"]: shard_router.shard_for_user(row["user_id"]) for row in note_rows}
+    for shard in shard_router.each():
+        shard_notes = [row for row in note_rows if note_shard[row["id"]] == shard]
+        if shard_notes:
+            db.session.execute(insert(Note), shard_notes)
+        # Los padres siempre van antes que sus respuestas, así que la FK se cumple en orden
+        shard_comments = [row for row in comment_rows if note_shard[row["note_id"]] == shard]
+        if shard_comments:
+            db.session.execute(insert(Comment), shard_comments)
+        shard_files = [row for row in file_rows if note_shard[row["note_id"]] == shard]
+        if shard_files:
+            db.session.execute(insert(NoteFile), shard_files)
+        db.session.commit()
+
+    # Copia en el almacén de documentos, como harían los endpoints
+    for _ in shard_router.each():
+        for note in Note.query.all():
+            mongo.notes.insert_one(note.to_document())
+        for comment in Comment.query.all():
+            mongo.comments.insert_one(comment.to_document())
+    for row in file_rows:
+        mongo.note_files.insert_one({
+            "_id": row["id"], "noteId": row["note_id"],
+            "fileUrl": row["file_url"], "blobId": row["blob_sha256"],
+        })
+    for user in dataset.users:
+        mongo.users.insert_one({"_id": user["id"], **user})
+    db.session.remove()
+    return dataset
@@ -0,0 +1,44 @@
+# Réplicas SQLite para probar en local el reparto de lecturas: un hilo copia
+# la base principal sobre cada réplica con la API de backup de SQLite cada
+# `delay` segundos, así que las réplicas van atrasadas como mucho ese tiempo
+# (más lo que tarda la copia), igual que una réplica asíncrona de MySQL.
+
+import sqlite3
+import threading
+
+class SQLiteReplicator:
+    def __init__(self, primary, replicas, delay=0.5):
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.delay = delay
+        self.copies = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def copy(self):
+        """Copia ahora la principal sobre cada réplica."""
+        source = sqlite3.connect(self.primary, timeout=30)
+        try:
+            for path in self.replicas:
+                target = sqlite3.connect(path, timeout=30)
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+        finally:
+            source.close()
+        self.copies += 1
+
+    def start(self):
+        self.copy()
+        self._thread = threading.Thread(target=self._run, name="bench-replicator", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.delay):
+            self.copy()
@@ -0,0 +1,303 @@
+# Ejecuta la suite de carga: siembra un conjunto de datos sintético, lanza
+# la mezcla de peticiones en paralelo contra todas las rutas y reporta
+# percentiles de latencia y throughput por endpoint.
+#
+#   python -m bench.run --concurrency 8 --requests 4000 --output results.json
+#   python -m bench.run --baseline bench/baseline.json        # compara y falla si empeora
+#   python -m bench.run --save-baseline bench/baseline.json   # guarda la referencia
+#
+# Funciona sin red: usa SQLite (WAL) y el almacén de documentos embebido en
+# memoria en lugar de MySQL y MongoDB, y el cliente de pruebas de Flask en
+# lugar de HTTP.
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from bench.dataset import seed
+from bench.replication import SQLiteReplicator
+from bench.workload import BenchState, PROFILE
+from app.utils.autosave import note_autosave
+from app.utils.usage_stats import usage_stats
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+def load_create_app():
+    # app.py comparte nombre con el paquete app/, así que se carga por ruta
+    spec = importlib.util.spec_from_file_location("notenest_app", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.create_app
+
+def replica_paths(workdir, replicas):
+    return [os.path.join(workdir, f"replica{index}.db") for index in range(replicas)]
+
+def build_app(workdir, shards=0, replicas=0):
+    database = os.path.join(workdir, "bench.db")
+    create_app = load_create_app()
+    return create_app({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{database}",
+        # Con --shards, una base SQLite más por shard para notas, comentarios y sesiones
+        "SQL_SHARD_URLS": [f"sqlite:///{os.path.join(workdir, f'shard{index}.db')}" for index in range(shards)],
+        # Con --replicas, copias de la principal que SQLiteReplicator mantiene al día
+        "SQL_REPLICA_URLS": [f"sqlite:///{path}" for path in replica_paths(workdir, replicas)],
+        "DOCUMENT_STORE_URL": "memory://",
+        "BLOB_STORAGE_DIR": os.path.join(workdir, "blobs"),
+        "BOOTSTRAP_CACHE_DIR": os.path.join(workdir, "bootstrap"),
+        # Agrupa las ráfagas de autosave_note como en producción
+        "NOTE_AUTOSAVE_WINDOW": 0.2,
+    })
+
+class Recorder:
+    """Latencias y códigos de estado por endpoint. Cada hilo escribe en el suyo y se unen al final."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+
+    def merge(self, other):
+        for endpoint, values in other.latencies.items():
+            self.latencies[endpoint].extend(values)
+        for endpoint, counts in other.statuses.items():
+            self.statuses[endpoint].update(counts)
+
+def make_call(client, recorder):
+    def call(endpoint, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = client.open(url, method=method, **kwargs)
+            status = response.status_code
+        except Exception:
+            recorder.latencies[endpoint].append((time.perf_counter() - start) * 1000)
+            recorder.statuses[endpoint]["exception"] += 1
+            raise
+        recorder.latencies[endpoint].append((time.perf_counter() - start) * 1000)
+        recorder.statuses[endpoint][str(status)] += 1
+        return response
+    return call
+
+def percentile(ordered, fraction):
+    """Percentil por rango más cercano sobre una lista ya ordenada."""
+    if not ordered:
+        return None
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def summarize(latencies, statuses, elapsed):
+    ordered = sorted(latencies)
+    errors = sum(count for status, count in statuses.items() if not status.isdigit() or int(status) >= 500)
+    return {
+        "count": len(ordered),
+        "errors": errors,
+        "statuses": dict(sorted(statuses.items())),
+        "throughputRps": round(len(ordered) / elapsed, 2) if elapsed else None,
+        "meanMs": round(sum(ordered) / len(ordered), 3) if ordered else None,
+        "p50Ms": round(percentile(ordered, 0.50), 3) if ordered else None,
+        "p95Ms": round(percentile(ordered, 0.95), 3) if ordered else None,
+        "p99Ms": round(percentile(ordered, 0.99), 3) if ordered else None,
+        "maxMs": round(ordered[-1], 3) if ordered else None,
+    }
+
+def run_worker(app, state, recorder, seed_value, operations, failures):
+    rng = random.Random(seed_value)
+    client = app.test_client()
+    call = make_call(client, recorder)
+    functions = [operation for operation, _ in PROFILE]
+    weights = [weight for _, weight in PROFILE]
+    for _ in range(operations):
+        operation = rng.choices(functions, weights)[0]
+        try:
+            operation(call, state, rng)
+        except Exception as e:
+            failures.append(f"{operation.__name__}: {e!r}")
+
+def coverage_pass(app, state, rng):
+    """Ejecuta cada operación una vez, para que todas las rutas aparezcan en el reporte."""
+    recorder = Recorder()
+    call = make_call(app.test_client(), recorder)
+    for operation, _ in PROFILE:
+        operation(call, state, rng)
+    return recorder
+
+def compare(results, baseline, tolerance, min_delta_ms, min_samples):
+    """
+    Compara con una ejecución anterior. Un endpoint empeora si su p95 sube más
+    de `tolerance` (y al menos `min_delta_ms`, para ignorar el ruido en rutas
+    muy rápidas) o si tiene más errores; además se vigila el throughput total.
+    Los endpoints con menos de `min_samples` peticiones no tienen percentiles
+    estables y solo se comparan por errores.
+    """
+    regressions = []
+    for endpoint, current in results["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(endpoint)
+        if not previous or not previous.get("count") or not current.get("count"):
+            continue
+        if (min(current["count"], previous["count"]) >= min_samples
+                and current["p95Ms"] > previous["p95Ms"] * (1 + tolerance)
+                and current["p95Ms"] - previous["p95Ms"] >= min_delta_ms):
+            regressions.append(f"{endpoint}: p95 {previous['p95Ms']:.2f} → {current['p95Ms']:.2f} ms")
+        if current["errors"] > previous.get("errors", 0):
+            regressions.append(f"{endpoint}: errores {previous.get('errors', 0)} → {current['errors']}")
+    total, previous_total = results["total"], baseline.get("total", {})
+    if previous_total.get("throughputRps") and total["throughputRps"] < previous_total["throughputRps"] * (1 - tolerance):
+        regressions.append(
+            f"total: throughput {previous_total['throughputRps']:.1f} → {total['throughputRps']:.1f} req/s"
+        )
+    return regressions
+
+def print_report(results, out=sys.stdout):
+    header = f"{'endpoint':45} {'n':>6} {'err':>4} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}"
+    print(header, file=out)
+    print("-" * len(header), file=out)
+    rows = sorted(results["endpoints"].items(), key=lambda item: -item[1]["count"])
+    for endpoint, stats in rows + [("TOTAL", results["total"])]:
+        if not stats["count"]:
+            continue
+        print(f"{endpoint:45} {stats['count']:>6} {stats['errors']:>4} {stats['throughputRps']:>8.1f} "
+              f"{stats['p50Ms']:>8.2f} {stats['p95Ms']:>8.2f} {stats['p99Ms']:>8.2f}", file=out)
+    if results["uncovered"]:
+        print(f"⚠️ Rutas sin cubrir por la carga: {', '.join(results['uncovered'])}", file=out)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de carga y latencia de la API de NoteNest")
+    parser.add_argument("--seed", type=int, default=42, help="semilla del conjunto de datos y de la carga")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--notes-per-user", type=int, default=20)
+    parser.add_argument("--comments-per-note", type=int, default=8, help="media de comentarios por nota")
+    parser.add_argument("--files-per-note", type=int, default=1, help="media de archivos por nota")
+    parser.add_argument("--concurrency", type=int, default=8, help="hilos cliente en paralelo")
+    parser.add_argument("--requests", type=int, default=2000, help="operaciones totales de la fase medida")
+    parser.add_argument("--output", help="archivo JSON con los resultados")
+    parser.add_argument("--baseline", help="JSON de una ejecución anterior con el que comparar")
+    parser.add_argument("--save-baseline", help="guarda los resultados como nueva referencia")
+    parser.add_argument("--tolerance", type=float, default=0.20, help="empeoramiento permitido (0.20 = 20%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=2.0, help="diferencia mínima de p95 para contar")
+    parser.add_argument("--min-samples", type=int, default=30, help="peticiones mínimas para comparar percentiles")
+    parser.add_argument("--replicas", type=int, default=0, help="réplicas de lectura SQLite de la base principal")
+    parser.add_argument("--replica-delay", type=float, default=0.5, help="segundos entre copias a las réplicas")
+    parser.add_argument("--shards", type=int, default=0, help="reparte los datos en N bases SQLite (0 = sin sharding)")
+    parser.add_argument("--workdir", help="directorio para la base y los blobs (por defecto, uno temporal)")
+    parser.add_argument("--verbose", action="store_true", help="no silenciar los logs de la aplicación")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.verbose:
+        logging.disable(logging.WARNING)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="notenest-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    # Algunas rutas aún escriben con print(); se silencia mientras corre la carga
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    replicator = None
+    try:
+        with quiet:
+            app = build_app(workdir, args.shards, args.replicas)
+            with app.app_context():
+                dataset = seed(
+                    random.Random(args.seed),
+                    users=args.users,
+                    notes_per_user=args.notes_per_user,
+                    comments_per_note=args.comments_per_note,
+                    files_per_note=args.files_per_note,
+                )
+                # La siembra no pasa por las rutas: las estadísticas de uso se calculan como de noche
+                usage_stats.reconcile()
+            if args.replicas:
+                replicator = SQLiteReplicator(os.path.join(workdir, "bench.db"),
+                                              replica_paths(workdir, args.replicas), args.replica_delay)
+                replicator.start()
+            state = BenchState(dataset)
+            coverage = coverage_pass(app, state, random.Random(args.seed))
+
+            recorders = [Recorder() for _ in range(args.concurrency)]
+            failures = []
+            per_worker = max(1, args.requests // args.concurrency)
+            threads = [
+                threading.Thread(
+                    target=run_worker,
+                    args=(app, state, recorders[index], args.seed + index + 1, per_worker, failures),
+                )
+                for index in range(args.concurrency)
+            ]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            # Lo acumulado en segundo plano se guarda antes de borrar el directorio de trabajo
+            note_autosave.flush_all()
+            with app.app_context():
+                usage_stats.checkpoint()
+
+        measured = Recorder()
+        for recorder in recorders:
+            measured.merge(recorder)
+
+        routes = {rule.endpoint for rule in app.url_map.iter_rules() if rule.endpoint != "static"}
+        exercised = set(coverage.latencies) | set(measured.latencies)
+        all_latencies = [value for values in measured.latencies.values() for value in values]
+        all_statuses = Counter()
+        for counts in measured.statuses.values():
+            all_statuses.update(counts)
+
+        results = {
+            "meta": {
+                "startedAt": datetime.utcnow().isoformat(),
+                "seed": args.seed,
+                "concurrency": args.concurrency,
+                "operations": per_worker * args.concurrency,
+                "elapsedSeconds": round(elapsed, 3),
+                "dataset": dataset.summary(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+            },
+            "total": summarize(all_latencies, all_statuses, elapsed),
+            "endpoints": {
+                endpoint: summarize(measured.latencies.get(endpoint, []), measured.statuses.get(endpoint, Counter()), elapsed)
+                for endpoint in sorted(routes)
+            },
+            "uncovered": sorted(routes - exercised),
+            "failures": failures[:50],
+        }
+
+        print_report(results)
+        if failures:
+            print(f"⚠️ {len(failures)} operaciones fallaron en el cliente (ver 'failures' en el JSON)")
+        for path in filter(None, (args.output, args.save_baseline)):
+            with open(path, "w") as handle:
+                json.dump(results, handle, indent=2, ensure_ascii=False)
+            print(f"💾 Resultados guardados en {path}")
+
+        if args.baseline:
+            with open(args.baseline) as handle:
+                regressions = compare(
+                    results, json.load(handle), args.tolerance, args.min_delta_ms, args.min_samples
+                )
+            if regressions:
+                print("❌ Regresiones respecto a la referencia:")
+                for line in regressions:
+                    print(f"   {line}")
+                return 1
+            print("✅ Sin regresiones respecto a la referencia")
+        return 0
+    finally:
+        if replicator is not None:
+            replicator.stop()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,432 @@
+# Perfil de carga mixto de lectura/escritura, modelado sobre el patrón de
+# llamadas del cliente Flutter: al abrir la app se valida la sesión y se
+# cargan las notas propias y públicas; al abrir una nota se piden sus
+# comentarios y archivos; escribir (editar, comentar, dar like) es menos común.
+
+import threading
+import uuid
+from bench.dataset import PASSWORD, blob_content, _text
+
+class BenchState:
+    """
+    Estado compartido entre los hilos de carga: los objetivos disponibles
+    (sembrados o creados durante la prueba) y los tokens obtenidos.
+    """
+
+    def __init__(self, dataset):
+        self._lock = threading.Lock()
+        self.users = list(dataset.users)
+        self.notes = list(dataset.notes)
+        self.public_notes = list(dataset.public_notes)
+        self.note_owner = dict(dataset.note_owner)
+        self.comments = list(dataset.comments)
+        self.files = list(dataset.files)
+        self.blobs = list(dataset.blobs)
+        # Solo se borra lo creado durante la prueba, para no vaciar el conjunto sembrado
+        self.created_notes = []
+        self.created_comments = []
+        self.created_files = []
+        self.deleted_notes = []
+        self.sessions = []   # (user_id, token)
+        self.logins = []     # tokens de /login
+
+    def pick(self, rng, name):
+        with self._lock:
+            items = getattr(self, name)
+            return rng.choice(items) if items else None
+
+    def add(self, name, value):
+        with self._lock:
+            getattr(self, name).append(value)
+
+    def take(self, rng, name):
+        with self._lock:
+            items = getattr(self, name)
+            if not items:
+                return None
+            return items.pop(rng.randrange(len(items)))
+
+# ----------------------------------------------------------------------
+# Operaciones. Cada una recibe call(endpoint, método, url, **kwargs), que
+# ejecuta la petición y registra su latencia bajo el endpoint de Flask.
+# ----------------------------------------------------------------------
+
+def _user(state, rng):
+    return state.pick(rng, "users")
+
+def public_notes(call, state, rng):
+    call("route_note.get_public_notes", "GET", "/api/publicNotes")
+
+def trending_notes(call, state, rng):
+    window = rng.choice(["1h", "24h", "7d"])
+    call("route_note.get_trending_notes", "GET", f"/api/trendingNotes?window={window}")
+
+def notes_by_user(call, state, rng):
+    call("route_note.get_notes_by_user", "GET", f"/api/notesByUser/{_user(state, rng)['id']}")
+
+def open_note(call, state, rng):
+    # Pantalla de detalle: nota, comentarios y archivos
+    note_id = state.pick(rng, "notes")
+    call("route_note.get_note_by_id", "GET", f"/api/note/{note_id}")
+    call("route_comment.get_comments_by_note", "GET", f"/api/commentsByNote/{note_id}")
+    call("route_note.get_note_files", "GET", f"/api/noteFiles/{note_id}")
+
+def comment_replies(call, state, rng):
+    _, comment_id = state.pick(rng, "comments")
+    call("route_comment.get_comment_replies", "GET", f"/api/commentReplies/{comment_id}")
+
+def comment_by_id(call, state, rng):
+    _, comment_id = state.pick(rng, "comments")
+    call("route_comment.get_comment_by_id", "GET", f"/api/comment/{comment_id}")
+
+def comments_by_user(call, state, rng):
+    call("route_comment.get_comments_by_user", "GET", f"/api/commentsByUser/{_user(state, rng)['id']}")
+
+def user_stats(call, state, rng):
+    # Pantalla de perfil: contadores del usuario
+    call("route_stats.get_user_stats", "GET", f"/api/stats/user/{_user(state, rng)['id']}")
+
+def global_stats(call, state, rng):
+    call("route_stats.get_global_stats", "GET", "/api/stats/global")
+
+def user_profile(call, state, rng):
+    user = _user(state, rng)
+    call("route_user.get_user_by_id", "GET", f"/api/user/{user['id']}")
+
+def search_users(call, state, rng):
+    prefix = _user(state, rng)["name"][:rng.randint(1, 4)]
+    call("route_user.search_users", "GET", "/api/users/search", query_string={"prefix": prefix})
+
+def users_by_name(call, state, rng):
+    call("route_user.get_all_users", "GET", "/api/users", query_string={"name": _user(state, rng)["name"][:2]})
+
+def all_users(call, state, rng):
+    call("route_user.get_all_users", "GET", "/api/users")
+
+def all_notes(call, state, rng):
+    call("route_note.get_all_notes", "GET", "/api/notes")
+
+def all_comments(call, state, rng):
+    call("route_comment.get_all_comments", "GET", "/api/comments")
+
+def all_sessions(call, state, rng):
+    call("route_session.get_all_sessions", "GET", "/api/sessions")
+
+def session_by_user(call, state, rng):
+    call("route_session.get_session_by_user", "GET", f"/api/session/{_user(state, rng)['id']}")
+
+def create_session(call, state, rng):
+    user = _user(state, rng)
+    response = call("route_session.create_session", "POST", "/api/createSession", json={"userId": user["id"]})
+    if response.status_code == 201:
+        state.add("sessions", (user["id"], response.get_json()["session"]["token"]))
+
+def validate_session(call, state, rng):
+    session = state.pick(rng, "sessions")
+    token = session[1] if session else str(uuid.uuid4())
+    call("route_session.validate_session", "POST", "/api/validateSession", json={"token": token})
+
+def delete_session(call, state, rng):
+    session = state.take(rng, "sessions")
+    user_id = session[0] if session else _user(state, rng)["id"]
+    call("route_session.delete_session", "DELETE", f"/api/deleteSession/{user_id}")
+
+def login(call, state, rng):
+    user = _user(state, rng)
+    response = call("route_user.login_user", "POST", "/api/login",
+                    json={"email": user["email"], "password": PASSWORD})
+    if response.status_code == 200:
+        state.add("logins", response.get_json()["token"])
+
+def logout(call, state, rng):
+    token = state.take(rng, "logins") or str(uuid.uuid4())
+    call("route_user.logout_user", "POST", "/api/logout", headers={"Authorization": token})
+
+def register(call, state, rng):
+    suffix = uuid.UUID(int=rng.getrandbits(128)).hex[:12]
+    email = f"new{suffix}@bench.notenest"
+    name = f"Nuevo {suffix}"
+    response = call("route_user.register_user", "POST", "/api/register",
+                    json={"email": email, "name": name, "password": PASSWORD})
+    if response.status_code == 201:
+        state.add("users", {"id": response.get_json()["id"], "email": email, "name": name})
+
+def update_user(call, state, rng):
+    user = _user(state, rng)
+    call("route_user.update_user", "PUT", f"/api/updateUser/{user['id']}", json={"name": user["name"]})
+
+def add_note(call, state, rng):
+    user = _user(state, rng)
+    payload = {
+        "userId": user["id"],
+        "title": _text(rng, rng.randint(8, 60)),
+        "content": _text(rng, rng.randint(50, 4000)),
+        "isPublic": rng.random() < 0.3,
+    }
+    if rng.random() < 0.3:
+        payload["files"] = [{"blobId": state.pick(rng, "blobs")}]
+    response = call("route_note.add_note", "POST", "/api/addNote", json=payload)
+    if response.status_code == 201:
+        note_id = response.get_json()["id"]
+        state.add("notes", note_id)
+        state.add("created_notes", note_id)
+        with state._lock:
+            state.note_owner[note_id] = user["id"]
+
+def update_note(call, state, rng):
+    # Autoguardado del editor: solo cambia el contenido
+    note_id = state.pick(rng, "notes")
+    call("route_note.update_note", "PUT", f"/api/updateNote/{note_id}",
+         json={"content": _text(rng, rng.randint(50, 4000))})
+
+def autosave_note(call, state, rng):
+    # Ráfaga del editor con "autosave": una petición por pausa al escribir
+    note_id = state.pick(rng, "notes")
+    content = _text(rng, rng.randint(50, 2000))
+    for _ in range(rng.randint(3, 12)):
+        content += _text(rng, rng.randint(1, 30))
+        call("route_note.update_note", "PUT", f"/api/updateNote/{note_id}",
+             json={"content": content, "autosave": True})
+
+def sync_notes(call, state, rng):
+    # Sincronización offline: el cliente envía varias notas propias de golpe
+    user = _user(state, rng)
+    notes = [{
+        "id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+        "userId": user["id"],
+        "title": _text(rng, rng.randint(8, 60)),
+        "content": _text(rng, rng.randint(50, 2000)),
+        "isPublic": False,
+    } for _ in range(rng.randint(1, 5))]
+    response = call("route_note.sync_notes", "POST", "/api/notes", json=notes)
+    if response.status_code == 201:
+        for note in notes:
+            state.add("notes", note["id"])
+            state.add("created_notes", note["id"])
+
+def sync_batch(call, state, rng):
+    # Reconexión tras un rato offline: la cola del cliente en un solo lote
+    user = _user(state, rng)
+    operations = [{"op": "addNote", "ref": "n", "data": {
+        "userId": user["id"],
+        "title": _text(rng, rng.randint(8, 60)),
+        "content": _text(rng, rng.randint(50, 2000)),
+    }}]
+    for _ in range(rng.randint(2, 20)):
+        kind = rng.random()
+        if kind < 0.4:
+            operations.append({"op": "addComment", "data": {
+                "noteId": "$ref:n", "userId": user["id"], "content": _text(rng, rng.randint(20, 200)),
+            }})
+        elif kind < 0.7:
+            operations.append({"op": "updateNote", "id": "$ref:n",
+                               "data": {"content": _text(rng, rng.randint(50, 2000))}})
+        else:
+            operations.append({"op": "likeNote", "id": state.pick(rng, "notes")})
+    response = call("route_sync.sync_batch", "POST", "/api/sync/batch", json={"operations": operations})
+    if response.status_code == 200:
+        note_id = response.get_json()["refs"].get("n")
+        if note_id:
+            state.add("notes", note_id)
+            state.add("created_notes", note_id)
+
+def bootstrap_device(call, state, rng):
+    # Primer inicio de sesión en un dispositivo: instantánea completa del usuario
+    response = call("route_sync.sync_bootstrap", "GET", f"/api/sync/bootstrap/{_user(state, rng)['id']}")
+    response.get_data()
+    response.close()
+
+def delete_note(call, state, rng):
+    note_id = state.take(rng, "created_notes")
+    if note_id is None:
+        return
+    with state._lock:
+        if note_id in state.notes:
+            state.notes.remove(note_id)
+        state.comments = [item for item in state.comments if item[0] != note_id]
+    response = call("route_note.delete_note", "DELETE", f"/api/deleteNote/{note_id}")
+    if response.status_code == 200:
+        state.add("deleted_notes", note_id)
+
+def note_cleanup(call, state, rng):
+    note_id = state.pick(rng, "deleted_notes") or state.pick(rng, "notes")
+    call("route_note.get_note_cleanup", "GET", f"/api/noteCleanup/{note_id}")
+
+def like_note(call, state, rng):
+    note_id = state.pick(rng, "public_notes") or state.pick(rng, "notes")
+    call("route_note.like_note", "PUT", f"/api/likeNote/{note_id}", json={"userId": _user(state, rng)["id"]})
+
+def unlike_note(call, state, rng):
+    note_id = state.pick(rng, "public_notes") or state.pick(rng, "notes")
+    call("route_note.unlike_note", "PUT", f"/api/unlikeNote/{note_id}", json={"userId": _user(state, rng)["id"]})
+
+def liked_notes(call, state, rng):
+    # El feed pregunta de una vez por todas las notas visibles
+    note_ids = [state.pick(rng, "public_notes") or state.pick(rng, "notes") for _ in range(50)]
+    call("route_note.get_liked_notes", "POST", "/api/likedNotes",
+         json={"userId": _user(state, rng)["id"], "noteIds": note_ids})
+
+def add_comment(call, state, rng):
+    note_id = state.pick(rng, "notes")
+    user = _user(state, rng)
+    response = call("route_comment.add_comment", "POST", "/api/addComment", json={
+        "noteId": note_id, "userId": user["id"], "userName": user["name"],
+        "content": _text(rng, rng.randint(20, 400)),
+    })
+    if response.status_code == 201:
+        comment_id = response.get_json()["id"]
+        state.add("comments", (note_id, comment_id))
+        state.add("created_comments", (note_id, comment_id))
+
+def reply_comment(call, state, rng):
+    note_id, parent_id = state.pick(rng, "comments")
+    user = _user(state, rng)
+    response = call("route_comment.reply_comment", "POST", "/api/replyComment", json={
+        "noteId": note_id, "userId": user["id"], "userName": user["name"],
+        "parentId": parent_id, "content": _text(rng, rng.randint(20, 400)),
+    })
+    if response.status_code == 201:
+        state.add("comments", (note_id, response.get_json()["id"]))
+
+def update_comment(call, state, rng):
+    _, comment_id = state.pick(rng, "comments")
+    call("route_comment.update_comment", "PUT", f"/api/updateComment/{comment_id}",
+         json={"content": _text(rng, rng.randint(20, 400))})
+
+def delete_comment(call, state, rng):
+    item = state.take(rng, "created_comments")
+    if item is None:
+        return
+    with state._lock:
+        # El borrado se lleva el subárbol; basta con quitar la raíz de los objetivos
+        if item in state.comments:
+            state.comments.remove(item)
+    call("route_comment.delete_comment", "DELETE", f"/api/deleteComment/{item[1]}")
+
+def upload_blob(call, state, rng):
+    content = blob_content(rng, rng.randint(1024, 128 * 1024))
+    response = call("route_blob.upload_blob", "POST", "/api/blobs",
+                    data=content, content_type="application/octet-stream")
+    if response.status_code == 201:
+        state.add("blobs", response.get_json()["blobId"])
+
+def resumable_upload(call, state, rng):
+    content = blob_content(rng, rng.randint(64 * 1024, 512 * 1024))
+    response = call("route_blob.begin_upload", "POST", "/api/uploads",
+                    json={"contentType": "application/octet-stream", "size": len(content)})
+    if response.status_code != 201:
+        return
+    upload_id = response.get_json()["uploadId"]
+    chunk = 128 * 1024
+    for offset in range(0, len(content), chunk):
+        call("route_blob.append_upload", "PATCH", f"/api/uploads/{upload_id}",
+             data=content[offset:offset + chunk], headers={"Upload-Offset": str(offset)})
+    call("route_blob.get_upload", "GET", f"/api/uploads/{upload_id}")
+    response = call("route_blob.complete_upload", "POST", f"/api/uploads/{upload_id}/complete")
+    if response.status_code == 201:
+        state.add("blobs", response.get_json()["blobId"])
+
+def abort_upload(call, state, rng):
+    response = call("route_blob.begin_upload", "POST", "/api/uploads", json={})
+    if response.status_code == 201:
+        upload_id = response.get_json()["uploadId"]
+        call("route_blob.abort_upload", "DELETE", f"/api/uploads/{upload_id}")
+
+def download_blob(call, state, rng):
+    blob_id = state.pick(rng, "blobs")
+    headers = {"Range": "bytes=0-65535"} if rng.random() < 0.3 else {}
+    response = call("route_blob.download_blob", "GET", f"/api/blobs/{blob_id}", headers=headers)
+    response.close()
+
+def blob_info(call, state, rng):
+    call("route_blob.get_blob_info", "GET", f"/api/blobs/{state.pick(rng, 'blobs')}/info")
+
+def blob_thumbnail(call, state, rng):
+    call("route_blob.get_blob_thumbnail", "GET", f"/api/blobs/{state.pick(rng, 'blobs')}/thumbnail").close()
+
+def blob_preview(call, state, rng):
+    call("route_blob.get_blob_preview", "GET", f"/api/blobs/{state.pick(rng, 'blobs')}/preview").close()
+
+def add_note_file(call, state, rng):
+    note_id = state.pick(rng, "notes")
+    response = call("route_note.add_note_file", "POST", "/api/addNoteFile",
+                    json={"noteId": note_id, "blobId": state.pick(rng, "blobs")})
+    if response.status_code == 201:
+        state.add("files", response.get_json()["id"])
+        state.add("created_files", response.get_json()["id"])
+
+def delete_note_file(call, state, rng):
+    file_id = state.take(rng, "created_files")
+    if file_id is None:
+        return
+    with state._lock:
+        if file_id in state.files:
+            state.files.remove(file_id)
+    call("route_note.delete_note_file", "DELETE", f"/api/deleteNoteFile/{file_id}")
+
+def subscribe_events(call, state, rng):
+    # La app abre el flujo de cambios al arrancar; se lee el preámbulo y se cierra
+    response = call("route_events.subscribe_events", "GET", f"/api/events?userId={_user(state, rng)['id']}&public=1")
+    next(response.response, None)
+    response.close()
+
+def scrape_metrics(call, state, rng):
+    # Prometheus recoge las métricas cada pocos segundos
+    call("route_metrics.get_metrics", "GET", "/metrics")
+
+# Peso relativo de cada operación en la mezcla. El orden también es el de la
+# pasada de cobertura (cada operación una vez), así que las que crean objetivos
+# van antes que las que los consumen.
+PROFILE = [
+    (create_session, 1.0),
+    (validate_session, 4.0),
+    (public_notes, 14.0),
+    (trending_notes, 3.0),
+    (notes_by_user, 14.0),
+    (open_note, 12.0),
+    (comment_replies, 2.0),
+    (comment_by_id, 1.0),
+    (comments_by_user, 1.0),
+    (user_profile, 3.0),
+    (user_stats, 2.0),
+    (search_users, 2.0),
+    (users_by_name, 1.0),
+    (session_by_user, 1.0),
+    (like_note, 4.0),
+    (unlike_note, 1.5),
+    (liked_notes, 6.0),
+    (subscribe_events, 1.0),
+    (add_note, 3.0),
+    (update_note, 6.0),
+    (autosave_note, 1.0),
+    (sync_notes, 1.0),
+    (sync_batch, 0.5),
+    (bootstrap_device, 0.3),
+    (add_comment, 3.0),
+    (reply_comment, 2.0),
+    (update_comment, 1.0),
+    (upload_blob, 1.0),
+    (resumable_upload, 0.3),
+    (abort_upload, 0.1),
+    (download_blob, 3.0),
+    (blob_info, 1.0),
+    (blob_thumbnail, 1.0),
+    (blob_preview, 1.0),
+    (add_note_file, 1.0),
+    (delete_note_file, 0.3),
+    (delete_comment, 0.5),
+    (delete_note, 0.3),
+    (note_cleanup, 0.3),
+    (login, 0.3),
+    (logout, 0.2),
+    (register, 0.1),
+    (update_user, 0.3),
+    (delete_session, 0.2),
+    # Listados completos: caros y poco frecuentes (administración)
+    (all_users, 0.1),
+    (all_notes, 0.1),
+    (all_comments, 0.1),
+    (all_sessions, 0.1),
+    (scrape_metrics, 0.1),
+    (global_stats, 0.1),
+]
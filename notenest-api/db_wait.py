@@ -1,6 +1,12 @@
 import time
 import pymysql
 import os
+import sys
+
+# Con otra base de datos (p. ej. SQLite) no hay servidor al que esperar
+database_url = os.getenv("DATABASE_URL", "")
+if database_url and not database_url.startswith("mysql"):
+    sys.exit(0)
 
 host = os.getenv("DB_HOST", "localhost")
 port = int(os.getenv("DB_PORT", "3306"))